@@ -1,10 +1,13 @@
 import os
 import tempfile
 import shutil
+from typing import Dict, List
 
 import pytest
 from flask import Flask
 from flask.testing import FlaskClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 
 from smartsexplore import create_app
@@ -88,3 +91,74 @@ def full_client(full_app: Flask) -> FlaskClient:
     """
     with full_app.test_client() as client:
         yield client
+
+
+@pytest.fixture
+def fake_tools(app: Flask, tmp_path) -> Dict[str, str]:
+    """
+    A fixture that installs the fake external tools (see :mod:`tests.fake_tools`) into a
+    temporary directory, and configures the :func:`app` fixture to use them. Their behaviour can
+    be changed by setting environment variables, e.g. with ``monkeypatch.setenv``.
+
+    Yields a dictionary mapping the app config keys of the tool paths to the fake tools.
+    """
+    from tests.fake_tools import install_fake_tools
+    config = install_fake_tools(str(tmp_path / 'fake_tools'))
+    app.config.update(config)
+    yield config
+
+
+@pytest.fixture
+def fake_matcher(fake_tools) -> str:
+    """
+    A fixture to yield the path of the fake SMARTSMoleculeMatcher of the :func:`fake_tools`
+    fixture, which matches a SMARTS to a molecule if the SMARTS pattern is a substring of the
+    molecule pattern.
+    """
+    yield fake_tools['MATCHTOOL_PATH']
+
+
+@pytest.fixture
+def substring_smarts(session: Session) -> List:
+    """
+    A fixture to yield a few SMARTS stored in the :func:`session` database, whose patterns are
+    chosen so that the substring semantics of the :func:`fake_matcher` agree with RDKit.
+    """
+    from smartsexplore.database import SMARTS
+    smartss = [SMARTS(name=name, pattern=name, library='test') for name in ['C', 'N', 'CO', 'S']]
+    session.add_all(smartss)
+    session.commit()
+    yield smartss
+
+
+class QueryCounter:
+    """
+    A context manager that records the SQL statements executed by all SQLAlchemy engines while it
+    is active. An ``executemany`` (e.g., a bulk insert) counts as a single statement.
+    """
+    def __init__(self):
+        """The statements executed so far"""
+        self.statements: List[str] = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self) -> 'QueryCounter':
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self._before_cursor_execute)
+
+    def __len__(self) -> int:
+        return len(self.statements)
+
+
+@pytest.fixture
+def count_queries():
+    """
+    A fixture to yield :class:`QueryCounter`, to count the SQL statements executed within a
+    ``with count_queries() as queries:`` block, e.g. to check that a route does not execute one
+    query per row (N+1 queries).
+    """
+    yield QueryCounter
@@ -0,0 +1,264 @@
+"""
+Benchmarks the Python backend on synthetic databases of several sizes, writes the results to a
+.json file, and optionally compares them against a previously stored baseline to flag
+regressions.
+
+For each scale (number of directed edges), a temporary database with SMARTS, directed edges and
+a molecule set with matches is generated, and the following operations are timed:
+
+* ``from_db``: :func:`smartsexplore.smarts.to_json.from_db`
+* ``smarts_data``: The ``/smarts/data`` route
+* ``matches_for_molecule_set``: The ``/molecules/matches/<id>`` route
+* ``calculate_molecule_matches``: Ingesting a molecule set, including matching (RDKit backend by
+  default, see ``--backend``)
+* ``parse_smartscompare``, ``parse_moleculematch``, ``parse_smiles_stream``: The parsers, on
+  synthetic input of the same scale
+
+Usage::
+
+    python profiling/backend_benchmark.py --output baseline.json
+    # ... change the code ...
+    python profiling/backend_benchmark.py --output current.json --baseline baseline.json
+
+Exits with status 1 if any benchmark's median is slower than the baseline's by more than the
+tolerance (``--tolerance``, 20% by default).
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from smartsexplore import create_app  # noqa: E402
+from smartsexplore.database import init_db, get_db, get_session, SMARTS, DirectedEdge, \
+    MoleculeSet, Molecule, Match  # noqa: E402
+
+
+SMARTS_PATTERNS = ['C(=O)O', 'c1ccccc1', '[#7]C=O', 'CN', 'S(=O)(=O)', 'C#N', '[OH]c', 'C=C',
+                   'C(F)(F)F', '[Cl,Br,I]', 'N=N', 'OCC']
+MOLECULE_PATTERNS = ['CCO', 'c1ccccc1O', 'CC(=O)O', 'CN(C)C=O', 'CS(=O)(=O)N', 'N#CCC(F)(F)F',
+                     'C=CCBr', 'Oc1ccc(Cl)cc1', 'CCN=NC', 'OCCOC(=O)c1ccccc1']
+
+
+def _insert(engine, table, rows, batch_size=50000):
+    for start in range(0, len(rows), batch_size):
+        engine.execute(table.insert(), rows[start:start+batch_size])
+
+
+def generate_database(nof_edges: int, nof_molecules: int, seed: int = 0) -> int:
+    """
+    Fills the database of the current app with synthetic data: ``max(200, nof_edges // 100)``
+    SMARTS, ``nof_edges`` directed edges between them, and a molecule set of ``nof_molecules``
+    molecules with ``nof_edges`` matches in total.
+
+    Must be called from within a Flask appcontext.
+
+    :returns: The ID of the generated molecule set.
+    """
+    rng = random.Random(seed)
+    engine, _ = get_db()
+    nof_smarts = max(200, nof_edges // 100)
+
+    _insert(engine, SMARTS.__table__, [
+        {'id': i + 1, 'name': f'smarts{i}', 'pattern': SMARTS_PATTERNS[i % len(SMARTS_PATTERNS)],
+         'library': f'library{i % 10}'}
+        for i in range(nof_smarts)
+    ])
+    # edge k goes from SMARTS (k % n) to the SMARTS (k // n + 1) places after it, so all edges are
+    # unique as long as there are at most n * (n-1) of them
+    _insert(engine, DirectedEdge.__table__, [
+        {'from_id': k % nof_smarts + 1,
+         'to_id': (k % nof_smarts + k // nof_smarts + 1) % nof_smarts + 1,
+         'mcssim': rng.random(), 'spsim': rng.random()}
+        for k in range(nof_edges)
+    ])
+
+    _insert(engine, MoleculeSet.__table__, [{'id': 1, 'last_accessed': datetime.utcnow()}])
+    _insert(engine, Molecule.__table__, [
+        {'id': i + 1, 'name': f'mol{i}', 'molset_id': 1,
+         'pattern': MOLECULE_PATTERNS[i % len(MOLECULE_PATTERNS)]}
+        for i in range(nof_molecules)
+    ])
+    # matches (SMARTS j, molecule i) for all j, i with j * nof_molecules + i < nof_edges
+    _insert(engine, Match.__table__, [
+        {'smarts_id': k // nof_molecules % nof_smarts + 1, 'molecule_id': k % nof_molecules + 1}
+        for k in range(min(nof_edges, nof_smarts * nof_molecules))
+    ])
+    return 1
+
+
+def smartscompare_lines(nof_edges: int):
+    lines = ['SMARTScompare', '', "Mode: 'SubsetOfFirst'"]
+    lines.extend(f'C{"C" * (k % 5)}`({k} left)|(0.5,0.25)`N{"C" * (k % 3)}`({k + 1} right)'
+                 for k in range(nof_edges))
+    return lines
+
+
+def moleculematch_lines(nof_matches: int):
+    return [f'{k % 1000}\t{k}\n' for k in range(nof_matches)]
+
+
+def smiles_bytes(nof_molecules: int) -> bytes:
+    return ''.join(f'{MOLECULE_PATTERNS[i % len(MOLECULE_PATTERNS)]} mol{i}\n'
+                   for i in range(nof_molecules)).encode('utf-8')
+
+
+def measure(fn, repeats: int, setup=None, teardown=None) -> dict:
+    """
+    Runs ``fn`` ``repeats`` times, and returns the timings in milliseconds. ``setup`` and
+    ``teardown`` are run before and after each run, without being timed.
+    """
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+        if teardown is not None:
+            teardown()
+    return {
+        'min_ms': min(timings),
+        'median_ms': statistics.median(timings),
+        'mean_ms': statistics.mean(timings),
+        'runs_ms': timings
+    }
+
+
+def benchmark_scale(nof_edges: int, args) -> dict:
+    """
+    Generates a database with ``nof_edges`` edges and runs all benchmarks on it.
+
+    :returns: A dictionary mapping each benchmark name (suffixed with ``@nof_edges``) to its
+        timings, see :func:`measure`.
+    """
+    from smartsexplore.molecules.actions import calculate_molecule_matches
+    from smartsexplore.molecules.eviction import evict_molecule_sets
+    from smartsexplore.parsers import parse_smartscompare, parse_moleculematch, \
+        parse_smiles_stream
+    from smartsexplore.smarts import to_json
+
+    results = {}
+
+    def run(name, fn, **kwargs):
+        print(f'{name}@{nof_edges} ...', file=sys.stderr, end=' ', flush=True)
+        results[f'{name}@{nof_edges}'] = measure(fn, args.repeats, **kwargs)
+        print(f"{results[f'{name}@{nof_edges}']['median_ms']:.1f} ms", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as instance_path:
+        app = create_app({
+            'DATABASE': 'sqlite:///' + os.path.join(instance_path, 'db.sqlite'),
+            'MATCHING_BACKEND': args.backend,
+            'MATCH_STORAGE': args.match_storage
+        }, instance_path=instance_path)
+        with app.app_context():
+            init_db()
+            molset_id = generate_database(nof_edges, args.molecules)
+
+        def in_app_context(fn):
+            def wrapped():
+                with app.app_context():
+                    fn()
+            return wrapped
+
+        client = app.test_client()
+        run('from_db', in_app_context(lambda: to_json.from_db(0, 1)))
+        run('smarts_data', lambda: client.get('/smarts/data'))
+        run('matches_for_molecule_set', lambda: client.get(f'/molecules/matches/{molset_id}'))
+
+        if not args.skip_ingestion:
+            molecules = [(MOLECULE_PATTERNS[i % len(MOLECULE_PATTERNS)], f'mol{i}')
+                         for i in range(args.molecules)]
+            ingested = []
+
+            def evict():
+                with app.app_context():
+                    evict_molecule_sets(get_session(), ingested)
+                ingested.clear()
+
+            run('calculate_molecule_matches', in_app_context(
+                lambda: ingested.append(calculate_molecule_matches(molecules).id)
+            ), teardown=evict)
+
+    smartscompare = smartscompare_lines(nof_edges)
+    run('parse_smartscompare', lambda: sum(1 for _ in parse_smartscompare(smartscompare)))
+    moleculematch = moleculematch_lines(nof_edges)
+    run('parse_moleculematch', lambda: sum(1 for _ in parse_moleculematch(moleculematch)))
+    smiles = smiles_bytes(nof_edges)
+    run('parse_smiles_stream',
+        lambda: sum(1 for _ in parse_smiles_stream(io.BytesIO(smiles))))
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Prints a comparison of benchmark results against a baseline, by median.
+
+    :returns: The names of all benchmarks that are slower than the baseline by more than
+        ``tolerance`` (relative).
+    """
+    regressions = []
+    print(f'{"benchmark":<40} {"baseline ms":>12} {"current ms":>12} {"change":>8}')
+    for name, timings in results.items():
+        if name not in baseline:
+            print(f'{name:<40} {"-":>12} {timings["median_ms"]:>12.1f} {"new":>8}')
+            continue
+        before, after = baseline[name]['median_ms'], timings['median_ms']
+        change = after / before - 1 if before else 0.
+        flag = '  REGRESSION' if change > tolerance else ''
+        print(f'{name:<40} {before:>12.1f} {after:>12.1f} {change:>+8.1%}{flag}')
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--edges', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='The numbers of edges of the benchmarked databases.')
+    parser.add_argument('--molecules', type=int, default=200,
+                        help='The number of molecules per molecule set.')
+    parser.add_argument('--repeats', type=int, default=5, help='The number of runs per benchmark.')
+    parser.add_argument('--backend', default='rdkit',
+                        help='The matching backend for ingestion (MATCHING_BACKEND).')
+    parser.add_argument('--match-storage', default='rows',
+                        help='The match storage for ingestion (MATCH_STORAGE).')
+    parser.add_argument('--skip-ingestion', action='store_true',
+                        help='Do not benchmark calculate_molecule_matches.')
+    parser.add_argument('--output', default='backend_benchmark.json',
+                        help='The .json file to write the results to.')
+    parser.add_argument('--baseline', default=None,
+                        help='A .json file of previous results to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='The relative slowdown of a median that counts as a regression.')
+    args = parser.parse_args()
+
+    results = {}
+    for nof_edges in args.edges:
+        results.update(benchmark_scale(nof_edges, args))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'meta': {
+                'date': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'args': vars(args)
+            },
+            'benchmarks': results
+        }, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['benchmarks'], args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regressions: {", ".join(regressions)}')
+            sys.exit(1)
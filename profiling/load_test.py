@@ -0,0 +1,288 @@
+"""
+Load-tests the backend with concurrent scripted user sessions, and reports the throughput and
+latency percentiles (p50/p95/p99) per route and per concurrency level.
+
+Each simulated user repeatedly runs a session like the frontend does: it loads the graph
+(``POST /smarts/data``), hovers some nodes and edges (fetching their SVG images), uploads a small
+molecule set, fetches its matches and match counts, and the images of some matching molecules.
+
+By default, a local server is started in a separate process, with a synthetic database (see
+``backend_benchmark.py``) and the fake external tools of :mod:`tests.fake_tools` (configurable with
+their ``FAKE_TOOLS_*`` environment variables). Use ``--url`` to test a running server instead.
+
+Usage::
+
+    python profiling/load_test.py --concurrency 1 2 4 8 16 --duration 20 --output load.json
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from typing import Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from backend_benchmark import generate_database, MOLECULE_PATTERNS  # noqa: E402
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Does not follow redirects, so that the upload is timed separately from the matches."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+class Recorder:
+    """Collects the (route, latency in seconds, HTTP status) of all requests, thread-safely."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        """All recorded (route, latency in seconds, HTTP status) tuples"""
+        self.records = []
+
+    def request(self, base_url: str, route: str, path: str, data: bytes = None,
+                headers: dict = None):
+        """
+        Performs and records one request. Failed requests are recorded with their HTTP status,
+        or status 0 if no response was received.
+
+        :param route: The route the request is reported under, e.g. ``/smarts/smartsview/<id>``.
+        :returns: A tuple of (HTTP status, response headers, response body), or (0, {}, b'').
+        """
+        request = urllib.request.Request(base_url + path, data=data, headers=headers or {})
+        start = time.perf_counter()
+        try:
+            with _opener.open(request, timeout=60) as response:
+                result = response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            result = e.code, e.headers, e.read()
+        except OSError:
+            result = 0, {}, b''
+        with self.lock:
+            self.records.append((route, time.perf_counter() - start, result[0]))
+        return result
+
+
+def _multipart(filename: str, contents: bytes):
+    """:returns: A multipart/form-data body with one file in the field 'file', and its headers."""
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+            f'filename="{filename}"\r\nContent-Type: chemical/x-daylight-smiles\r\n\r\n'
+            ).encode('utf-8') + contents + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+def user_session(base_url: str, recorder: Recorder, rng: random.Random, args) -> None:
+    """Runs the requests of one scripted user session, see above."""
+    status, _, body = recorder.request(
+        base_url, '/smarts/data', '/smarts/data',
+        data=json.dumps({'spsim_min': 0, 'spsim_max': 1}).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}
+    )
+    if status != 200:
+        return
+    graph = json.loads(body)
+
+    for node in rng.sample(graph['nodes'], min(args.hovers, len(graph['nodes']))):
+        recorder.request(base_url, '/smarts/smartsview/<id>', f'/smarts/smartsview/{node["id"]}')
+    for edge in rng.sample(graph['edges'], min(args.hovers // 2, len(graph['edges']))):
+        recorder.request(base_url, '/smarts/smartssubsets/<id>',
+                         f'/smarts/smartssubsets/{edge["id"]}')
+
+    smiles = ''.join(f'{rng.choice(MOLECULE_PATTERNS)} mol{i}\n'
+                     for i in range(args.upload_molecules)).encode('utf-8')
+    status, headers, _ = recorder.request(base_url, '/molecules/upload', '/molecules/upload',
+                                          *_multipart('load_test.smi', smiles))
+    if status != 302:
+        return
+    molset_id = headers['Location'].rstrip('/').rsplit('/', 1)[-1]
+
+    status, _, body = recorder.request(base_url, '/molecules/matches/<id>',
+                                       f'/molecules/matches/{molset_id}')
+    recorder.request(base_url, '/molecules/matches/counts',
+                     f'/molecules/matches/counts?molsets={molset_id}')
+    if status == 200:
+        molecule_ids = sorted({match['molecule_id'] for match in json.loads(body)['matches']})
+        for molecule_id in rng.sample(molecule_ids, min(args.hovers, len(molecule_ids))):
+            recorder.request(base_url, '/molecules/images/<id>',
+                             f'/molecules/images/{molecule_id}')
+
+
+def run_level(base_url: str, concurrency: int, args) -> dict:
+    """
+    Runs ``concurrency`` simulated users for ``args.duration`` seconds.
+
+    :returns: The report of this concurrency level, see :func:`summarize`.
+    """
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+
+    def user(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            user_session(base_url, recorder, rng, args)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(recorder.records, time.perf_counter() - start)
+
+
+def _percentiles(latencies):
+    """:returns: The p50, p95 and p99 of a list of latencies, in milliseconds."""
+    if len(latencies) == 1:
+        return [latencies[0] * 1000] * 3
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return [quantiles[49] * 1000, quantiles[94] * 1000, quantiles[98] * 1000]
+
+
+def summarize(records, elapsed: float) -> dict:
+    """
+    :param records: The (route, latency in seconds, HTTP status) tuples of all requests.
+    :param elapsed: The wall time of the test, in seconds.
+    :returns: A dictionary with the overall throughput, number of requests and errors, and the
+        same plus latency percentiles per route (key ``routes``).
+    """
+    routes = {}
+    for route in sorted({route for route, _, _ in records}):
+        latencies = [latency for r, latency, _ in records if r == route]
+        errors = sum(1 for r, _, status in records if r == route and not 200 <= status < 400)
+        p50, p95, p99 = _percentiles(latencies)
+        routes[route] = {'requests': len(latencies), 'errors': errors,
+                         'throughput': len(latencies) / elapsed,
+                         'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+    return {
+        'requests': len(records),
+        'errors': sum(route['errors'] for route in routes.values()),
+        'throughput': len(records) / elapsed,
+        'elapsed_s': elapsed,
+        'routes': routes
+    }
+
+
+def print_report(report: dict) -> None:
+    for concurrency, level in report.items():
+        print(f'\nconcurrency {concurrency}: {level["requests"]} requests, '
+              f'{level["errors"]} errors, {level["throughput"]:.1f} requests/s')
+        print(f'{"route":<30} {"requests":>9} {"errors":>7} {"req/s":>8} '
+              f'{"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+        for route, stats in level['routes'].items():
+            print(f'{route:<30} {stats["requests"]:>9} {stats["errors"]:>7} '
+                  f'{stats["throughput"]:>8.1f} {stats["p50_ms"]:>9.1f} '
+                  f'{stats["p95_ms"]:>9.1f} {stats["p99_ms"]:>9.1f}')
+
+
+def _serve(instance_path: str, args, connection) -> None:
+    """
+    Runs the local server of :func:`start_local_server` in a child process: sets up the app with a
+    synthetic database, pre-rendered SMARTS and subset images, and the fake external tools, sends
+    the port it listens on through ``connection``, and serves requests until terminated.
+    """
+    from werkzeug.serving import make_server
+    from smartsexplore import create_app
+    from smartsexplore.database import init_db, get_session, SMARTS, DirectedEdge
+    from tests.fake_tools import install_fake_tools
+    from tests.fake_tools._common import FakeTool
+
+    config = {'DATABASE': 'sqlite:///' + os.path.join(instance_path, 'db.sqlite')}
+    config.update(install_fake_tools(os.path.join(instance_path, 'bin')))
+    app = create_app(config, instance_path=instance_path)
+
+    viewer = FakeTool('SMARTSCOMPARE_VIEWER')
+    with app.app_context():
+        init_db()
+        generate_database(args.edges, args.molecules)
+        session = get_session()
+        for output_path, ids in [
+            (app.config['STATIC_SMARTSVIEW_PATH'], session.query(SMARTS.id)),
+            (app.config['STATIC_SMARTSVIEW_SUBSETS_PATH'], session.query(DirectedEdge.id))
+        ]:
+            os.makedirs(output_path, exist_ok=True)
+            for id_, in ids:
+                with open(os.path.join(output_path, f'{id_}.svg'), 'w') as f:
+                    f.write(viewer.svg(str(id_)))
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    connection.send(server.server_port)  # the server socket is already listening
+    server.serve_forever()
+
+
+def start_local_server(instance_path: str, args,
+                       timeout: float = 600) -> Tuple[str, multiprocessing.Process]:
+    """
+    Starts the app on a free local port in a separate process (see :func:`_serve`), so that the
+    server does not share the GIL with the simulated users, and waits until it accepts requests.
+
+    :param instance_path: The instance folder of the app.
+    :param args: The command line arguments.
+    :param timeout: The maximum time to wait for the server to start, in seconds.
+    :returns: A tuple of the base URL of the server, and its process, which must be terminated.
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_serve, args=(instance_path, args, sender), daemon=True)
+    process.start()
+    sender.close()
+    deadline = time.monotonic() + timeout
+    while not receiver.poll(1):
+        if not process.is_alive() or time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError('The local server failed to start.')
+    return f'http://127.0.0.1:{receiver.recv()}', process
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default=None,
+                        help='The base URL of a running server. Starts a local server if not '
+                             'given.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='The numbers of concurrent users to test.')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='The duration of each concurrency level, in seconds.')
+    parser.add_argument('--hovers', type=int, default=10,
+                        help='The number of nodes (and molecules) whose images each session '
+                             'fetches.')
+    parser.add_argument('--upload-molecules', type=int, default=20,
+                        help='The number of molecules per uploaded molecule set.')
+    parser.add_argument('--edges', type=int, default=10000,
+                        help='The number of edges of the local server\'s database.')
+    parser.add_argument('--molecules', type=int, default=200,
+                        help='The number of molecules of the local server\'s molecule set.')
+    parser.add_argument('--output', default=None, help='A .json file to write the report to.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as instance_path:
+        base_url, server_process = (args.url, None) if args.url is not None \
+            else start_local_server(instance_path, args)
+        try:
+            report = {}
+            for concurrency in args.concurrency:
+                print(f'Running {concurrency} users for {args.duration} s ...', file=sys.stderr)
+                report[concurrency] = run_level(base_url, concurrency, args)
+        finally:
+            if server_process is not None:
+                server_process.terminate()
+                server_process.join()
+        print_report(report)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'levels': report}, f, indent=2)
@@ -0,0 +1,234 @@
+"""
+Benchmarks the offline database build pipeline (``flask smarts add_libraries``,
+``calculate_edges`` in both modes, ``draw_all_smarts`` and ``draw_all_subsets``) on generated SMARTS
+libraries of increasing size, and reports how each phase scales.
+
+The libraries are sampled from the SMARTS in ``data/*.smarts``. By default, the fake external
+tools of :mod:`tests.fake_tools` are used (configurable with their ``FAKE_TOOLS_*`` environment
+variables); use ``--real-tools`` to use the tools in ``bin/`` instead.
+
+Each phase runs in its own process, for which the following are recorded:
+
+* ``wall_s``, ``cpu_s``: The wall time and the CPU time (user + system, including the processes
+  it started, e.g. SMARTScompare)
+* ``peak_rss_mb``: The peak resident set size of the phase process, or of the largest process
+  it started
+* ``rows``, ``rows_per_s``: The number of created database rows or image files
+* ``output_bytes``: The growth of the database file, or the size of the written images
+
+Usage::
+
+    python profiling/pipeline_benchmark.py --sizes 50 100 200 400 --output pipeline.json
+
+The scaling report shows, per phase and between consecutive sizes, the exponent ``k`` of the
+wall time growth ``t ~ n^k`` in the number of SMARTS ``n``; phases with ``k`` > 1.2 are flagged
+as superlinear.
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from smartsexplore import create_app  # noqa: E402
+
+
+"""The phases of the pipeline, as (name, flask command arguments)"""
+PHASES = [
+    ('add_libraries', ['smarts', 'add_libraries']),  # + the library files
+    ('calculate_edges_subset', ['smarts', 'calculate_edges', 'SubsetOfFirst']),
+    ('calculate_edges_similarity', ['smarts', 'calculate_edges', 'Similarity']),
+    ('draw_all_smarts', ['smarts', 'draw_all_smarts']),
+    ('draw_all_subsets', ['smarts', 'draw_all_subsets']),
+]
+
+
+def generate_libraries(directory: str, nof_smarts: int, nof_libraries: int, seed: int = 0):
+    """
+    Writes ``nof_libraries`` .smarts files with ``nof_smarts`` SMARTS in total, sampled from the
+    SMARTS in ``data/*.smarts``.
+
+    :returns: The paths of the written files.
+    """
+    patterns = []
+    for filename in sorted(glob.glob(os.path.join(ROOT, 'data', '*.smarts'))):
+        with open(filename) as f:
+            patterns.extend(line.split()[0] for line in f
+                            if line.strip() and not line.startswith('#'))
+    rng = random.Random(seed)
+    sample = [rng.choice(patterns) for _ in range(nof_smarts)]
+
+    filenames = []
+    for i in range(nof_libraries):
+        filename = os.path.join(directory, f'library{i}.smarts')
+        with open(filename, 'w') as f:
+            f.writelines(f'{pattern} smarts{j}\n'
+                         for j, pattern in enumerate(sample[i::nof_libraries]))
+        filenames.append(filename)
+    return filenames
+
+
+def _directory_size(path: str):
+    """:returns: The number of files in a directory, and their total size in bytes."""
+    sizes = [entry.stat().st_size for entry in os.scandir(path) if entry.is_file()] \
+        if os.path.isdir(path) else []
+    return len(sizes), sum(sizes)
+
+
+def _count_rows(app, phase: str) -> int:
+    from smartsexplore.database import get_session, SMARTS, DirectedEdge, UndirectedEdge
+    model = {'add_libraries': SMARTS, 'calculate_edges_subset': DirectedEdge,
+             'calculate_edges_similarity': UndirectedEdge}[phase]
+    with app.app_context():
+        return get_session().query(model).count()
+
+
+def measure_phase(app, phase: str, instance_path: str, args) -> dict:
+    """
+    Runs one phase in a child process (see :func:`run_phase`), and measures it.
+    """
+    database_filename = os.path.join(instance_path, 'db.sqlite')
+    output_dir = {'draw_all_smarts': app.config['STATIC_SMARTSVIEW_PATH'],
+                  'draw_all_subsets': app.config['STATIC_SMARTSVIEW_SUBSETS_PATH']}.get(phase)
+    rows_before = _count_rows(app, phase) if output_dir is None else 0
+    size_before = os.path.getsize(database_filename)
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run-phase', phase,
+                                '--instance', instance_path, *args])
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f'Phase {phase} failed with exit code {process.returncode}')
+
+    if output_dir is None:
+        rows = _count_rows(app, phase) - rows_before
+        output_bytes = os.path.getsize(database_filename) - size_before
+    else:
+        rows, output_bytes = _directory_size(output_dir)
+    return {
+        'wall_s': wall,
+        'cpu_s': rusage.ru_utime + rusage.ru_stime,
+        'peak_rss_mb': rusage.ru_maxrss / 1024,
+        'rows': rows,
+        'rows_per_s': rows / wall if wall else 0.,
+        'output_bytes': output_bytes
+    }
+
+
+def run_phase(phase: str, instance_path: str, library_filenames) -> None:
+    """
+    Runs one phase of the pipeline in this process, as a flask command of an app using the
+    instance directory (and its config.py).
+    """
+    import io
+    from flask.cli import ScriptInfo
+
+    app = create_app(instance_path=instance_path)
+    command = dict(PHASES)[phase]
+    if phase == 'add_libraries':
+        command = command + list(library_filenames)
+        sys.stdin = io.StringIO('y\n')  # confirm the library names
+    app.cli.main(args=command, obj=ScriptInfo(create_app=lambda: app), standalone_mode=False)
+
+
+def benchmark_size(nof_smarts: int, args) -> dict:
+    """
+    Runs all phases on a new database and generated libraries with ``nof_smarts`` SMARTS.
+
+    :returns: A dictionary mapping each phase name to its measurements.
+    """
+    from smartsexplore.database import init_db
+
+    with tempfile.TemporaryDirectory() as instance_path:
+        config = {'DATABASE': 'sqlite:///' + os.path.join(instance_path, 'db.sqlite')}
+        if not args.real_tools:
+            from tests.fake_tools import install_fake_tools
+            config.update(install_fake_tools(os.path.join(instance_path, 'bin')))
+        with open(os.path.join(instance_path, 'config.py'), 'w') as f:
+            f.writelines(f'{key} = {value!r}\n' for key, value in config.items())
+
+        app = create_app(instance_path=instance_path)
+        with app.app_context():
+            init_db()
+        library_filenames = generate_libraries(instance_path, nof_smarts, args.libraries)
+
+        results = {}
+        for phase, _ in PHASES:
+            print(f'{nof_smarts} SMARTS: {phase} ...', file=sys.stderr, end=' ', flush=True)
+            results[phase] = measure_phase(
+                app, phase, instance_path, library_filenames if phase == 'add_libraries' else []
+            )
+            print(f"{results[phase]['wall_s']:.2f} s", file=sys.stderr)
+        return results
+
+
+def scaling_report(results: dict, threshold: float = 1.2) -> list:
+    """
+    Prints, per phase, the measurements at each size and the scaling exponents between
+    consecutive sizes.
+
+    :param results: A dictionary mapping each number of SMARTS to the results of
+        :func:`benchmark_size`.
+    :param threshold: The exponent above which a phase is flagged as superlinear.
+    :returns: A list of (phase, smaller size, larger size, exponent) for each superlinear step.
+    """
+    superlinear = []
+    sizes = sorted(results)
+    for phase, _ in PHASES:
+        print(f'\n{phase}')
+        print(f'{"SMARTS":>8} {"wall s":>9} {"cpu s":>9} {"peak MB":>9} {"rows":>10} '
+              f'{"rows/s":>10} {"out bytes":>12} {"exponent":>9}')
+        for i, size in enumerate(sizes):
+            measurements = results[size][phase]
+            exponent = ''
+            if i > 0 and results[sizes[i-1]][phase]['wall_s'] > 0:
+                k = math.log(measurements['wall_s'] / results[sizes[i-1]][phase]['wall_s']) \
+                    / math.log(size / sizes[i-1])
+                exponent = f'{k:.2f}' + (' !' if k > threshold else '')
+                if k > threshold:
+                    superlinear.append((phase, sizes[i-1], size, k))
+            print(f'{size:>8} {measurements["wall_s"]:>9.2f} {measurements["cpu_s"]:>9.2f} '
+                  f'{measurements["peak_rss_mb"]:>9.1f} {measurements["rows"]:>10} '
+                  f'{measurements["rows_per_s"]:>10.0f} {measurements["output_bytes"]:>12} '
+                  f'{exponent:>9}')
+    if superlinear:
+        print('\nSuperlinear (t ~ n^k, k > {:.1f}):'.format(threshold))
+        for phase, smaller, larger, k in superlinear:
+            print(f'  {phase}: {smaller} -> {larger} SMARTS, k = {k:.2f}')
+    return superlinear
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200, 400],
+                        help='The total numbers of SMARTS of the generated libraries.')
+    parser.add_argument('--libraries', type=int, default=4,
+                        help='The number of libraries to split the SMARTS into.')
+    parser.add_argument('--real-tools', action='store_true',
+                        help='Use the external tools configured by default, not the fake ones.')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='The scaling exponent above which a phase counts as superlinear.')
+    parser.add_argument('--output', default='pipeline_benchmark.json',
+                        help='The .json file to write the results to.')
+    parser.add_argument('--run-phase', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--instance', default=None, help=argparse.SUPPRESS)
+    args, rest = parser.parse_known_args()
+
+    if args.run_phase is not None:
+        run_phase(args.run_phase, args.instance, rest)
+        sys.exit(0)
+
+    results = {size: benchmark_size(size, args) for size in args.sizes}
+    scaling_report(results, args.threshold)
+    with open(args.output, 'w') as f:
+        json.dump({'args': vars(args), 'results': results}, f, indent=2)
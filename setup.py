@@ -44,6 +44,7 @@ setup(
         'tqdm==4.51.0',             # for progress bars of backend management commands
 
         'sqlalchemy==1.3.20',       # our database layer
+        'numpy>=1.19',              # for vectorized pre-screening of molecule matches
 
         'pytest==6.2.2',            # our testing framework
         'pytest-cov==2.11.1',       # for generating coverage from pytest
@@ -55,6 +56,9 @@ setup(
                                     # this is an officially inexistent version, to force setuptools
                                     # to use our own fork of the package (see dependency_links)
     ],
+    extras_require={
+        'rdkit': ['rdkit']          # for the optional in-process SMARTS matching backend
+    },
     dependency_links=[
         'git+https://github.com/cobalamin/sphinx-js.git@0.0.1337#egg=sphinx-js-0.0.1337'
     ],
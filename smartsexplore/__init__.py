@@ -4,7 +4,8 @@ from flask import Flask
 from flask import render_template
 from flask_compress import Compress
 
-__all__ = ['database', 'molecules', 'parsers', 'util', 'create_app']
+__all__ = ['database', 'metrics', 'molecules', 'parsers', 'profiler', 'timing', 'util',
+           'create_app']
 
 
 def create_app(test_config=None, instance_path=None) -> Flask:
@@ -25,10 +26,39 @@ def create_app(test_config=None, instance_path=None) -> Flask:
         SMARTSCOMPARE_PATH=os.path.join(app.root_path, '..', 'bin', 'SMARTScompare'),
         SMARTSCOMPARE_VIEWER_PATH=os.path.join(app.root_path, '..', 'bin', 'SMARTScompareViewer'),
         MATCHTOOL_PATH=os.path.join(app.root_path, '..', 'bin', 'SMARTSMoleculeMatcher'),
+        MATCHTOOL_CHUNK_SIZE=250,
+        MATCHTOOL_MAX_WORKERS=None,
+        MATCHING_BACKEND='external',  # or 'rdkit', see smartsexplore.molecules.matching
+        MATCHING_HIERARCHY_PRUNING=False,  # only supported by the 'rdkit' matching backend
+        MATCHING_PRESCREEN=False,  # see smartsexplore.molecules.prescreen
+        MATCH_STORAGE='rows',  # or 'bitmap', see smartsexplore.molecules.actions.store_matches
         MOL2SVG_PATH=os.path.join(app.root_path, '..', 'bin', 'mol2svg'),
+        MOL2SVG_CHUNK_SIZE=50,
+        MOL2SVG_MAX_WORKERS=None,
 
         ALLOWED_MOLECULE_SET_EXTENSIONS=['smi', 'smiles'],
-        MAX_UPLOADED_MOLECULE_NUMBER=250,
+        MAX_UPLOADED_MOLECULE_NUMBER=None,  # None: one chunk per matcher worker, see below
+        MAX_UPLOADED_MOLECULE_FILE_SIZE=None,  # bytes; None: 1 KiB per molecule, see below
+        MAX_IMAGE_BATCH_SIZE=100,
+        MAX_MATCHES_PAGE_SIZE=1000,
+        MATCH_COUNTS_CACHE_SIZE=128,  # nof. molecule sets, see molecules.actions.match_counts
+        MOLECULE_SET_TTL=None,  # seconds, see smartsexplore.molecules.eviction
+        MOLECULE_SET_BUDGET=None,  # nof. molecules, see smartsexplore.molecules.eviction
+        MOLECULE_SET_GC_INTERVAL=None,  # seconds, see smartsexplore.molecules.eviction
+
+        SLOW_QUERY_THRESHOLD=None,  # seconds, see smartsexplore.database.slow_queries
+        SLOW_QUERY_LOG=os.path.join(app.instance_path, 'slow_queries.jsonl'),
+        SERVER_TIMING=True,  # see smartsexplore.timing
+        METRICS=True,  # see smartsexplore.metrics
+        METRICS_ALLOWED_ADDRESSES=['127.0.0.1', '::1'],  # None: all addresses
+        METRICS_MULTIPROCESS_DIR=None,  # shared by all worker processes, see smartsexplore.metrics
+        PROFILER=False,  # profile single requests on demand, see smartsexplore.profiler
+        PROFILER_ALLOWED_ADDRESSES=['127.0.0.1', '::1'],  # None: all; see PROFILER_TOKEN
+        PROFILER_TOKEN=None,  # secret to trigger the profiler with, e.g. behind a reverse proxy
+        PROFILER_BACKEND='auto',  # or 'cprofile' or 'pyinstrument'
+        PROFILER_DIR=os.path.join(app.instance_path, 'profiles'),
+
+        SMARTS_EXPORT_PATH=os.path.join(app.instance_path, 'smarts_export'),
 
         STATIC_SMARTSVIEW_PATH=os.path.join(app.instance_path, 'static', 'smartsview'),
         STATIC_SMARTSVIEW_SUBSETS_PATH=os.path.join(app.instance_path, 'static', 'smartssubsets'),
@@ -38,9 +68,27 @@ def create_app(test_config=None, instance_path=None) -> Flask:
         app.config.from_pyfile('config.py', silent=True)
     else:
         app.config.from_mapping(test_config)
+    if app.config['MAX_UPLOADED_MOLECULE_NUMBER'] is None:
+        app.config['MAX_UPLOADED_MOLECULE_NUMBER'] = app.config['MATCHTOOL_CHUNK_SIZE'] *\
+            (app.config['MATCHTOOL_MAX_WORKERS'] or os.cpu_count() or 1)
+    if app.config['MAX_UPLOADED_MOLECULE_FILE_SIZE'] is None:
+        app.config['MAX_UPLOADED_MOLECULE_FILE_SIZE'] = \
+            app.config['MAX_UPLOADED_MOLECULE_NUMBER'] * 1024
+    if app.config['MAX_CONTENT_LENGTH'] is None:
+        # lets werkzeug reject too large requests before parsing them, see upload_molecule_set
+        from smartsexplore.molecules.routes import MULTIPART_OVERHEAD
+        app.config['MAX_CONTENT_LENGTH'] = \
+            app.config['MAX_UPLOADED_MOLECULE_FILE_SIZE'] + MULTIPART_OVERHEAD
+
+    # Metrics and request phase timing via the Server-Timing header; set up before compression,
+    # so that both include the compression time
+    from smartsexplore import metrics, timing
+    metrics.init_app(app)
+    timing.init_app(app)
 
     # Add compression via flask-compress
     compress = Compress()
+    compress.after_request = timing.timed('compress')(compress.after_request)
     compress.init_app(app)
 
     # App instance folder creation (if not present)
@@ -60,7 +108,13 @@ def create_app(test_config=None, instance_path=None) -> Flask:
 
     # Molecules setup
     from smartsexplore.molecules import bp as molecules_blueprint
+    from smartsexplore.molecules.eviction import start_sweeper
     app.register_blueprint(molecules_blueprint)
+    start_sweeper(app)
+
+    # On-demand profiling of single requests; wraps the whole WSGI app
+    from smartsexplore import profiler
+    profiler.init_app(app)
 
     # Routing setup
     @app.route('/')
@@ -0,0 +1,209 @@
+"""
+A compact in-memory representation of molecule-SMARTS matches as a bitmap, with one row per
+molecule and one column per SMARTS, and its compressed serialization for storage in the database
+(see :class:`smartsexplore.database.MoleculeSetMatches`).
+"""
+import functools
+import zlib
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+
+def _compress_ids(ids: np.ndarray) -> bytes:
+    """Compresses a sorted array of IDs, delta-encoded since IDs are mostly consecutive."""
+    return zlib.compress(np.diff(ids, prepend=0).astype('<i8').tobytes())
+
+
+def _decompress_ids(data: bytes) -> np.ndarray:
+    """Decompresses an array of IDs compressed by :func:`_compress_ids`."""
+    return np.cumsum(np.frombuffer(zlib.decompress(data), dtype='<i8')).astype(np.int64)
+
+
+class MatchBitmap:
+    """
+    The matches of a set of molecules against a set of SMARTS, as a bit-packed matrix with one row
+    per molecule and one column per SMARTS. Rows and columns are ordered by ascending ID.
+
+    Supports looking up the matches of a molecule or of a SMARTS without decompressing the whole
+    matrix, and, via :func:`smarts_matching_any` and :func:`smarts_matching_all`, unions and
+    intersections of the matching SMARTS of several bitmaps (i.e., molecule sets).
+    """
+
+    def __init__(self, molecule_ids: Sequence[int], smarts_ids: Sequence[int],
+                 packed: np.ndarray = None):
+        """
+        :param molecule_ids: The sorted, unique IDs of the molecules (rows).
+        :param smarts_ids: The sorted, unique IDs of the SMARTS (columns).
+        :param packed: The bit-packed matrix as a uint8 array of shape
+            (nof. molecules, ceil(nof. SMARTS / 8)), as created by ``numpy.packbits(..., axis=1)``.
+            Defaults to a matrix without any matches.
+        """
+        """The IDs of the molecules (rows)"""
+        self.molecule_ids = np.asarray(molecule_ids, dtype=np.int64)
+        """The IDs of the SMARTS (columns)"""
+        self.smarts_ids = np.asarray(smarts_ids, dtype=np.int64)
+        nof_bytes = (len(self.smarts_ids) + 7) // 8
+        if packed is None:
+            packed = np.zeros((len(self.molecule_ids), nof_bytes), dtype=np.uint8)
+        """The bit-packed matrix"""
+        self.packed = packed.reshape(len(self.molecule_ids), nof_bytes)
+
+    @classmethod
+    def from_matches(cls, molecule_ids: Sequence[int], smarts_ids: Sequence[int],
+                     matches: Iterable[Tuple[int, int]]) -> 'MatchBitmap':
+        """
+        Creates a bitmap from (SMARTS ID, molecule ID) matches, e.g. as yielded by
+        :func:`smartsexplore.molecules.matching.match_molecules`.
+
+        :param molecule_ids: The IDs of all matched molecules.
+        :param smarts_ids: The IDs of all SMARTS matched against.
+        :param matches: An iterable of (SMARTS ID, molecule ID) tuples. Matches of molecules or
+            SMARTS that are not in ``molecule_ids`` or ``smarts_ids`` are ignored.
+        """
+        bitmap = cls(np.unique(molecule_ids), np.unique(smarts_ids))
+        pairs = np.fromiter((i for match in matches for i in match), dtype=np.int64)
+        bitmap._set(pairs[1::2], pairs[0::2])
+        return bitmap
+
+    def _set(self, molecule_ids: np.ndarray, smarts_ids: np.ndarray) -> None:
+        """Sets the bits of all given (molecule ID, SMARTS ID) pairs that are in this bitmap."""
+        rows = np.searchsorted(self.molecule_ids, molecule_ids)
+        columns = np.searchsorted(self.smarts_ids, smarts_ids)
+        valid = (rows < len(self.molecule_ids)) & (columns < len(self.smarts_ids))
+        rows, columns = rows[valid], columns[valid]
+        valid = (self.molecule_ids[rows] == molecule_ids[valid]) \
+            & (self.smarts_ids[columns] == smarts_ids[valid])
+        rows, columns = rows[valid], columns[valid]
+        np.bitwise_or.at(self.packed, (rows, columns >> 3),
+                         (0x80 >> (columns & 7)).astype(np.uint8))
+
+    def __len__(self) -> int:
+        """The number of matches."""
+        return int(np.unpackbits(self.packed).sum()) if self.packed.size else 0
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MatchBitmap) and set(self.matches()) == set(other.matches())
+
+    def __repr__(self):
+        return f"<MatchBitmap({len(self.molecule_ids)} molecules x {len(self.smarts_ids)} "\
+               f"SMARTS, {len(self)} matches)>"
+
+    def smarts_for_molecule(self, molecule_id: int) -> List[int]:
+        """
+        :returns: The sorted IDs of all SMARTS matching the molecule with the given ID.
+        """
+        row = np.searchsorted(self.molecule_ids, molecule_id)
+        if row >= len(self.molecule_ids) or self.molecule_ids[row] != molecule_id:
+            return []
+        bits = np.unpackbits(self.packed[row], count=len(self.smarts_ids)).astype(bool)
+        return self.smarts_ids[bits].tolist()
+
+    def molecules_for_smarts(self, smarts_id: int) -> List[int]:
+        """
+        :returns: The sorted IDs of all molecules matched by the SMARTS with the given ID.
+        """
+        column = np.searchsorted(self.smarts_ids, smarts_id)
+        if column >= len(self.smarts_ids) or self.smarts_ids[column] != smarts_id:
+            return []
+        bits = (self.packed[:, column >> 3] >> (7 - (column & 7))) & 1
+        return self.molecule_ids[bits.astype(bool)].tolist()
+
+    def smarts_counts(self, block_size: int = 4096) -> Dict[int, int]:
+        """
+        Counts the matching molecules of each SMARTS, unpacking the matrix in blocks of
+        ``block_size`` rows.
+
+        :returns: A dictionary mapping the ID of each SMARTS with at least one match to its number
+            of matching molecules.
+        """
+        counts = np.zeros(len(self.smarts_ids), dtype=np.int64)
+        for start in range(0, len(self.molecule_ids), block_size):
+            counts += np.unpackbits(self.packed[start:start+block_size], axis=1,
+                                    count=len(self.smarts_ids)).sum(axis=0, dtype=np.int64)
+        nonzero = np.nonzero(counts)[0]
+        return dict(zip(self.smarts_ids[nonzero].tolist(), counts[nonzero].tolist()))
+
+    def matches(self, block_size: int = 4096) -> Iterator[Tuple[int, int]]:
+        """
+        Iterates over all matches, ordered by molecule ID and then SMARTS ID. Unpacks the matrix in
+        blocks of ``block_size`` rows, so that it is never held in memory completely unpacked.
+
+        :returns: An iterator over (SMARTS ID, molecule ID) tuples.
+        """
+        for start in range(0, len(self.molecule_ids), block_size):
+            block = np.unpackbits(self.packed[start:start+block_size], axis=1,
+                                  count=len(self.smarts_ids))
+            rows, columns = np.nonzero(block)
+            yield from zip(self.smarts_ids[columns].tolist(),
+                           self.molecule_ids[start + rows].tolist())
+
+    def matched_smarts(self) -> np.ndarray:
+        """
+        :returns: A boolean vector over :attr:`smarts_ids`, which is set for each SMARTS that
+            matches any molecule.
+        """
+        return np.unpackbits(np.bitwise_or.reduce(self.packed, axis=0),
+                             count=len(self.smarts_ids)).astype(bool)
+
+    def _packed_matched_smarts(self, smarts_ids: np.ndarray) -> np.ndarray:
+        """
+        :param smarts_ids: Sorted, unique SMARTS IDs including all of :attr:`smarts_ids`.
+        :returns: :meth:`matched_smarts` re-indexed to ``smarts_ids``, bit-packed.
+        """
+        bits = np.zeros(len(smarts_ids), dtype=bool)
+        bits[np.searchsorted(smarts_ids, self.smarts_ids)] = self.matched_smarts()
+        return np.packbits(bits)
+
+    def to_columns(self) -> Dict[str, bytes]:
+        """
+        Serializes this bitmap into compressed binary data.
+
+        :returns: A dictionary with the compressed ``molecule_ids``, ``smarts_ids`` and ``bits``.
+        """
+        return {
+            'molecule_ids': _compress_ids(self.molecule_ids),
+            'smarts_ids': _compress_ids(self.smarts_ids),
+            'bits': zlib.compress(self.packed.tobytes())
+        }
+
+    @classmethod
+    def from_columns(cls, molecule_ids: bytes, smarts_ids: bytes, bits: bytes) -> 'MatchBitmap':
+        """
+        Deserializes a bitmap serialized by :meth:`to_columns`.
+        """
+        return cls(_decompress_ids(molecule_ids), _decompress_ids(smarts_ids),
+                   np.frombuffer(zlib.decompress(bits), dtype=np.uint8).copy())
+
+
+def _combine_matched_smarts(bitmaps: Iterable[MatchBitmap], operation: np.ufunc) -> List[int]:
+    """
+    Combines the bit-packed :meth:`MatchBitmap.matched_smarts` vectors of bitmaps with a bitwise
+    operation, after aligning them to the union of their SMARTS IDs.
+
+    :returns: The sorted IDs of the SMARTS whose combined bit is set.
+    """
+    bitmaps = list(bitmaps)
+    if not bitmaps:
+        return []
+    smarts_ids = functools.reduce(np.union1d, (bitmap.smarts_ids for bitmap in bitmaps))
+    combined = operation.reduce([bitmap._packed_matched_smarts(smarts_ids) for bitmap in bitmaps])
+    return smarts_ids[np.unpackbits(combined, count=len(smarts_ids)).astype(bool)].tolist()
+
+
+def smarts_matching_any(bitmaps: Iterable[MatchBitmap]) -> List[int]:
+    """
+    :param bitmaps: The match bitmaps of several molecule sets.
+    :returns: The sorted IDs of the SMARTS that match any molecule of at least one of the molecule
+        sets (the union of their matching SMARTS).
+    """
+    return _combine_matched_smarts(bitmaps, np.bitwise_or)
+
+
+def smarts_matching_all(bitmaps: Iterable[MatchBitmap]) -> List[int]:
+    """
+    :param bitmaps: The match bitmaps of several molecule sets.
+    :returns: The sorted IDs of the SMARTS that match some molecule of each of the molecule sets
+        (the intersection of their matching SMARTS).
+    """
+    return _combine_matched_smarts(bitmaps, np.bitwise_and)
@@ -15,6 +15,7 @@ def attach_to_blueprint(blueprint: Blueprint):
     :param blueprint: The blueprint object to attach the commands to.
     """
     blueprint.cli.command('init')(init_db_command)
+    blueprint.cli.command('slow_queries')(slow_queries_command)
 
 
 @with_appcontext
@@ -25,3 +26,38 @@ def init_db_command():
     from smartsexplore.database.util import init_db
     init_db()
     click.echo("Initialized the database.")
+
+
+@click.option('--top', type=int, default=10, show_default=True,
+              help='The number of statements to show.')
+@click.option('--sort', type=click.Choice(['total', 'max', 'count']), default='total',
+              show_default=True, help='Sort by total or maximum duration, or by count.')
+@click.option('--log', 'log_filename', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='The slow-query log file. Defaults to the SLOW_QUERY_LOG config value.')
+@with_appcontext
+def slow_queries_command(top, sort, log_filename):
+    """
+    Summarize the slow-query log by normalized statement: the top N statements by total or
+    maximum duration or by count, with the routes or commands that executed them and the query
+    plan of their slowest execution. Requires SLOW_QUERY_THRESHOLD to be set while the server runs.
+    """
+    import os
+    from flask import current_app
+    from smartsexplore.database.slow_queries import read_slow_query_log, summarize_slow_queries
+
+    log_filename = log_filename or current_app.config['SLOW_QUERY_LOG']
+    if not os.path.isfile(log_filename):
+        raise click.ClickException(f'No slow-query log at {log_filename}. '
+                                   f'Set SLOW_QUERY_THRESHOLD to record one.')
+
+    for rank, group in enumerate(summarize_slow_queries(read_slow_query_log(log_filename),
+                                                        top, sort), 1):
+        click.echo(f"#{rank}: {group['count']}x, total {group['total'] * 1000:.1f} ms, "
+                   f"max {group['max'] * 1000:.1f} ms, mean {group['mean'] * 1000:.1f} ms")
+        click.echo(f"  {group['normalized']}")
+        click.echo('  from: ' + ', '.join(f'{context} ({count}x)' for context, count in
+                                           sorted(group['contexts'].items(),
+                                                  key=lambda item: -item[1])))
+        for detail in group['plan'] or []:
+            click.echo(f'  plan: {detail}' + ('  <-- full scan' if detail.startswith('SCAN')
+                                              and 'INDEX' not in detail else ''))
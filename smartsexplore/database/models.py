@@ -2,9 +2,13 @@
 Defines all relevant models for SMARTSexplore, as SQLAlchemy ORM models.
 """
 
+from datetime import datetime
+from typing import Dict, List
+
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy import ForeignKey, Column, Integer, String, Float, UniqueConstraint
+from sqlalchemy import ForeignKey, Column, DateTime, Index, Integer, String, Float, LargeBinary, \
+    UniqueConstraint
 
 
 """The SQLAlchemy declarative_base instance that all SMARTSexplore models derive from"""
@@ -20,14 +24,24 @@ class MoleculeSet(Base):
     by a frontend user.
     """
     __tablename__ = 'molecule_sets'
+    # IDs of deleted (e.g., evicted) molecule sets must not be reused by SQLite, since other
+    # processes may still cache data by molecule set ID, see molecules.actions.match_counts
+    __table_args__ = {'sqlite_autoincrement': True}
 
     """The integer ID (primary key) of the molecule set."""
     id = Column(Integer, primary_key=True)
+    """When the molecule set or its matches were last accessed (UTC), for garbage collection."""
+    last_accessed = Column(DateTime, default=datetime.utcnow, index=True)
     """The Molecule instances belonging to this molecule set."""
     molecules = relationship(
         'Molecule', back_populates='molset',
         cascade="all, delete, delete-orphan"
     )
+    """The matches of this molecule set as a compressed bitmap, if they are stored as one."""
+    match_bitmap = relationship(
+        'MoleculeSetMatches', uselist=False, back_populates='molset',
+        cascade="all, delete, delete-orphan"
+    )
 
     def __repr__(self):
         return f"<MoleculeSet ({self.id})>"
@@ -47,7 +61,7 @@ class Molecule(Base):
     """The name of the molecule."""
     name = Column(String)
     """The ID of the MoleculeSet this molecule belongs to."""
-    molset_id = Column(Integer, ForeignKey('molecule_sets.id'), nullable=False)
+    molset_id = Column(Integer, ForeignKey('molecule_sets.id'), nullable=False, index=True)
     """The MoleculeSet this molecule belongs to."""
     molset = relationship('MoleculeSet', foreign_keys=[molset_id], back_populates='molecules')
 
@@ -89,6 +103,22 @@ class SMARTS(Base):
         return f"<SMARTS({self.id}, name='{self.name}', pattern='{pattern}')>"
 
 
+class SMARTSSetVersion(Base):
+    """
+    A single row holding a counter that is incremented by every flush adding, changing or removing
+    :class:`SMARTS`, see :func:`smartsexplore.database.get_smarts_set_version`.
+    """
+    __tablename__ = 'smarts_set_version'
+
+    """The ID of the (single) row."""
+    id = Column(Integer, primary_key=True)
+    """The number of flushes that changed the SMARTS so far."""
+    version = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SMARTSSetVersion({self.version})>"
+
+
 class UndirectedEdge(Base):
     """
     An undirected edge between two :class:`SMARTS`, describing a **similarity** relationship as
@@ -194,6 +224,9 @@ class Match(Base):
     __tablename__ = 'molecule_smarts_matches'
     __table_args__ = (
         UniqueConstraint('molecule_id', 'smarts_id', name='_unique_molecule_smarts'),
+        # for looking up the molecules matching a SMARTS, see
+        # smartsexplore.molecules.actions.molecules_matching_smarts
+        Index('ix_molecule_smarts_matches_smarts_id', 'smarts_id', 'molecule_id'),
     )
 
     """The unique ID of this SMARTS--Molecule match."""
@@ -220,3 +253,76 @@ class Match(Base):
         self.smarts = smarts
 
 
+class MoleculeSetMatches(Base):
+    """
+    All matches of the molecules of a :class:`MoleculeSet` against all SMARTS, stored as one
+    compressed bitmap instead of one :class:`Match` row per match. See
+    :class:`smartsexplore.database.bitmap.MatchBitmap`.
+    """
+    __tablename__ = 'molecule_set_match_bitmaps'
+
+    """The ID of the MoleculeSet whose matches are stored (primary key)."""
+    molset_id = Column(Integer, ForeignKey('molecule_sets.id'), primary_key=True)
+    """The MoleculeSet whose matches are stored."""
+    molset = relationship(MoleculeSet, foreign_keys=[molset_id], back_populates='match_bitmap')
+    """The compressed IDs of the molecules (the rows of the bitmap)."""
+    molecule_ids = Column(LargeBinary, nullable=False)
+    """The compressed IDs of the SMARTS matched against (the columns of the bitmap)."""
+    smarts_ids = Column(LargeBinary, nullable=False)
+    """The compressed, bit-packed bitmap."""
+    bits = Column(LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f"<MoleculeSetMatches(molset={self.molset_id})>"
+
+    def __init__(self, molset: MoleculeSet, bitmap):
+        """
+        Creates new stored matches of a MoleculeSet.
+        :param molset: The MoleculeSet whose matches are stored.
+        :param bitmap: The :class:`smartsexplore.database.bitmap.MatchBitmap` of the matches.
+        """
+        self.molset = molset
+        for column, data in bitmap.to_columns().items():
+            setattr(self, column, data)
+
+    def to_bitmap(self):
+        """
+        :returns: The stored matches as a :class:`smartsexplore.database.bitmap.MatchBitmap`.
+        """
+        from smartsexplore.database.bitmap import MatchBitmap
+        return MatchBitmap.from_columns(self.molecule_ids, self.smarts_ids, self.bits)
+
+
+class MoleculeSetSMARTSCount(Base):
+    """
+    The number of molecules of a :class:`MoleculeSet` matching a :class:`SMARTS`, for each SMARTS
+    matching any of them, if the matches of the molecule set are stored as a
+    :class:`MoleculeSetMatches` bitmap. Allows looking up the molecule sets matching a SMARTS
+    via an index, instead of decompressing all bitmaps (see
+    :func:`smartsexplore.molecules.actions.molecules_matching_smarts`).
+    """
+    __tablename__ = 'molecule_set_smarts_counts'
+    __table_args__ = (
+        Index('ix_molecule_set_smarts_counts_smarts_id', 'smarts_id', 'molset_id'),
+    )
+
+    """The ID of the MoleculeSet (primary key)."""
+    molset_id = Column(Integer, ForeignKey('molecule_sets.id'), primary_key=True)
+    """The ID of the matching SMARTS (primary key)."""
+    smarts_id = Column(Integer, ForeignKey('smarts.id'), primary_key=True)
+    """The number of molecules of the MoleculeSet matching the SMARTS."""
+    nof_molecules = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<MoleculeSetSMARTSCount(molset={self.molset_id}, smarts={self.smarts_id}, " \
+               f"{self.nof_molecules})>"
+
+    @staticmethod
+    def rows_from_bitmap(molset_id: int, bitmap) -> List[Dict[str, int]]:
+        """
+        :param molset_id: The ID of the MoleculeSet whose matches are stored in the bitmap.
+        :param bitmap: The :class:`smartsexplore.database.bitmap.MatchBitmap` of the matches.
+        :returns: The rows to insert for the matches, as dictionaries of column values.
+        """
+        return [{'molset_id': molset_id, 'smarts_id': smarts_id, 'nof_molecules': count}
+                for smarts_id, count in bitmap.smarts_counts().items()]
@@ -0,0 +1,161 @@
+"""
+A slow-query log for the SMARTSexplore database.
+
+If the SLOW_QUERY_THRESHOLD app config value is set (in seconds), every SQL statement executed by
+an engine of :func:`smartsexplore.database.get_db` is timed, and statements that take longer than
+the threshold are logged as a warning, and appended as one JSON object per line to the file given
+by the SLOW_QUERY_LOG app config value (``slow_queries.jsonl`` in the instance folder by default).
+Each entry contains the statement, its parameters, its duration, the route or management command
+that executed it, and the SQLite query plan (``EXPLAIN QUERY PLAN``), in which a ``SCAN`` of a
+large table points to a missing index.
+
+``flask db slow_queries`` summarizes the log by normalized statement (with all literals and
+parameters replaced by ``?``), see :func:`summarize_slow_queries`.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+import click
+from flask import has_request_context, request
+from sqlalchemy import event
+
+
+"""The maximum number of characters of the parameters stored per log entry"""
+MAX_PARAMETERS_LENGTH = 1000
+
+_log_lock = threading.Lock()
+
+
+def normalize_statement(statement: str) -> str:
+    """
+    Normalizes an SQL statement, so that executions of the same query with different parameters
+    or literals (e.g., IN lists of different lengths) have the same normalized statement.
+
+    :param statement: The SQL statement.
+    :returns: The statement with all string and number literals and parameters replaced by ``?``,
+        lists of them collapsed to ``?, ...``, and whitespace collapsed to single spaces.
+    """
+    statement = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    statement = re.sub(r'\b\d+(?:\.\d+)?\b', '?', statement)
+    statement = re.sub(r'(?:\?|:\w+|%\(\w+\)s)', '?', statement)
+    statement = re.sub(r'\?(?:\s*,\s*\?)+', '?, ...', statement)
+    return re.sub(r'\s+', ' ', statement).strip()
+
+
+def _query_context() -> str:
+    """:returns: A description of the route or management command executing the current query."""
+    if has_request_context():
+        return f'{request.method} {request.endpoint or request.path}'
+    click_context = click.get_current_context(silent=True)
+    if click_context is not None:
+        return f'flask {click_context.command_path.split(" ", 1)[-1]}'
+    return f'thread {threading.current_thread().name}'
+
+
+def _explain(conn, statement: str, parameters) -> Optional[List[str]]:
+    """
+    :returns: The details of the SQLite query plan of a statement, or None if it cannot be
+        explained (e.g., on other databases, or for statements like ``PRAGMA``).
+    """
+    if conn.dialect.name != 'sqlite' \
+            or not re.match(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', statement, re.I):
+        return None
+    cursor = conn.connection.cursor()  # the DBAPI connection, so that no events are triggered
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    except Exception:
+        return None
+    finally:
+        cursor.close()
+
+
+def install_slow_query_log(engine, threshold: float, log_filename: Optional[str]) -> None:
+    """
+    Times all statements executed by an engine, and logs those that take longer than the
+    threshold, see above.
+
+    :param engine: The SQLAlchemy engine.
+    :param threshold: The minimum duration of logged statements, in seconds.
+    :param log_filename: The file to append the log entries to, or None to only log warnings.
+    """
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start_times', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['slow_query_start_times'].pop()
+        if duration < threshold:
+            return
+        entry = {
+            'time': time.time(),
+            'duration': duration,
+            'context': _query_context(),
+            'statement': statement,
+            'normalized': normalize_statement(statement),
+            'parameters': repr(parameters)[:MAX_PARAMETERS_LENGTH],
+            'executemany': executemany,
+            'plan': _explain(conn, statement, parameters[0] if executemany else parameters)
+        }
+        logging.warning(f"Slow query ({duration * 1000:.1f} ms, {entry['context']}): "
+                        f"{entry['normalized']}; plan: {entry['plan']}")
+        if log_filename is not None:
+            with _log_lock, open(log_filename, 'a') as log_file:
+                log_file.write(json.dumps(entry) + '\n')
+
+    def handle_error(exception_context):
+        start_times = exception_context.connection.info.get('slow_query_start_times') \
+            if exception_context.connection is not None else None
+        if start_times:
+            start_times.pop()
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+
+
+def read_slow_query_log(log_filename: str) -> List[dict]:
+    """:returns: All entries of a slow-query log file, skipping malformed lines."""
+    entries = []
+    with open(log_filename) as log_file:
+        for line in log_file:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+
+def summarize_slow_queries(entries: List[dict], top: int = 10, sort: str = 'total'
+                           ) -> List[Dict]:
+    """
+    Groups slow-query log entries by normalized statement.
+
+    :param entries: The log entries, see :func:`read_slow_query_log`.
+    :param top: The number of groups to return.
+    :param sort: The key to sort the groups by, descending: ``'total'`` (duration), ``'max'``
+        (duration) or ``'count'``.
+    :returns: The ``top`` groups, each a dict with the ``normalized`` statement, the ``count``,
+        ``total``, ``max`` and ``mean`` duration of its executions, the ``contexts`` it was
+        executed in (with counts), and the ``plan`` of its slowest execution.
+    """
+    groups = {}
+    for entry in entries:
+        group = groups.setdefault(entry['normalized'], {
+            'normalized': entry['normalized'], 'count': 0, 'total': 0., 'max': 0.,
+            'contexts': {}, 'plan': None
+        })
+        group['count'] += 1
+        group['total'] += entry['duration']
+        group['contexts'][entry['context']] = group['contexts'].get(entry['context'], 0) + 1
+        if entry['duration'] >= group['max']:
+            group['max'] = entry['duration']
+            group['plan'] = entry['plan']
+    for group in groups.values():
+        group['mean'] = group['total'] / group['count']
+    if sort not in ('total', 'max', 'count'):
+        raise ValueError(f'Unknown sort key: {sort}. Must be one of [total, max, count].')
+    return sorted(groups.values(), key=lambda group: group[sort], reverse=True)[:top]
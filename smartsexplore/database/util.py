@@ -1,14 +1,19 @@
 """
 Utility functions for easy access to the SMARTSexplore database and connected SQLAlchemy sessions.
 """
+import itertools
+import os
 import tempfile
+import time
 from typing import Dict
 
 from flask import current_app, g, has_app_context
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
 
-from smartsexplore.database import SMARTS
+from smartsexplore.database import SMARTS, SMARTSSetVersion
+from smartsexplore.metrics import record_cache_lookup
+from smartsexplore.util import ram_tempfile
 
 
 def get_db(db_url=None):
@@ -26,6 +31,10 @@ def get_db(db_url=None):
             raise ValueError("db_url cannot be None if working outside Flask app context!")
 
     engine = create_engine(db_url, connect_args={'check_same_thread': False})
+    if has_app_context() and current_app.config['SLOW_QUERY_THRESHOLD'] is not None:
+        from smartsexplore.database.slow_queries import install_slow_query_log
+        install_slow_query_log(engine, current_app.config['SLOW_QUERY_THRESHOLD'],
+                               current_app.config['SLOW_QUERY_LOG'])
     sm = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     return engine, sm
 
@@ -70,21 +79,126 @@ def close_session(e=None):
 def init_db() -> None:
     """
     Initializes the app database appropriately. Currently just means that the ORM model tables are
-    created.
+    created. Can be run on an existing database to upgrade it, since tables, columns and indexes
+    that were added in newer versions (e.g., :class:`smartsexplore.database.MoleculeSetMatches`)
+    are created, while existing data is left untouched.
+
+    For SQLite databases, also enables incremental vacuuming, so that the space freed by deleting
+    data can be reclaimed without rewriting the whole database (see
+    :func:`smartsexplore.molecules.eviction.collect_molecule_sets`).
 
     Must be used within the Flask appcontext.
     """
     from smartsexplore.database.models import Base
     engine, sessionmaker = get_db()
     session = sessionmaker()
+    _enable_incremental_vacuum(engine)
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns(engine)
+    _enable_molecule_set_autoincrement(engine)
+    _create_missing_indexes(engine)
+    _add_missing_molecule_set_smarts_counts(session)
     session.commit()
 
 
+def _enable_incremental_vacuum(engine) -> None:
+    """
+    Sets SQLite databases to incremental auto-vacuuming. Changing this setting requires a full
+    VACUUM on databases that already contain tables, so this is only slow once.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.connect() as connection:
+        if connection.execute('PRAGMA auto_vacuum').scalar() != 2:  # 2 = INCREMENTAL
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.execute('VACUUM')
+
+
+def _add_missing_columns(engine) -> None:
+    """
+    Adds all columns of the ORM models that are missing in existing tables of the database, and
+    fills them with their default values. ``create_all`` does not alter existing tables, so this
+    is needed for columns that were added to existing tables.
+    """
+    from sqlalchemy import inspect
+    from smartsexplore.database.models import Base
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            engine.execute(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+            if column.default is not None:
+                value = column.default.arg(None) if column.default.is_callable \
+                    else column.default.arg
+                engine.execute(table.update().values({column.name: value}))
+
+
+def _enable_molecule_set_autoincrement(engine) -> None:
+    """
+    Recreates the ``molecule_sets`` table of SQLite databases that were created before it was
+    declared with AUTOINCREMENT, keeping its rows, so that SQLite never reuses the IDs of deleted
+    molecule sets. SQLite cannot add AUTOINCREMENT to an existing table.
+    """
+    from smartsexplore.database.models import MoleculeSet
+
+    if engine.dialect.name != 'sqlite':
+        return
+    table = MoleculeSet.__table__
+    with engine.begin() as connection:
+        sql = connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                 table.name).scalar()
+        if 'AUTOINCREMENT' in sql.upper():
+            return
+        columns = ', '.join(column.name for column in table.columns)
+        connection.execute(f'CREATE TEMPORARY TABLE old_{table.name} AS '
+                           f'SELECT {columns} FROM {table.name}')
+        connection.execute(f'DROP TABLE {table.name}')
+        table.create(bind=connection)
+        connection.execute(f'INSERT INTO {table.name} ({columns}) '
+                           f'SELECT {columns} FROM old_{table.name}')
+        connection.execute(f'DROP TABLE old_{table.name}')
+
+
+def _add_missing_molecule_set_smarts_counts(session) -> None:
+    """
+    Adds the :class:`smartsexplore.database.MoleculeSetSMARTSCount` rows of match bitmaps that
+    were stored before that table was added.
+    """
+    from smartsexplore.database.models import MoleculeSetMatches, MoleculeSetSMARTSCount
+
+    counted_molset_ids = session.query(MoleculeSetSMARTSCount.molset_id).distinct()
+    for stored in session.query(MoleculeSetMatches)\
+            .filter(MoleculeSetMatches.molset_id.notin_(counted_molset_ids)):
+        rows = MoleculeSetSMARTSCount.rows_from_bitmap(stored.molset_id, stored.to_bitmap())
+        if rows:
+            session.execute(MoleculeSetSMARTSCount.__table__.insert(), rows)
+
+
+def _create_missing_indexes(engine) -> None:
+    """
+    Creates all indexes of the ORM models that are missing in the database. ``create_all`` only
+    creates the indexes of newly created tables, so this is needed for indexes that were added to
+    existing tables.
+    """
+    from sqlalchemy import inspect
+    from smartsexplore.database.models import Base
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=engine)
+
+
 def molecules_to_temporary_smiles_file(molecules) -> (tempfile.NamedTemporaryFile, Dict[int, int]):
     """
     Writes a list of :class:`Molecule` objects to a temporary .smiles file, and returns a handle
-    to that file.
+    to that file. The file is RAM-backed if possible, see :func:`smartsexplore.util.ram_tempfile`.
 
     Will write each :class:`Molecule` as one line consisting of the molecule's SMILES pattern and
     its ID as the "label" of its output SMILES line, so that the resultant file can be passed to
@@ -99,7 +213,7 @@ def molecules_to_temporary_smiles_file(molecules) -> (tempfile.NamedTemporaryFil
     """
     line_no_to_molecule_id = {}
 
-    moleculefile = tempfile.NamedTemporaryFile(mode='w+', suffix='.smiles')
+    moleculefile = ram_tempfile(mode='w+', suffix='.smiles')
     moleculefile.write(
         '\n'.join(f'{mol.pattern}\t{mol.id}' for mol in molecules)
     )
@@ -113,7 +227,8 @@ def molecules_to_temporary_smiles_file(molecules) -> (tempfile.NamedTemporaryFil
 
 class NoSMARTSException(Exception):
     """
-    Raised by :func:`write_smarts_to_tempfile` if no SMARTS are available to write.
+    Raised by :func:`write_smarts_to_tempfile` and :func:`get_smarts_export_file` if no SMARTS are
+    available to write.
     """
     pass
 
@@ -122,20 +237,130 @@ def write_smarts_to_tempfile() -> tempfile.NamedTemporaryFile:
     """
     Retrieves all SMARTS patterns currently stored in the database, and writes them out into a
     temporary file, using the IDs from the database as labels for each SMARTS object.
+    The file is RAM-backed if possible, see :func:`smartsexplore.util.ram_tempfile`.
 
     :returns: A file handle to the written temporary .smarts file.
     :raises: :class:`NoSMARTSException`, if there are no SMARTS to be written.
     """
-    import tempfile
     session = get_session()
     smartss = session.query(SMARTS).all()
 
     if len(smartss) == 0:
         raise NoSMARTSException("No SMARTS in the database to write to a file!")
 
-    smartsfile = tempfile.NamedTemporaryFile(mode='r+', suffix='.smarts')
+    smartsfile = ram_tempfile(mode='w+', suffix='.smarts')
     smartsfile.write(
         '\n'.join(f'{smarts.pattern}\t{smarts.id}' for smarts in smartss)
     )
     smartsfile.seek(0)
     return smartsfile
+
+
+def _bump_smarts_set_version(session, flush_context, instances) -> None:
+    """
+    Increments the :class:`smartsexplore.database.SMARTSSetVersion` counter in the same
+    transaction, if a flush adds, changes or removes SMARTS. Registered for all sessions.
+    """
+    if not any(isinstance(obj, SMARTS)
+               for obj in itertools.chain(session.new, session.dirty, session.deleted)):
+        return
+    table = SMARTSSetVersion.__table__
+    if session.execute(table.update().values(version=table.c.version + 1)).rowcount == 0:
+        session.execute(table.insert().values(id=1, version=1))
+
+
+event.listen(Session, 'before_flush', _bump_smarts_set_version)
+
+
+def get_smarts_set_version(session=None) -> str:
+    """
+    Gets a version string of the set of SMARTS currently stored in the database, of the form
+    ``'<number of SMARTS>-<highest ID>-<counter>'``. The counter is stored in the database and
+    incremented by every flush that adds, changes or removes SMARTS through the ORM (e.g., by
+    :func:`smartsexplore.smarts.actions.add_library`), so the version never repeats, even if
+    SMARTS are removed and others added; the number of SMARTS and their highest ID additionally
+    change with SMARTS inserted without the ORM (e.g., by bulk inserts).
+
+    Must be called from within a Flask appcontext.
+
+    :param session: An optional SQLAlchemy session to use. Uses :func:`get_session` if not given.
+    :returns: The version string.
+    """
+    session = session or get_session()
+    count, max_id = session.query(func.count(SMARTS.id), func.max(SMARTS.id)).one()
+    counter = session.query(SMARTSSetVersion.version).scalar()
+    return f'{count}-{max_id or 0}-{counter or 0}'
+
+
+"""The age (in seconds) after which temporary files left over from interrupted SMARTS exports are
+removed, see :func:`get_smarts_export_file`"""
+STALE_EXPORT_TMP_AGE = 3600
+
+
+def get_smarts_export_file(session=None) -> str:
+    """
+    Gets the path of a .smarts file containing all SMARTS patterns currently stored in the database,
+    using the IDs from the database as labels for each SMARTS object (like
+    :func:`write_smarts_to_tempfile`).
+
+    The file is stored persistently in the SMARTS_EXPORT_PATH directory of the app config, named
+    by the current SMARTS set version (see :func:`get_smarts_set_version`). It is only rewritten
+    when that version changes, and replaced atomically, so that concurrent readers never see a
+    partially written file. Exports of older versions are removed, except for the previous one,
+    which concurrent readers may still be using.
+
+    Must be called from within a Flask appcontext.
+
+    :param session: An optional SQLAlchemy session to use. Uses :func:`get_session` if not given.
+    :returns: The path of the up-to-date .smarts export file.
+    :raises: :class:`NoSMARTSException`, if there are no SMARTS to be written.
+    """
+    session = session or get_session()
+    version = get_smarts_set_version(session)
+    if version.startswith('0-'):
+        raise NoSMARTSException("No SMARTS in the database to write to a file!")
+
+    export_dir = current_app.config['SMARTS_EXPORT_PATH']
+    export_filename = os.path.join(export_dir, f'smarts-{version}.smarts')
+    is_cached = os.path.isfile(export_filename)
+    record_cache_lookup('smarts_export', is_cached)
+    if is_cached:
+        return export_filename
+
+    os.makedirs(export_dir, exist_ok=True)
+    smartss = session.query(SMARTS.id, SMARTS.pattern).order_by(SMARTS.id)
+    with tempfile.NamedTemporaryFile(mode='w', dir=export_dir, suffix='.tmp',
+                                     delete=False) as smartsfile:
+        smartsfile.write(
+            '\n'.join(f'{pattern}\t{id_}' for id_, pattern in smartss)
+        )
+    os.replace(smartsfile.name, export_filename)
+    _remove_old_smarts_exports(export_dir, export_filename)
+    return export_filename
+
+
+def _remove_old_smarts_exports(export_dir: str, export_filename: str) -> None:
+    """
+    Removes the SMARTS exports of all but the current and the previous version, since matchers
+    (possibly in other worker processes) may still be reading the previous one, and temporary
+    files of exports that were interrupted at least :data:`STALE_EXPORT_TMP_AGE` seconds ago.
+    """
+    exports, stale_tmp_files = [], []
+    now = time.time()
+    for filename in os.listdir(export_dir):
+        path = os.path.join(export_dir, filename)
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:  # removed concurrently
+            continue
+        if filename.startswith('smarts-') and path != export_filename:
+            exports.append((mtime, path))
+        elif filename.endswith('.tmp') and now - mtime >= STALE_EXPORT_TMP_AGE:
+            stale_tmp_files.append(path)
+
+    # all older exports except for the most recently written one
+    for path in [path for _, path in sorted(exports)[:-1]] + stale_tmp_files:
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # removed concurrently
+            pass
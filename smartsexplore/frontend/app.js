@@ -16,6 +16,7 @@ import * as M from 'materialize-css/dist/js/materialize.min.js';
 /////////////// COMPONENT IMPORTS //////////////////////////////////////////////
 
 import { Graph } from './graph.js'
+import { moleculeImages } from './images.js';
 import { SmartsGraph, ArrowheadMarker } from './components/smarts-graph.js';
 import { InfoBox } from './components/info.js';
 import { RangeSlider } from './components/range-slider.js';
@@ -442,11 +443,13 @@ const appDescription = {
         },
         /**
          * Handles a (successful) response of the backend to a molecule upload request.
-         * Stores match data and sets the application up to show it.
+         * Stores match data and sets the application up to show it, and fetches the images of all
+         * molecules of the uploaded set in one request.
          */
         handleFileUploadResponse(response) {
-            const { matches } = response;
+            const { matches, molecule_set_id } = response;
             const matchesPerSMARTS = {};
+            moleculeImages.fetchBundle(`/molecules/images/set/${molecule_set_id}`);
 
             _.each(this.graph.nodes, (node) => {
                 node.meta.matches.length = 0;  // prune existing data
@@ -6,6 +6,7 @@ const d3 = Object.assign({}, d3Selection, d3Zoom);
 
 import { Copyable, Pluralize } from './util.js';
 import { Node, Edge } from '../graph.js';
+import { smartsImages, subsetImages, moleculeImages } from '../images.js';
 
 /**
  * A Vue component that renders a grid of matches, optionally with custom CSS classes attached
@@ -55,13 +56,14 @@ const MatchesGrid = {
      */
     methods: {
         /**
-         * Gets the appropriate image URL given a molecule id. Doesn't do any validation, neither
-         * for existence nor for input data.
+         * Gets the appropriate image URL given a molecule id: the cached image of the molecule if
+         * the image bundle of its molecule set was fetched, its single image otherwise. Doesn't
+         * do any validation, neither for existence nor for input data.
          * @param {integer} molecule_id The molecule ID to get an image URL for.
          * @returns {string} The image URL for that molecule.
          */
         getMoleculeImageURL(molecule_id) {
-            return `/molecules/images/${molecule_id}`;
+            return moleculeImages.url(molecule_id);
         }
     }
 };
@@ -200,7 +202,7 @@ const InfoBox = {
         <div>
             <svg ref="previewSvg">
                 <g ref="previewSvgGroup">
-                    <image :href="previewHref" @error="handleImageError">
+                    <image :href="previewHref" :data-id="obj && obj.id" @error="handleImageError">
                 </image></g>
             </svg>
         </div>
@@ -241,15 +243,16 @@ const InfoBox = {
             }
         },
         /**
-         * Determines the href (URL) of the preview image to show.
+         * Determines the href (URL) of the preview image to show: the cached image if it was
+         * prefetched (see prefetchNeighbourhood), the single image otherwise.
          */
         previewHref: function() {
             const { obj } = this;
             if(obj instanceof Node) {
-                return '/smarts/smartsview/' + obj.id;
+                return smartsImages.url(obj.id);
             }
             else if(obj instanceof Edge) {
-                return '/smarts/smartssubsets/' + obj.id;
+                return subsetImages.url(obj.id);
             }
         },
     },
@@ -260,11 +263,42 @@ const InfoBox = {
             () => this.resetPreviewZoom(),
             { flush: 'post', deep: false }
         );
+        this.$watch(
+            () => this.obj,
+            (obj) => this.prefetchNeighbourhood(obj),
+            { immediate: true, deep: false }
+        );
     },
     unmounted() {
         this.cleanupPreviewZoom();
     },
     methods: {
+        /**
+         * Prefetches the images of the displayed object and its neighbourhood with one batch
+         * request per image type, so that hovering neighbouring nodes and edges next shows their
+         * images without any further request: for a node, the images of the node, its neighbour
+         * nodes and its incident edges; for an edge, the images of its nodes and of all edges
+         * incident to them.
+         * @param {(Node|Edge|null)} obj The displayed object.
+         */
+        prefetchNeighbourhood(obj) {
+            let nodes, edges;
+            if(obj instanceof Node) {
+                edges = obj.incidentEdges;
+                nodes = [obj, ..._.map(
+                    edges, (edge) => edge.source.id === obj.id ? edge.target : edge.source
+                )];
+            }
+            else if(obj instanceof Edge) {
+                nodes = [obj.source, obj.target];
+                edges = [obj, ...obj.source.incidentEdges, ...obj.target.incidentEdges];
+            }
+            else {
+                return;
+            }
+            smartsImages.prefetch(_.map(nodes, 'id'));
+            subsetImages.prefetch(_.map(edges, 'id'));
+        },
         /**
          * Handles errors in image loading by replacing errored image with a static 'missing image'
          * text image.
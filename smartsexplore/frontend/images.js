@@ -0,0 +1,114 @@
+import * as Vue from 'vue';
+import _ from 'lodash';
+
+/**
+ * The maximum number of images requested per batch request. Must not exceed the
+ * MAX_IMAGE_BATCH_SIZE app config value of the backend.
+ */
+const MAX_BATCH_SIZE = 100;
+
+/**
+ * Turns the source of an SVG image into a data URL, which can be used as the src (or href) of
+ * an image element without any further request.
+ * @param {string} svg The source of the SVG image.
+ * @returns {string} The data URL.
+ */
+function svgDataURL(svg) {
+    return 'data:image/svg+xml;charset=utf-8,' + encodeURIComponent(svg);
+}
+
+/**
+ * A cache of SVG images fetched from the backend in batches (or bundles), instead of one request
+ * per image. The cached images are stored reactively, so that components showing an image
+ * re-render once it was fetched.
+ */
+class ImageCache {
+    /**
+     * @param {Function} singleURLFn A function returning the URL of the single image with a given
+     *   ID, used for images that are not (yet) cached.
+     * @param {string} batchURL (optional) The URL of the batch endpoint to prefetch images from,
+     *   which is passed the image IDs in its ``ids`` query parameter.
+     */
+    constructor(singleURLFn, batchURL = null) {
+        this.singleURLFn = singleURLFn;
+        this.batchURL = batchURL;
+        /** Maps image IDs to the data URLs of the cached images */
+        this.images = Vue.reactive({});
+        /** The IDs (as strings) of the images that were requested (or are being requested) */
+        this._requested = new Set();
+    }
+
+    /**
+     * Gets the URL to show the image with the given ID: a data URL if it is cached, otherwise the
+     * URL of the single image.
+     * @param {(integer|string)} id The ID of the image.
+     * @returns {string} The URL of the image.
+     */
+    url(id) {
+        return this.images[id] || this.singleURLFn(id);
+    }
+
+    /**
+     * Caches the images with the given IDs that are not cached yet, with as few requests to the
+     * batch endpoint as possible. Failed requests are ignored (so that the single images are
+     * shown), and their images are requested again by the next call.
+     * @param {Array} ids The IDs of the images to prefetch.
+     * @returns {Promise} A promise that resolves once all requests finished.
+     */
+    async prefetch(ids) {
+        const missing = _.filter(_.uniq(_.map(ids, String)), (id) => !this._requested.has(id));
+        _.each(missing, (id) => this._requested.add(id));
+        await Promise.all(_.map(_.chunk(missing, MAX_BATCH_SIZE), async (chunk) => {
+            try {
+                const response = await fetch(`${this.batchURL}?ids=${chunk.join(',')}`);
+                if(!response.ok) {
+                    throw new Error(response.statusText);
+                }
+                this.add((await response.json()).images);
+            }
+            catch(e) {
+                _.each(chunk, (id) => this._requested.delete(id));
+            }
+        }));
+    }
+
+    /**
+     * Fetches a bundle of images, i.e., a JSON object mapping image IDs to SVG sources, and caches
+     * all images in it. Failed requests are ignored (so that the single images are shown).
+     * @param {string} url The URL of the bundle.
+     * @returns {Promise} A promise that resolves once the request finished.
+     */
+    async fetchBundle(url) {
+        try {
+            const response = await fetch(url);
+            if(response.ok) {
+                this.add(await response.json());
+            }
+        }
+        catch(e) {}
+    }
+
+    /**
+     * Caches images.
+     * @param {Object} images An object mapping image IDs to SVG sources.
+     */
+    add(images) {
+        _.each(images, (svg, id) => {
+            this._requested.add(id);
+            this.images[id] = svgDataURL(svg);
+        });
+    }
+}
+
+/** The images of SMARTS, see the /smarts/smartsview routes */
+const smartsImages = new ImageCache(
+    (id) => `/smarts/smartsview/${id}`, '/smarts/smartsview/batch'
+);
+/** The images of subset edges, see the /smarts/smartssubsets routes */
+const subsetImages = new ImageCache(
+    (id) => `/smarts/smartssubsets/${id}`, '/smarts/smartssubsets/batch'
+);
+/** The images of uploaded molecules, fetched per molecule set, see the /molecules/images routes */
+const moleculeImages = new ImageCache((id) => `/molecules/images/${id}`);
+
+export { ImageCache, MAX_BATCH_SIZE, svgDataURL, smartsImages, subsetImages, moleculeImages };
@@ -0,0 +1,398 @@
+"""
+Operational metrics, exposed in the Prometheus text format at ``/metrics`` (see
+https://prometheus.io/docs/instrumenting/exposition_formats/), without requiring any external
+service or library.
+
+Metrics are kept in an in-process :class:`Registry`. If the app is served by several worker
+processes (e.g., Gunicorn workers), set the METRICS_MULTIPROCESS_DIR app config value to a
+directory shared by all of them: each process then writes its metrics to its own file in that
+directory after every request, and ``/metrics`` reports the sum over all files, no matter which
+worker serves it. Counters and histograms of exited processes are kept; their gauges are dropped.
+The directory should be emptied whenever the server is (re)started.
+
+The following metrics are recorded:
+
+* ``smartsexplore_requests_total``, ``smartsexplore_request_duration_seconds``: Requests and their
+  latency, per endpoint (blueprint route), method and status
+* ``smartsexplore_process_runs_total``, ``smartsexplore_process_duration_seconds``,
+  ``smartsexplore_process_cpu_seconds_total``, ``smartsexplore_process_max_rss_bytes``: Runs of
+  external tools (see :func:`smartsexplore.util.run_process`), per tool (and exit code)
+* ``smartsexplore_upload_bytes``, ``smartsexplore_upload_molecules``: The sizes of molecule uploads
+* ``smartsexplore_molecule_set_matches``: The number of matches per matched molecule set
+* ``smartsexplore_cache_requests_total``: Cache lookups, per cache and result (hit or miss)
+* ``smartsexplore_db_connections_total``, ``smartsexplore_db_checkouts_total``,
+  ``smartsexplore_db_connections_checked_out``: Statistics of the database connection pools
+
+Enabled by the METRICS app config value (True by default). The metrics routes only respond to
+clients from the addresses in the METRICS_ALLOWED_ADDRESSES app config value (only the local host
+by default; None allows all addresses), and with a 403 error to all others. Behind a reverse proxy
+on the same host, all requests come from the local host, so the proxy must not forward requests
+for ``/metrics`` from untrusted clients.
+"""
+import atexit
+import bisect
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+from flask import Flask, Response, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+
+class Registry:
+    """
+    A set of metrics of this process, optionally shared with other processes via a directory (see
+    above).
+    """
+
+    def __init__(self):
+        """Guards the values of all metrics"""
+        self.lock = threading.RLock()
+        """The registered metrics, keyed by name"""
+        self.metrics: Dict[str, '_Metric'] = {}
+        """The directory shared with other processes, if any"""
+        self.directory: Optional[str] = None
+        """The ID of the process the values of the metrics belong to"""
+        self.pid = os.getpid()
+
+    def register(self, metric: '_Metric') -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} is already registered.')
+        self.metrics[metric.name] = metric
+
+    def check_pid(self) -> None:
+        """
+        Resets all values if this process was forked from the process they belong to, since
+        they were already counted there. Must be called with :attr:`lock` held.
+        """
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            for metric in self.metrics.values():
+                metric.values.clear()
+
+    def _snapshot(self) -> Dict[str, Dict[Tuple[str, ...], object]]:
+        with self.lock:
+            self.check_pid()
+            return {name: {key: list(value) if isinstance(value, list) else value
+                           for key, value in metric.values.items()}
+                    for name, metric in self.metrics.items()}
+
+    def flush(self) -> None:
+        """
+        Writes the values of all metrics to this process's file in :attr:`directory`, if set.
+        The file is replaced atomically, so that other processes never read a partial file.
+        """
+        if self.directory is None:
+            return
+        snapshot = {name: [[list(key), value] for key, value in values.items()]
+                    for name, values in self._snapshot().items()}
+        with tempfile.NamedTemporaryFile('w', dir=self.directory, suffix='.tmp',
+                                         delete=False) as file:
+            json.dump(snapshot, file)
+        os.replace(file.name, os.path.join(self.directory, f'{self.pid}.json'))
+
+    def collect(self) -> Dict[str, Dict[Tuple[str, ...], object]]:
+        """
+        :returns: The values of all metrics, keyed by metric name and label values, summed over
+            this process and the files of other processes in :attr:`directory` (if set).
+        """
+        result = self._snapshot()
+        if self.directory is None:
+            return result
+        for filename in glob.glob(os.path.join(self.directory, '*.json')):
+            pid = int(os.path.basename(filename)[:-len('.json')])
+            if pid == self.pid:
+                continue
+            try:
+                with open(filename) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            alive = _is_alive(pid)
+            for name, values in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None or (metric.type == 'gauge' and not alive):
+                    continue
+                for key, value in values:
+                    result[name][tuple(key)] = metric.merge(result[name].get(tuple(key)), value)
+        return result
+
+    def render(self) -> str:
+        """:returns: All metrics in the Prometheus text format, see :meth:`collect`."""
+        collected = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for key, value in sorted(collected[name].items()):
+                lines.extend(metric.samples(dict(zip(metric.labelnames, key)), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+"""The registry of all metrics of this module"""
+REGISTRY = Registry()
+
+
+class _Metric:
+    """A metric with a value per combination of label values."""
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        """The values of the metric, keyed by label values"""
+        self.values = {}
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'Metric {self.name} requires the labels {self.labelnames}.')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _update(self, labels: Dict[str, object], update) -> None:
+        key = self._key(labels)
+        with self.registry.lock:
+            self.registry.check_pid()
+            self.values[key] = update(self.values.get(key))
+
+    def merge(self, value, other):
+        """:returns: The sum of the values of this metric in two processes."""
+        return (value or 0.) + other
+
+    def samples(self, labels: Dict[str, str], value):
+        """:returns: The lines of the Prometheus text format for one value."""
+        return [f'{self.name}{_format_labels(labels)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    """A metric that only increases, e.g. a number of requests."""
+    type = 'counter'
+
+    def inc(self, amount: float = 1., **labels) -> None:
+        self._update(labels, lambda value: (value or 0.) + amount)
+
+
+class Gauge(_Metric):
+    """A metric that can increase and decrease, e.g. a number of open connections."""
+    type = 'gauge'
+
+    def inc(self, amount: float = 1., **labels) -> None:
+        self._update(labels, lambda value: (value or 0.) + amount)
+
+    def dec(self, amount: float = 1., **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    A metric that counts observations (e.g. durations) in buckets, plus their sum. The value per
+    label values is a list of the number of observations per bucket (not cumulative), the last
+    bucket being +Inf, followed by the sum of all observations.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10,
+                                             30, 60),
+                 registry: Registry = REGISTRY):
+        """
+        :param buckets: The upper bounds of the buckets, ascending, without +Inf.
+        """
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(float(bound) for bound in buckets)
+
+    def observe(self, amount: float, **labels) -> None:
+        def update(value):
+            value = value or [0.] * (len(self.buckets) + 2)
+            value[bisect.bisect_left(self.buckets, amount)] += 1
+            value[-1] += amount
+            return value
+        self._update(labels, update)
+
+    def merge(self, value, other):
+        return [a + b for a, b in zip(value, other)] if value is not None else other
+
+    def samples(self, labels: Dict[str, str], value):
+        lines, cumulative = [], 0.
+        for bound, count in zip(self.buckets + (float('inf'),), value[:-1]):
+            cumulative += count
+            bucket_labels = _format_labels({**labels, 'le': _format_value(bound)})
+            lines.append(f'{self.name}_bucket{bucket_labels} {_format_value(cumulative)}')
+        lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(value[-1])}')
+        lines.append(f'{self.name}_count{_format_labels(labels)} {_format_value(cumulative)}')
+        return lines
+
+
+REQUESTS = Counter('smartsexplore_requests_total', 'The number of handled requests.',
+                   ['endpoint', 'method', 'status'])
+REQUEST_DURATION = Histogram('smartsexplore_request_duration_seconds',
+                             'The time taken to handle requests.', ['endpoint'])
+PROCESS_RUNS = Counter('smartsexplore_process_runs_total', 'The number of external tool runs.',
+                       ['tool', 'exit_code'])
+PROCESS_DURATION = Histogram('smartsexplore_process_duration_seconds',
+                             'The wall time of external tool runs.', ['tool'],
+                             buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 600, 1800))
+PROCESS_CPU = Counter('smartsexplore_process_cpu_seconds_total',
+                      'The user and system CPU time of external tool runs.', ['tool'])
+PROCESS_MAX_RSS = Histogram('smartsexplore_process_max_rss_bytes',
+                            'The peak memory (resident set size) of external tool runs.', ['tool'],
+                            buckets=(1e7, 5e7, 1e8, 5e8, 1e9, 4e9, 16e9))
+UPLOAD_BYTES = Histogram('smartsexplore_upload_bytes', 'The sizes of molecule set uploads.',
+                         buckets=(1e3, 1e4, 1e5, 1e6, 1e7, 1e8))
+UPLOAD_MOLECULES = Histogram('smartsexplore_upload_molecules',
+                             'The numbers of molecules of uploaded molecule sets.',
+                             buckets=(1, 10, 100, 1e3, 1e4, 1e5))
+MOLECULE_SET_MATCHES = Histogram('smartsexplore_molecule_set_matches',
+                                 'The numbers of matches of matched molecule sets.',
+                                 buckets=(0, 10, 100, 1e3, 1e4, 1e5, 1e6, 1e7))
+CACHE_REQUESTS = Counter('smartsexplore_cache_requests_total', 'The number of cache lookups.',
+                         ['cache', 'result'])
+DB_CONNECTIONS = Counter('smartsexplore_db_connections_total',
+                         'The number of opened database connections.')
+DB_CHECKOUTS = Counter('smartsexplore_db_checkouts_total',
+                       'The number of database connection pool checkouts.')
+DB_CHECKED_OUT = Gauge('smartsexplore_db_connections_checked_out',
+                       'The number of database connections currently checked out of their pool.')
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """Records a lookup in the cache named ``cache`` as a hit or a miss."""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def record_process(stats) -> None:
+    """
+    Records a run of an external tool, named by the file name of its executable.
+
+    :param stats: The :class:`smartsexplore.util.ProcessStats` of the run.
+    """
+    PROCESS_RUNS.inc(tool=stats.tool,
+                     exit_code=stats.returncode if stats.returncode is not None else 'error')
+    PROCESS_DURATION.observe(stats.wall_time, tool=stats.tool)
+    if stats.user_time is not None:
+        PROCESS_CPU.inc(stats.user_time + stats.system_time, tool=stats.tool)
+    if stats.max_rss is not None:
+        PROCESS_MAX_RSS.observe(stats.max_rss * 1024, tool=stats.tool)
+
+
+def _on_connect(dbapi_connection, connection_record):
+    DB_CONNECTIONS.inc()
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_CHECKOUTS.inc()
+    DB_CHECKED_OUT.inc()
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    DB_CHECKED_OUT.dec()
+
+
+def _start_request():
+    g.metrics_start_time = time.perf_counter()
+
+
+def _record_request(response):
+    endpoint = request.endpoint or 'none'
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'metrics_start_time' in g:
+        REQUEST_DURATION.observe(time.perf_counter() - g.metrics_start_time, endpoint=endpoint)
+    return response
+
+
+def _flush(e=None):
+    REGISTRY.flush()
+
+
+def _access_allowed() -> bool:
+    """
+    :returns: Whether the client of the current request may read the metrics, see the
+        METRICS_ALLOWED_ADDRESSES app config value.
+    """
+    allowed_addresses = current_app.config['METRICS_ALLOWED_ADDRESSES']
+    return allowed_addresses is None or request.remote_addr in allowed_addresses
+
+
+def metrics():
+    """A route that responds with all metrics in the Prometheus text format."""
+    if not _access_allowed():
+        return {'error': 'Access to the metrics is not allowed from this address.'}, 403
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+def process_runs():
+    """
+    A route that responds with the most recent external tool runs of the worker process that
+    serves the request, newest first, as a JSON object with a list of ``runs`` (see
+    :func:`smartsexplore.util.recent_process_runs`). Accepts the optional query parameters
+    ``tool`` (the file name of the tool's executable) and ``limit``.
+
+    The command lines of the runs are left out, since they contain server paths; they are only
+    logged, see :func:`smartsexplore.util.run_process`. Like ``/metrics``, only responds to
+    clients from the addresses in the METRICS_ALLOWED_ADDRESSES app config value.
+    """
+    from smartsexplore.util import recent_process_runs
+
+    if not _access_allowed():
+        return {'error': 'Access to the metrics is not allowed from this address.'}, 403
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return {'error': 'Parameter limit must be an integer.'}, 400
+    return {'runs': [run.to_dict(with_cmd=False) for run in
+                     recent_process_runs(tool=request.args.get('tool'), limit=limit)]}
+
+
+def init_app(app: Flask) -> None:
+    """
+    Sets up the metrics and the ``/metrics`` route for an app, if the METRICS app config value is
+    set. Should be called before other ``after_request`` functions are registered, so that their
+    time is included in the request durations.
+
+    :param app: The app to record metrics of.
+    """
+    if not app.config['METRICS']:
+        return
+    REGISTRY.directory = app.config['METRICS_MULTIPROCESS_DIR']
+    if REGISTRY.directory is not None:
+        os.makedirs(REGISTRY.directory, exist_ok=True)
+        atexit.register(REGISTRY.flush)  # e.g. for tool runs of management commands
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    app.teardown_request(_flush)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    app.add_url_rule('/metrics/processes', 'process_runs', process_runs)
+    for name, listener in [('connect', _on_connect), ('checkout', _on_checkout),
+                           ('checkin', _on_checkin)]:
+        if not event.contains(Pool, name, listener):
+            event.listen(Pool, name, listener)
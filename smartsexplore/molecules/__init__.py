@@ -7,8 +7,9 @@ Depends on the :mod:`smartsexplore.database` module.
 
 from flask import Blueprint
 
-from smartsexplore.molecules import routes
+from smartsexplore.molecules import commands, routes
 
 bp = Blueprint('molecules', __name__, url_prefix='/molecules')
 bp.cli.short_help = 'Manage molecule and SMARTS-molecule match data.'
+commands.attach_to_blueprint(bp)
 routes.attach_to_blueprint(bp)
@@ -2,96 +2,116 @@
 Functions that interact with the database and external programs to manage molecule and
 molecule-SMARTS match data.
 """
+import heapq
 import logging
-from typing import BinaryIO
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from flask import current_app
+from sqlalchemy import func
 
-from smartsexplore.database import get_session, MoleculeSet, Molecule, SMARTS, Match, \
-    write_smarts_to_tempfile, molecules_to_temporary_smiles_file, NoSMARTSException
-from smartsexplore.parsers import parse_moleculematch
+from smartsexplore.database import get_session, MoleculeSet, MoleculeSetMatches, Molecule, \
+    MoleculeSetSMARTSCount, Match, SMARTS, NoSMARTSException
+from smartsexplore.metrics import MOLECULE_SET_MATCHES, record_cache_lookup
+from smartsexplore.parsers import parse_smiles_stream
 
 
-def create_molecules_from_smiles_file(file: BinaryIO) -> MoleculeSet:
+def create_molecule_set(molecules: Iterable[Tuple[str, str]], batch_size: int = 10000
+                        ) -> MoleculeSet:
     """
-    Reads in a .smiles file and constructs :class:`Molecule` instances from it, all linked to a
-    single new :class:`MoleculeSet` instance.
+    Creates a new :class:`MoleculeSet` with one :class:`Molecule` per given (SMILES pattern, name)
+    tuple. The molecules are inserted in bulk, ``batch_size`` rows per statement, rather than as
+    ORM objects, and are consumed from ``molecules`` while inserting, so they can be parsed lazily.
 
-    :param file: A file handle to a .smiles file.
+    :param molecules: An iterable of (SMILES pattern, name) tuples, e.g. as yielded by
+        :func:`smartsexplore.parsers.parse_smiles_stream`.
+    :param batch_size: The number of rows to insert per statement.
     :returns: The newly created :class:`MoleculeSet` instance. The created :class:`Molecule`
       instances are available as its ``.molecules`` property.
     """
     session = get_session()
-    nof_mol = 0
     molset = MoleculeSet()
-
-    for line in file:
-        # Rudimentary SMILES parsing
-        line = line.decode('utf-8')
-        if line.startswith('#'):
-            continue
-
-        line_contents = line.split(None, 1)
-        if len(line_contents) == 2:
-            pattern, name = line_contents
-        else:
-            pattern = line_contents[0]
-            name = ''
-        pattern, name = pattern.strip(), name.strip()
-
-        molecule = Molecule(pattern=pattern, name=name, molset=molset)
-        session.add(molecule)
-        nof_mol += 1
-    session.commit()
+    session.add(molset)
+    try:
+        session.flush()
+        insert = Molecule.__table__.insert()
+        nof_mol = 0
+        batch = []
+        for pattern, name in molecules:
+            batch.append({'pattern': pattern, 'name': name, 'molset_id': molset.id})
+            if len(batch) >= batch_size:
+                session.execute(insert, batch)
+                nof_mol += len(batch)
+                batch = []
+        if batch:
+            session.execute(insert, batch)
+            nof_mol += len(batch)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
     logging.info(f"Added {nof_mol} Molecules to the database.")
     return molset
 
 
-def calculate_molecule_matches(uploaded_molecules_file: BinaryIO) -> MoleculeSet:
+def create_molecules_from_smiles_file(file: BinaryIO) -> MoleculeSet:
+    """
+    Reads in a .smiles file and constructs :class:`Molecule` instances from it, all linked to a
+    single new :class:`MoleculeSet` instance, see :func:`create_molecule_set`.
+
+    :param file: A binary file handle to a .smiles file.
+    :returns: The newly created :class:`MoleculeSet` instance. The created :class:`Molecule`
+      instances are available as its ``.molecules`` property.
+    """
+    return create_molecule_set(parse_smiles_stream(file))
+
+
+def calculate_molecule_matches(molecules: Iterable[Tuple[str, str]]) -> MoleculeSet:
     """
-    Calculate molecule matches of all SMARTS in the database given a molecule file,
+    Calculate molecule matches of all SMARTS in the database given a set of molecules,
     and store the Molecule and Match instances in the database.
 
-    :param uploaded_molecules_file: An open file handle to a molecule file to match
+    The molecules are matched in parallel chunks by the configured matching backend, see
+    :func:`smartsexplore.molecules.matching.match_molecules`. Depending on the MATCH_STORAGE app
+    config value, the matches are inserted in bulk as :class:`Match` rows (``'rows'``, see
+    :func:`store_matches`), or stored as one compressed bitmap per molecule set (``'bitmap'``, see
+    :func:`store_match_bitmap`).
+
+    :param molecules: An iterable of (SMILES pattern, name) tuples of the molecules to match, e.g.
+        as yielded by :func:`smartsexplore.parsers.parse_smiles_stream`.
     """
-    import tempfile
-    import sys
-    from smartsexplore.util import run_process
-    moleculefile, smartsfile, moleculematchfile = [None] * 3
+    from smartsexplore.molecules.matching import match_molecules, get_matching_backend
 
-    # get all SMARTS patterns in file
     mol_set = None
     try:
         session = get_session()
-        mol_set = create_molecules_from_smiles_file(uploaded_molecules_file)
-        moleculefile, _ = molecules_to_temporary_smiles_file(mol_set.molecules)
+        mol_set = create_molecule_set(molecules)
         try:
-            smartsfile = write_smarts_to_tempfile()
+            backend = get_matching_backend(session)
         except NoSMARTSException:
             session.commit()
             return mol_set
 
-        # Run moleculematch on the temporary SMARTS file, and write the
-        # stdout to a new temporary result output file.
-        moleculematchfile = tempfile.NamedTemporaryFile(mode='w+')
-        match_cmd = [
-            current_app.config['MATCHTOOL_PATH'],
-            '-i', '2',
-            '-m', moleculefile.name,
-            '-s', smartsfile.name
+        molecules = [
+            (molecule_id, pattern) for molecule_id, pattern in
+            session.query(Molecule.id, Molecule.pattern)
+            .filter_by(molset_id=mol_set.id).order_by(Molecule.id)
         ]
-        run_process(match_cmd, stdout=moleculematchfile, stderr=sys.stderr, reraise_exceptions=True)
-        moleculematchfile.seek(0)
-
-        # Parse the moleculematch output
-        parse_iterator = parse_moleculematch(moleculematchfile)
-
-        # --- Code to store results in the database starts here ---
-        for (smartsid, moleculeid) in parse_iterator:
-            mmol = session.query(Molecule).get(moleculeid)
-            msmarts = session.query(SMARTS).get(smartsid)
-            newmatch = Match(molecule=mmol, smarts=msmarts)
-            session.add(newmatch)
+        matches = match_molecules(molecules, backend)
+        storage = current_app.config['MATCH_STORAGE']
+        if storage == 'rows':
+            nof_matches = store_matches(session, matches)
+        elif storage == 'bitmap':
+            nof_matches = store_match_bitmap(session, mol_set, molecules, matches)
+        else:
+            raise ValueError(f"Unknown match storage: {storage}. Must be one of [rows, bitmap].")
+        logging.info(f"Stored {nof_matches} matches for {len(molecules)} molecules.")
+        MOLECULE_SET_MATCHES.observe(nof_matches)
+        stats = getattr(backend, 'stats', None)
+        if stats is not None and (stats.tested or stats.screened):
+            logging.info(f"Pattern tests: {stats}, "
+                         f"{stats.saved_ratio:.1%} saved by pruning and pre-screening.")
 
         # Commit the session
         session.commit()
@@ -99,15 +119,186 @@ def calculate_molecule_matches(uploaded_molecules_file: BinaryIO) -> MoleculeSet
     except Exception as e:
         if mol_set is not None:  # clean up molset if exception occurred
             session = get_session()
+            session.rollback()
             session.delete(mol_set)
             session.commit()
+            forget_match_counts(mol_set.id)
         raise e
-    finally:  # close all open file handles
-        if uploaded_molecules_file:
-            uploaded_molecules_file.close()
-        if moleculefile:
-            moleculefile.close()
-        if smartsfile:
-            smartsfile.close()
-        if moleculematchfile:
-            moleculematchfile.close()
+
+
+def store_matches(session, matches: Iterable[Tuple[int, int]], batch_size: int = 10000) -> int:
+    """
+    Stores (SMARTS ID, molecule ID) matches as :class:`Match` rows, using bulk inserts of
+    ``batch_size`` rows each rather than creating ORM objects. Does not commit the session.
+
+    :param session: The SQLAlchemy session to insert the matches with.
+    :param matches: An iterable of (SMARTS ID, molecule ID) tuples, e.g. as yielded by
+        :func:`smartsexplore.parsers.parse_moleculematch`.
+    :param batch_size: The number of rows to insert per statement.
+    :returns: The number of stored matches.
+    """
+    insert = Match.__table__.insert()
+    nof_matches = 0
+    batch = []
+    for smarts_id, molecule_id in matches:
+        batch.append({'smarts_id': smarts_id, 'molecule_id': molecule_id})
+        if len(batch) >= batch_size:
+            session.execute(insert, batch)
+            nof_matches += len(batch)
+            batch = []
+    if batch:
+        session.execute(insert, batch)
+        nof_matches += len(batch)
+    return nof_matches
+
+
+def store_match_bitmap(session, mol_set: MoleculeSet, molecules: Sequence[Tuple[int, str]],
+                       matches: Iterable[Tuple[int, int]]) -> int:
+    """
+    Stores (SMARTS ID, molecule ID) matches of a molecule set as one compressed
+    :class:`smartsexplore.database.bitmap.MatchBitmap` over the molecules and all SMARTS in the
+    database, instead of one :class:`Match` row per match, along with the number of matching
+    molecules per SMARTS (see :class:`smartsexplore.database.MoleculeSetSMARTSCount`). Does not
+    commit the session.
+
+    :param session: The SQLAlchemy session to store the matches with.
+    :param mol_set: The molecule set the matches belong to.
+    :param molecules: A sequence of (molecule ID, SMILES pattern) tuples of all molecules of the
+        molecule set.
+    :param matches: An iterable of (SMARTS ID, molecule ID) tuples.
+    :returns: The number of stored matches.
+    """
+    from smartsexplore.database.bitmap import MatchBitmap
+
+    smarts_ids = [smarts_id for smarts_id, in session.query(SMARTS.id)]
+    bitmap = MatchBitmap.from_matches([molecule_id for molecule_id, _ in molecules], smarts_ids,
+                                      matches)
+    session.add(MoleculeSetMatches(mol_set, bitmap))
+    smarts_counts = MoleculeSetSMARTSCount.rows_from_bitmap(mol_set.id, bitmap)
+    if smarts_counts:
+        session.execute(MoleculeSetSMARTSCount.__table__.insert(), smarts_counts)
+    return len(bitmap)
+
+
+def molecules_matching_smarts(session, smarts_id: int, molset_ids: Optional[Sequence[int]] = None,
+                              after: Optional[int] = None, limit: int = 100
+                              ) -> Tuple[List[Tuple[int, str, int]], Dict[int, int]]:
+    """
+    Looks up the molecules matching a SMARTS, across all molecule sets, regardless of whether
+    their matches are stored as :class:`Match` rows (looked up via the index on
+    ``Match.smarts_id``) or as a match bitmap (of which only those of the molecule sets with
+    matching molecules are decompressed, as looked up via the index on
+    ``MoleculeSetSMARTSCount.smarts_id``).
+
+    Pages through the molecules by ascending molecule ID ("keyset pagination"), i.e., the next
+    page starts after the last molecule ID of the previous page.
+
+    :param session: The SQLAlchemy session to query with.
+    :param smarts_id: The ID of the SMARTS.
+    :param molset_ids: An optional sequence of molecule set IDs to restrict the lookup to.
+    :param after: An optional molecule ID; only molecules with larger IDs are returned.
+    :param limit: The maximum number of molecules to return.
+    :returns: A tuple of:
+
+      * A list of at most ``limit`` (molecule ID, molecule name, molecule set ID) tuples, ordered
+        by molecule ID
+      * A dictionary mapping the ID of each molecule set with matching molecules to its number of
+        matching molecules (regardless of ``after`` and ``limit``)
+    """
+    ids_query = session.query(Match.molecule_id).filter(Match.smarts_id == smarts_id)
+    counts_query = session.query(Molecule.molset_id, func.count(Match.id))\
+        .select_from(Match).join(Molecule, Match.molecule_id == Molecule.id)\
+        .filter(Match.smarts_id == smarts_id)
+    bitmap_counts_query = session.query(MoleculeSetSMARTSCount.molset_id,
+                                        MoleculeSetSMARTSCount.nof_molecules)\
+        .filter(MoleculeSetSMARTSCount.smarts_id == smarts_id)
+    if molset_ids is not None:
+        ids_query = ids_query.join(Molecule, Match.molecule_id == Molecule.id)\
+            .filter(Molecule.molset_id.in_(molset_ids))
+        counts_query = counts_query.filter(Molecule.molset_id.in_(molset_ids))
+        bitmap_counts_query = bitmap_counts_query\
+            .filter(MoleculeSetSMARTSCount.molset_id.in_(molset_ids))
+    if after is not None:
+        ids_query = ids_query.filter(Match.molecule_id > after)
+
+    molecule_ids = [molecule_id for molecule_id, in
+                    ids_query.order_by(Match.molecule_id).limit(limit)]
+    counts = dict(counts_query.group_by(Molecule.molset_id))
+    bitmap_counts = dict(bitmap_counts_query)
+    counts.update(bitmap_counts)
+    if bitmap_counts:
+        bitmaps_query = session.query(MoleculeSetMatches)\
+            .filter(MoleculeSetMatches.molset_id.in_(list(bitmap_counts)))
+        for stored in bitmaps_query:
+            molecule_ids.extend(molecule_id for molecule_id in
+                                stored.to_bitmap().molecules_for_smarts(smarts_id)
+                                if after is None or molecule_id > after)
+    molecule_ids = heapq.nsmallest(limit, molecule_ids)
+
+    molecules = {
+        molecule_id: (molecule_id, name, molset_id) for molecule_id, name, molset_id in
+        session.query(Molecule.id, Molecule.name, Molecule.molset_id)
+        .filter(Molecule.id.in_(molecule_ids))
+    }
+    return [molecules[molecule_id] for molecule_id in molecule_ids], counts
+
+
+_match_counts_lock = threading.Lock()
+"""Cached results of :func:`match_counts`, keyed by (database URL, molecule set ID), least
+recently used first"""
+_match_counts_cache: 'OrderedDict[Tuple[str, int], Tuple[int, Dict[int, int]]]' = OrderedDict()
+
+
+def match_counts(session, molset_id: int) -> Tuple[int, Dict[int, int]]:
+    """
+    Counts the matching molecules of each SMARTS within a molecule set, with a GROUP BY query for
+    matches stored as :class:`Match` rows, or a vectorized pass over the match bitmap otherwise.
+
+    Since the matches of a molecule set do not change after upload, the results are cached in
+    this process for the MATCH_COUNTS_CACHE_SIZE most recently used molecule sets. Deleting a
+    molecule set should call :func:`forget_match_counts`; the caches of other processes are not
+    cleared, which is safe because the IDs of deleted molecule sets are never reused (see
+    :class:`smartsexplore.database.MoleculeSet`).
+
+    Must be called from within a Flask appcontext.
+
+    :param session: The SQLAlchemy session to query with.
+    :param molset_id: The ID of the molecule set.
+    :returns: A tuple of the number of molecules of the molecule set, and a dictionary mapping the
+        ID of each SMARTS that matches any of its molecules to its number of matching molecules.
+    """
+    key = (current_app.config['DATABASE'], molset_id)
+    with _match_counts_lock:
+        record_cache_lookup('match_counts', key in _match_counts_cache)
+        if key in _match_counts_cache:
+            _match_counts_cache.move_to_end(key)
+            return _match_counts_cache[key]
+
+    nof_molecules = session.query(func.count(Molecule.id)).filter_by(molset_id=molset_id).scalar()
+    stored = session.query(MoleculeSetMatches).get(molset_id)
+    if stored is not None:
+        counts = stored.to_bitmap().smarts_counts()
+    else:
+        counts = dict(
+            session.query(Match.smarts_id, func.count(Match.id))
+            .join(Molecule, Match.molecule_id == Molecule.id)
+            .filter(Molecule.molset_id == molset_id)
+            .group_by(Match.smarts_id)
+        )
+
+    with _match_counts_lock:
+        _match_counts_cache[key] = (nof_molecules, counts)
+        while len(_match_counts_cache) > max(current_app.config['MATCH_COUNTS_CACHE_SIZE'], 0):
+            _match_counts_cache.popitem(last=False)
+    return nof_molecules, counts
+
+
+def forget_match_counts(molset_id: int) -> None:
+    """
+    Removes the cached result of :func:`match_counts` for a molecule set in this process, e.g.
+    because it was deleted.
+
+    Must be called from within a Flask appcontext.
+    """
+    with _match_counts_lock:
+        _match_counts_cache.pop((current_app.config['DATABASE'], molset_id), None)
@@ -0,0 +1,141 @@
+"""
+Flask management commands for this modular app. Try ``flask molecules``.
+
+Exposes commands for:
+
+    * screening large molecule files against all SMARTS in the database, without storing the
+      molecules or matches in the database (:func:`screen_command`)
+    * reporting how many (molecule, SMARTS) pairs the pre-screen rules out per SMARTS library
+      (:func:`prescreen_command`)
+    * evicting old molecule sets with their matches and images (:func:`gc_command`)
+"""
+
+import click
+from flask import current_app, Blueprint
+from flask.cli import with_appcontext
+
+from smartsexplore.database import SMARTS, get_session, get_smarts_set_version, \
+    NoSMARTSException
+from smartsexplore.molecules.matching import screen_molecules, get_max_workers, \
+    get_matching_backend
+from smartsexplore.parsers import parse_smiles
+
+
+def attach_to_blueprint(blueprint: Blueprint):
+    """
+    Attaches all available commands to the given :class:`flask.Blueprint` object.
+
+    :param blueprint: The blueprint object to attach the commands to.
+    """
+    blueprint.cli.command('screen')(screen_command)
+    blueprint.cli.command('prescreen')(prescreen_command)
+    blueprint.cli.command('gc')(gc_command)
+
+
+@click.argument('smiles_file', type=click.File('r'))
+@click.argument('output_file', type=click.File('w'))
+@click.option('--chunk-size', type=int, default=None,
+              help='Number of molecules per matcher process. Defaults to MATCHTOOL_CHUNK_SIZE.')
+@with_appcontext
+def screen_command(smiles_file, output_file, chunk_size):
+    """
+    Screen a (large) .smiles file against all SMARTS in the db.
+
+    Writes one tab-separated line per molecule to the output file, consisting of the molecule's
+    index in the input file (counting from 1), its name, and a comma-separated list of the IDs of
+    all matching SMARTS. Molecules and matches are not stored in the database.
+    """
+    import time
+    from tqdm import tqdm
+
+    chunk_size = chunk_size or current_app.config['MATCHTOOL_CHUNK_SIZE']
+    try:
+        backend = get_matching_backend()
+    except NoSMARTSException:
+        raise click.ClickException('There are no SMARTS in the database to screen against. '
+                                   'Add a SMARTS library first, see: flask smarts add_library')
+    click.echo(f"Screening with {get_max_workers()} parallel {backend.name} matcher processes "
+               f"of {chunk_size} molecules each.", err=True)
+
+    output_file.write(f"# SMARTS set version: {get_smarts_set_version()}\n")
+    output_file.write("# index\tname\tsmarts_ids\n")
+
+    nof_molecules, nof_matches = 0, 0
+    start = time.perf_counter()
+    results = screen_molecules(parse_smiles(smiles_file), backend, chunk_size)
+    for index, name, smarts_ids in tqdm(results, unit='mol', unit_scale=True):
+        output_file.write(f"{index}\t{name}\t{','.join(map(str, smarts_ids))}\n")
+        nof_molecules += 1
+        nof_matches += len(smarts_ids)
+    elapsed = time.perf_counter() - start
+
+    click.echo(f"Screened {nof_molecules} molecules in {elapsed:.1f} s "
+               f"({nof_molecules / max(elapsed, 1e-9):.1f} molecules/s), "
+               f"found {nof_matches} matches.", err=True)
+    stats = getattr(backend, 'stats', None)
+    if stats is not None and (stats.tested or stats.screened):
+        click.echo(f"Pattern tests: {stats.tested} performed, {stats.pruned} pruned, "
+                   f"{stats.inferred} inferred, {stats.screened} pre-screened "
+                   f"({stats.saved_ratio:.1%} saved).", err=True)
+
+
+@click.argument('smiles_file', type=click.File('r'))
+@with_appcontext
+def prescreen_command(smiles_file):
+    """
+    Report the pre-screen's screen-out rates for a .smiles file.
+
+    Prints, per SMARTS library in the db, how many of the (molecule, SMARTS) pairs of the given
+    molecules the cheap pre-screen rules out without matching, and the resulting upper bound on the
+    speedup of matching that library. Nothing is stored in the database.
+    """
+    import time
+    from smartsexplore.molecules.prescreen import prescreen_report
+
+    smarts = get_session().query(SMARTS.id, SMARTS.pattern, SMARTS.library).all()
+    patterns = [pattern for pattern, _ in parse_smiles(smiles_file)]
+
+    start = time.perf_counter()
+    report = prescreen_report(smarts, patterns)
+    elapsed = time.perf_counter() - start
+
+    click.echo(f"Pre-screened {len(patterns)} molecules against {len(smarts)} SMARTS "
+               f"in {elapsed:.2f} s.")
+    click.echo("library\tpairs\tscreened_out\trate\tmax_speedup")
+    for library, (nof_pairs, nof_screened_out) in sorted(report.items()):
+        rate = nof_screened_out / nof_pairs if nof_pairs else 0.0
+        speedup = nof_pairs / (nof_pairs - nof_screened_out) \
+            if nof_pairs > nof_screened_out else float('inf')
+        click.echo(f"{library}\t{nof_pairs}\t{nof_screened_out}\t{rate:.1%}\t{speedup:.2f}x")
+
+
+@click.option('--ttl', type=float, default=None,
+              help='Evict molecule sets not accessed for this many seconds. '
+                   'Defaults to MOLECULE_SET_TTL.')
+@click.option('--budget', type=int, default=None,
+              help='Evict the least recently accessed molecule sets until at most this many '
+                   'molecules remain. Defaults to MOLECULE_SET_BUDGET.')
+@click.option('--dry-run', is_flag=True, help='Only list the molecule sets that would be evicted.')
+@with_appcontext
+def gc_command(ttl, budget, dry_run):
+    """
+    Evict old molecule sets with their matches and images.
+
+    Evicts molecule sets that were not accessed within the TTL, or that exceed the budget on the
+    total number of stored molecules, see :mod:`smartsexplore.molecules.eviction`.
+    """
+    from datetime import timedelta
+    from smartsexplore.molecules.eviction import collect_molecule_sets, \
+        find_evictable_molecule_sets
+
+    ttl = timedelta(seconds=ttl) if ttl is not None else None
+    if dry_run:
+        if ttl is None and current_app.config['MOLECULE_SET_TTL'] is not None:
+            ttl = timedelta(seconds=current_app.config['MOLECULE_SET_TTL'])
+        if budget is None:
+            budget = current_app.config['MOLECULE_SET_BUDGET']
+        molset_ids = find_evictable_molecule_sets(get_session(), ttl=ttl, budget=budget)
+        click.echo(f"Would evict {len(molset_ids)} molecule sets: {molset_ids}")
+    else:
+        molset_ids = collect_molecule_sets(ttl=ttl, budget=budget)
+        click.echo(f"Evicted {len(molset_ids)} molecule sets: {molset_ids}")
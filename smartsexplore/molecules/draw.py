@@ -2,12 +2,20 @@
 Functions for drawing molecule structure diagrams. Uses the ``mol2svg`` NAOMI tool for this purpose.
 """
 
-import math
+import json
+import os
+import re
 import tempfile
+from typing import Dict, Iterable, List
 
 from flask import current_app
 
 from smartsexplore.database import MoleculeSet, molecules_to_temporary_smiles_file
+from smartsexplore.timing import timed
+
+
+"""Matches mol2svg's output file names, capturing the (zero-filled) line number of the molecule"""
+_MOL2SVG_OUTPUT_FILENAME = re.compile(r'^img_0*(\d+)\.svg$')
 
 
 def draw_molecules_from_molset(molset: MoleculeSet) -> None:
@@ -16,46 +24,128 @@ def draw_molecules_from_molset(molset: MoleculeSet) -> None:
     to the static molecule image path defined in the app config (STATIC_MOL2SVG_MOLECULE_SETS_PATH).
 
     A subfolder named by the MoleculeSet's ID will be created under the static path, and the
-    molecule images will be stored inside that folder, named by their IDs ({id}.svg).
+    molecule images will be stored inside that folder, named by their IDs ({id}.svg). Additionally,
+    all images are packed into a single bundle file inside that folder, see
+    :func:`write_molecule_image_bundle`.
+
+    The molecules are split into chunks of MOL2SVG_CHUNK_SIZE molecules, which are rendered by
+    parallel mol2svg processes (at most MOL2SVG_MAX_WORKERS at once, or one per CPU if that is not
+    set), see :func:`draw_molecule_chunk`.
 
     :param molset: The MoleculeSet instance to render all molecules of.
     """
-    import os
-    import shutil
-    from smartsexplore.util import run_process
+    from concurrent.futures import ThreadPoolExecutor
 
-    molfile, line_no_to_molecule_id =\
-        molecules_to_temporary_smiles_file(molset.molecules)
-    # deal with mol2svg's output naming scheme being dependent on the number of input molecules...
-    filename_nof_digits = int(math.ceil(math.log10(len(molset.molecules) + 1)))
+    mol2svg_path = current_app.config['MOL2SVG_PATH']
+    chunk_size = current_app.config['MOL2SVG_CHUNK_SIZE']
+    max_workers = current_app.config['MOL2SVG_MAX_WORKERS'] or os.cpu_count()
 
+    output_dir = os.path.join(
+        current_app.config['STATIC_MOL2SVG_MOLECULE_SETS_PATH'],
+        str(molset.id)
+    )
+    os.makedirs(output_dir, exist_ok=True)
+
+    molecules = molset.molecules
+    chunks = [molecules[i:i+chunk_size] for i in range(0, len(molecules), chunk_size)]
+    # write all input files up front, so that the worker threads don't touch any ORM objects
+    chunk_files = [molecules_to_temporary_smiles_file(chunk) for chunk in chunks]
     try:
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            draw_cmd = [
-                current_app.config['MOL2SVG_PATH'],
-                '-i', molfile.name,
-                # mol2svg will infer img_1.svg, img_2.svg, ... from this
-                '-o', os.path.join(tmpdirname, 'img.svg'),
-                '-a',  # draw all in file, not just first
-                '-P'  # use protonation as-is
+        with timed('subprocess'), \
+                ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+            futures = [
+                executor.submit(draw_molecule_chunk, molfile.name, line_no_to_molecule_id,
+                                mol2svg_path, output_dir)
+                for molfile, line_no_to_molecule_id in chunk_files
             ]
-            run_process(draw_cmd, reraise_exceptions=True)
-
-            output_dir = os.path.join(
-                current_app.config['STATIC_MOL2SVG_MOLECULE_SETS_PATH'],
-                str(molset.id)
-            )
-            os.makedirs(output_dir, exist_ok=True)
-            for line_no, molecule_id in line_no_to_molecule_id.items():
-                # see def. of filename_of_digits above
-                id_ = '{num:{fill}{width}}'.format(num=line_no, fill='0', width=filename_nof_digits)
-                from_file = os.path.join(tmpdirname, f'img_{id_}.svg')
-                to_file = os.path.join(output_dir, f'{molecule_id:d}.svg')
-                if os.path.isfile(from_file):
-                    shutil.move(from_file, to_file)
-                else:
+            for future in futures:
+                for molecule_id in future.result():
                     current_app.logger.warning(
-                        f'Could not find expected mol2svg output file: {from_file}!'
+                        f'mol2svg did not draw an image for molecule {molecule_id}!'
                     )
     finally:
-        molfile.close()
+        for molfile, _ in chunk_files:
+            molfile.close()
+
+    with timed('file_io'):
+        write_molecule_image_bundle(output_dir, (molecule.id for molecule in molecules))
+
+
+def draw_molecule_chunk(smiles_filename: str, line_no_to_molecule_id: Dict[int, int],
+                        mol2svg_path: str, output_dir: str) -> List[int]:
+    """
+    Draws all molecules in a .smiles file (as written by
+    :func:`smartsexplore.database.molecules_to_temporary_smiles_file`) with a single mol2svg
+    process, and stores the images in the output directory, named by the molecules' IDs ({id}.svg).
+
+    mol2svg names its output files by line number, left-filled with zeros (img_1.svg or
+    img_001.svg, ...). The line number is parsed back from each output file name and mapped to
+    the molecule ID, so the output naming does not have to be predicted. mol2svg writes into a
+    temporary directory inside the output directory, from which the images are renamed into
+    place without being copied.
+
+    Does not require a Flask app context, so that it can run in a worker thread.
+
+    :param smiles_filename: The name of the .smiles file of the molecules to draw.
+    :param line_no_to_molecule_id: A dictionary mapping line numbers of the .smiles file to
+        molecule IDs.
+    :param mol2svg_path: The path to the mol2svg binary.
+    :param output_dir: The directory to store the drawn images in.
+    :returns: The IDs of all molecules that mol2svg did not draw an image for.
+    """
+    from smartsexplore.util import run_process
+
+    with tempfile.TemporaryDirectory(dir=output_dir, prefix='.mol2svg-') as tmpdirname:
+        draw_cmd = [
+            mol2svg_path,
+            '-i', smiles_filename,
+            # mol2svg will infer img_1.svg, img_2.svg, ... from this
+            '-o', os.path.join(tmpdirname, 'img.svg'),
+            '-a',  # draw all in file, not just first
+            '-P'  # use protonation as-is
+        ]
+        run_process(draw_cmd, reraise_exceptions=True)
+
+        drawn_molecule_ids = set()
+        for filename in os.listdir(tmpdirname):
+            m = _MOL2SVG_OUTPUT_FILENAME.match(filename)
+            if m is None or int(m.group(1)) not in line_no_to_molecule_id:
+                continue
+            molecule_id = line_no_to_molecule_id[int(m.group(1))]
+            os.replace(os.path.join(tmpdirname, filename),
+                       os.path.join(output_dir, f'{molecule_id:d}.svg'))
+            drawn_molecule_ids.add(molecule_id)
+
+    return [molecule_id for molecule_id in line_no_to_molecule_id.values()
+            if molecule_id not in drawn_molecule_ids]
+
+
+"""The filename of the per-molecule-set image bundle written by :func:`write_molecule_image_bundle`"""
+MOLECULE_IMAGE_BUNDLE_FILENAME = 'images.json'
+
+
+def write_molecule_image_bundle(output_dir: str, molecule_ids: Iterable[int]) -> None:
+    """
+    Packs the rendered images ({id}.svg) of the given molecules in a molecule set's image
+    directory into a single JSON file, mapping each molecule ID to its SVG source. Molecules
+    without a rendered image are left out.
+
+    The bundle is written to a temporary file first and then moved into place, so that readers
+    never see a partially written bundle.
+
+    :param output_dir: The image directory of a molecule set, as written to by
+        :func:`draw_molecules_from_molset`.
+    :param molecule_ids: The IDs of the molecules to include in the bundle.
+    """
+    images = {}
+    for molecule_id in molecule_ids:
+        try:
+            with open(os.path.join(output_dir, f'{molecule_id:d}.svg'), 'r') as file:
+                images[str(molecule_id)] = file.read()
+        except FileNotFoundError:
+            continue
+
+    with tempfile.NamedTemporaryFile(mode='w', dir=output_dir, suffix='.json',
+                                     delete=False) as bundle_file:
+        json.dump(images, bundle_file)
+    os.replace(bundle_file.name, os.path.join(output_dir, MOLECULE_IMAGE_BUNDLE_FILENAME))
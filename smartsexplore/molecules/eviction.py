@@ -0,0 +1,220 @@
+"""
+Garbage collection of uploaded molecule sets: evicts molecule sets that were not accessed for
+longer than a TTL, or that exceed a budget on the total number of stored molecules, along with
+their molecules, matches and rendered images.
+
+Eviction is configured by the app config values:
+
+* MOLECULE_SET_TTL: The number of seconds after its last access that a molecule set is evicted,
+  or None to never evict by age.
+* MOLECULE_SET_BUDGET: The maximum total number of molecules of all molecule sets, or None for no
+  limit. The least recently accessed molecule sets are evicted first.
+* MOLECULE_SET_GC_INTERVAL: The number of seconds between two runs of the background sweeper
+  started by :func:`start_sweeper` (in one server process only), or None to not run it (use
+  ``flask molecules gc`` instead, e.g. from cron).
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import func, or_
+
+from smartsexplore.database import get_session, Match, Molecule, MoleculeSet, MoleculeSetMatches, \
+    MoleculeSetSMARTSCount
+
+
+"""Molecule sets accessed within this period are never evicted by the budget, so that uploads
+that are still being processed are not evicted"""
+BUDGET_GRACE_PERIOD = timedelta(minutes=5)
+"""Molecule sets whose last access was recorded within this period are not touched again, so
+that frequent accesses do not cause a database write each"""
+TOUCH_INTERVAL = timedelta(minutes=1)
+
+
+def touch_molecule_set(session, molset_id: int) -> None:
+    """
+    Records an access to a molecule set, see
+    :attr:`smartsexplore.database.MoleculeSet.last_accessed`. Commits the session if the access was
+    recorded.
+
+    :param session: The SQLAlchemy session to update with.
+    :param molset_id: The ID of the accessed molecule set.
+    """
+    now = datetime.utcnow()
+    nof_updated = session.query(MoleculeSet)\
+        .filter(MoleculeSet.id == molset_id)\
+        .filter(or_(MoleculeSet.last_accessed.is_(None),
+                    MoleculeSet.last_accessed < now - TOUCH_INTERVAL))\
+        .update({MoleculeSet.last_accessed: now}, synchronize_session=False)
+    if nof_updated:
+        session.commit()
+
+
+def find_evictable_molecule_sets(session, ttl: Optional[timedelta] = None,
+                                 budget: Optional[int] = None,
+                                 now: Optional[datetime] = None) -> List[int]:
+    """
+    Determines the molecule sets to evict.
+
+    :param session: The SQLAlchemy session to query with.
+    :param ttl: Evict all molecule sets not accessed for longer than this, if given.
+    :param budget: Evict the least recently accessed molecule sets until the remaining ones have
+        at most this many molecules in total, if given: all molecule sets accessed before the
+        first one that does not fit into the budget anymore are evicted, even if smaller ones
+        would still fit. Molecule sets accessed within the :data:`BUDGET_GRACE_PERIOD` are never
+        evicted by the budget.
+    :param now: The current time (UTC). Defaults to ``datetime.utcnow()``.
+    :returns: The IDs of the molecule sets to evict.
+    """
+    now = now or datetime.utcnow()
+    molsets = session.query(MoleculeSet.id, MoleculeSet.last_accessed, func.count(Molecule.id))\
+        .outerjoin(Molecule, Molecule.molset_id == MoleculeSet.id)\
+        .group_by(MoleculeSet.id)\
+        .order_by(MoleculeSet.last_accessed.desc(), MoleculeSet.id.desc())
+
+    evictable = []
+    nof_kept_molecules = 0
+    over_budget = False
+    for molset_id, last_accessed, nof_molecules in molsets:
+        last_accessed = last_accessed or datetime.min
+        if ttl is not None and last_accessed < now - ttl:
+            evictable.append(molset_id)
+        elif budget is not None and last_accessed < now - BUDGET_GRACE_PERIOD \
+                and (over_budget or nof_kept_molecules + nof_molecules > budget):
+            # least recently used first: all less recently accessed molecule sets are evicted too
+            over_budget = True
+            evictable.append(molset_id)
+        else:
+            nof_kept_molecules += nof_molecules
+    return evictable
+
+
+def evict_molecule_sets(session, molset_ids: List[int]) -> None:
+    """
+    Deletes molecule sets with all of their molecules, matches and rendered images. Deletes the
+    rows in bulk rather than loading them into ORM objects, and reclaims the freed space of SQLite
+    databases with an incremental VACUUM.
+
+    Must be called from within a Flask appcontext.
+
+    :param session: The SQLAlchemy session to delete with. Is committed.
+    :param molset_ids: The IDs of the molecule sets to evict.
+    """
+    from smartsexplore.molecules.actions import forget_match_counts
+
+    if not molset_ids:
+        return
+    molecule_ids = session.query(Molecule.id).filter(Molecule.molset_id.in_(molset_ids))
+    session.query(Match).filter(Match.molecule_id.in_(molecule_ids))\
+        .delete(synchronize_session=False)
+    session.query(MoleculeSetMatches).filter(MoleculeSetMatches.molset_id.in_(molset_ids))\
+        .delete(synchronize_session=False)
+    session.query(MoleculeSetSMARTSCount)\
+        .filter(MoleculeSetSMARTSCount.molset_id.in_(molset_ids))\
+        .delete(synchronize_session=False)
+    session.query(Molecule).filter(Molecule.molset_id.in_(molset_ids))\
+        .delete(synchronize_session=False)
+    session.query(MoleculeSet).filter(MoleculeSet.id.in_(molset_ids))\
+        .delete(synchronize_session=False)
+    session.commit()
+
+    for molset_id in molset_ids:
+        forget_match_counts(molset_id)
+        shutil.rmtree(
+            os.path.join(current_app.config['STATIC_MOL2SVG_MOLECULE_SETS_PATH'], str(molset_id)),
+            ignore_errors=True
+        )
+
+    if session.bind.dialect.name == 'sqlite':
+        # the pragma frees one page per result row, which pysqlite only steps through (and thus
+        # frees all pages) if it is run as a script
+        session.connection().connection.executescript('PRAGMA incremental_vacuum;')
+        session.commit()
+
+
+def collect_molecule_sets(session=None, ttl: Optional[timedelta] = None,
+                          budget: Optional[int] = None) -> List[int]:
+    """
+    Evicts all molecule sets that are past the TTL or beyond the budget, see
+    :func:`find_evictable_molecule_sets` and :func:`evict_molecule_sets`.
+
+    Must be called from within a Flask appcontext.
+
+    :param session: An optional SQLAlchemy session to use. Uses
+        :func:`smartsexplore.database.get_session` if not given.
+    :param ttl: The TTL. Defaults to the MOLECULE_SET_TTL app config value.
+    :param budget: The budget. Defaults to the MOLECULE_SET_BUDGET app config value.
+    :returns: The IDs of the evicted molecule sets.
+    """
+    session = session or get_session()
+    if ttl is None and current_app.config['MOLECULE_SET_TTL'] is not None:
+        ttl = timedelta(seconds=current_app.config['MOLECULE_SET_TTL'])
+    if budget is None:
+        budget = current_app.config['MOLECULE_SET_BUDGET']
+
+    molset_ids = find_evictable_molecule_sets(session, ttl=ttl, budget=budget)
+    evict_molecule_sets(session, molset_ids)
+    if molset_ids:
+        logging.info(f"Evicted {len(molset_ids)} molecule sets: {molset_ids}")
+    return molset_ids
+
+
+def _acquire_sweeper_lock(path: str):
+    """
+    Tries to acquire the exclusive lock on the sweeper lock file, without blocking.
+
+    :returns: The open lock file, which holds the lock until it is closed (or the process exits),
+        or None if another process holds the lock.
+    """
+    import fcntl
+
+    lock_file = open(path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def start_sweeper(app: Flask) -> Optional[threading.Thread]:
+    """
+    Starts a daemon thread that runs :func:`collect_molecule_sets` every MOLECULE_SET_GC_INTERVAL
+    seconds, if that app config value is set.
+
+    Every process creating the app (e.g., each server worker process) starts the thread, but only
+    one of them sweeps at a time: the thread only sweeps while its process holds the lock on the
+    ``molecule_set_gc.lock`` file in the instance folder, which it tries to acquire before each
+    run, so that another process takes over if the sweeping one exits. Short-lived processes,
+    like ``flask`` management commands, exit before the first run.
+
+    :param app: The Flask app to run the sweeper for.
+    :returns: The started thread, or None if no sweeper is configured.
+    """
+    interval = app.config['MOLECULE_SET_GC_INTERVAL']
+    if not interval:
+        return None
+    lock_path = os.path.join(app.instance_path, 'molecule_set_gc.lock')
+
+    def _sweep():
+        lock_file = None
+        while True:
+            time.sleep(interval)
+            if lock_file is None:
+                lock_file = _acquire_sweeper_lock(lock_path)
+                if lock_file is None:  # another process sweeps
+                    continue
+            try:
+                with app.app_context():
+                    collect_molecule_sets()
+            except Exception as e:
+                logging.error(f"Molecule set garbage collection failed: {e}")
+
+    thread = threading.Thread(target=_sweep, name='molecule-set-sweeper', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,184 @@
+"""
+Hierarchical SMARTS matching, pruned by the subset relationships between SMARTS that are stored as
+:class:`smartsexplore.database.DirectedEdge` objects.
+
+A directed edge from SMARTS A to SMARTS B states that A describes a subset of B, i.e. every molecule
+matched by A is also matched by B. Therefore, if the more general B does not match a molecule,
+none of the more specific SMARTS with an edge to B can match it either, and need not be tested.
+SMARTS that are subsets of each other (cycles in the subset graph) match exactly the same
+molecules, so only one of them needs to be tested.
+"""
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+
+class PruningStats:
+    """
+    Counts the pattern tests performed and saved by :meth:`SubsetHierarchy.match`, and by the
+    pre-screen of :mod:`smartsexplore.molecules.prescreen`.
+    """
+
+    def __init__(self, tested: int = 0, pruned: int = 0, inferred: int = 0, screened: int = 0):
+        """
+        :param tested: The number of pattern tests performed.
+        :param pruned: The number of pattern tests skipped because a more general pattern did not
+            match, or an equivalent pattern did not match.
+        :param inferred: The number of pattern tests skipped because an equivalent pattern matched.
+        :param screened: The number of pattern tests skipped because the pre-screen ruled out a
+            match.
+        """
+        self.tested = tested
+        self.pruned = pruned
+        self.inferred = inferred
+        self.screened = screened
+
+    def __add__(self, other: 'PruningStats') -> 'PruningStats':
+        return PruningStats(self.tested + other.tested, self.pruned + other.pruned,
+                            self.inferred + other.inferred, self.screened + other.screened)
+
+    def __repr__(self):
+        return f"<PruningStats(tested={self.tested}, pruned={self.pruned}, "\
+               f"inferred={self.inferred}, screened={self.screened})>"
+
+    @property
+    def saved_ratio(self) -> float:
+        """The fraction of all pattern tests that were saved by pruning, inference or the
+        pre-screen."""
+        saved = self.pruned + self.inferred + self.screened
+        total = self.tested + saved
+        return saved / total if total else 0.0
+
+
+def _strongly_connected_components(nodes: Iterable[int],
+                                   successors: Dict[int, List[int]]) -> List[List[int]]:
+    """
+    Computes the strongly connected components of a directed graph with (an iterative version of)
+    Tarjan's algorithm.
+
+    :returns: The list of components, each a list of nodes. A component is always listed after all
+        components reachable from it.
+    """
+    index, lowlink = {}, {}
+    stack, on_stack = [], set()
+    components = []
+
+    def _visit(node):
+        index[node] = lowlink[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        return node, iter(successors.get(node, ()))
+
+    for root in nodes:
+        if root in index:
+            continue
+        work = [_visit(root)]
+        while work:
+            node, succs = work[-1]
+            for succ in succs:
+                if succ not in index:
+                    work.append(_visit(succ))
+                    break
+                elif succ in on_stack:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+
+class SubsetHierarchy:
+    """
+    The subset graph of a set of SMARTS, condensed into a DAG of groups of equivalent SMARTS, and
+    ordered from the most general to the most specific SMARTS.
+    """
+
+    def __init__(self, smarts_ids: Iterable[int], edges: Iterable[Tuple[int, int]]):
+        """
+        :param smarts_ids: The IDs of all SMARTS to match.
+        :param edges: (from ID, to ID) tuples of all subset relationships, where the SMARTS with
+            the from ID describes a subset of the SMARTS with the to ID. Edges to or from SMARTS
+            that are not in ``smarts_ids`` are ignored.
+        """
+        smarts_ids = sorted(set(smarts_ids))
+        known_ids = set(smarts_ids)
+        successors = {}
+        for from_id, to_id in edges:
+            if from_id in known_ids and to_id in known_ids and from_id != to_id:
+                successors.setdefault(from_id, []).append(to_id)
+
+        # groups of equivalent SMARTS IDs, more general groups first
+        self.components = [
+            sorted(component)
+            for component in _strongly_connected_components(smarts_ids, successors)
+        ]
+        component_of = {
+            smarts_id: i for i, component in enumerate(self.components) for smarts_id in component
+        }
+        # for each group, the indices of the directly more general groups
+        self.parents = [
+            sorted({
+                component_of[to_id]
+                for smarts_id in component for to_id in successors.get(smarts_id, ())
+            } - {i})
+            for i, component in enumerate(self.components)
+        ]
+
+    @classmethod
+    def from_db(cls, session) -> 'SubsetHierarchy':
+        """
+        Creates the subset hierarchy of all SMARTS and DirectedEdges in the database.
+
+        :param session: The SQLAlchemy session to query with.
+        """
+        from smartsexplore.database import SMARTS, DirectedEdge
+        return cls(
+            (smarts_id for smarts_id, in session.query(SMARTS.id)),
+            session.query(DirectedEdge.from_id, DirectedEdge.to_id)
+        )
+
+    def match(self, test: Callable[[int], bool]) -> Tuple[Set[int], PruningStats]:
+        """
+        Matches one molecule against all SMARTS of the hierarchy, from the most general to the most
+        specific SMARTS. A group of equivalent SMARTS is only tested (once, for its smallest ID)
+        if all of its more general groups matched.
+
+        :param test: A function that tests whether the SMARTS with the given ID matches the
+            molecule.
+        :returns: A tuple of the set of matching SMARTS IDs, and the :class:`PruningStats` of this
+            matching.
+        """
+        stats = PruningStats()
+        component_matched = [False] * len(self.components)
+        matched_ids = set()
+        for i, component in enumerate(self.components):
+            if not all(component_matched[parent] for parent in self.parents[i]):
+                stats.pruned += len(component)
+                continue
+            stats.tested += 1
+            if test(component[0]):
+                component_matched[i] = True
+                matched_ids.update(component)
+                stats.inferred += len(component) - 1
+            else:
+                stats.pruned += len(component) - 1
+        return matched_ids, stats
+
+
+def brute_force_match(smarts_ids: Iterable[int], test: Callable[[int], bool]) -> Set[int]:
+    """
+    Matches one molecule against all given SMARTS without any pruning, as a reference for
+    :meth:`SubsetHierarchy.match`.
+
+    :returns: The set of matching SMARTS IDs.
+    """
+    return {smarts_id for smarts_id in smarts_ids if test(smarts_id)}
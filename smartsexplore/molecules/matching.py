@@ -0,0 +1,543 @@
+"""
+A matching engine that matches molecules against all SMARTS in the database, in parallel on chunks
+of the molecules. The actual matching is done by a pluggable :class:`MatchingBackend`:
+
+* :class:`ExternalMatchingBackend` (the default) runs the ``SMARTSMoleculeMatcher`` NAOMI tool,
+  one process per chunk.
+* :class:`RDKitMatchingBackend` matches in-process with RDKit, using a pool of worker processes
+  that keep the compiled SMARTS patterns cached per SMARTS set version. Requires the optional
+  ``rdkit`` package. Can prune matching by the subset relationships between SMARTS, see
+  :mod:`smartsexplore.molecules.hierarchy`.
+
+Both backends can skip (molecule, SMARTS) pairs that cannot match with the cheap pre-screen of
+:mod:`smartsexplore.molecules.prescreen`, if the MATCHING_PRESCREEN app config value is set.
+
+Which backend is used is defined by the MATCHING_BACKEND app config value (``'external'`` or
+``'rdkit'``), see :func:`get_matching_backend`.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from flask import current_app
+from sqlalchemy import func
+
+from smartsexplore.database import SMARTS, DirectedEdge, get_session, get_smarts_export_file, \
+    get_smarts_set_version, NoSMARTSException
+from smartsexplore.metrics import record_cache_lookup
+from smartsexplore.molecules.hierarchy import PruningStats, SubsetHierarchy
+from smartsexplore.molecules.prescreen import Prescreen
+from smartsexplore.parsers import parse_moleculematch
+from smartsexplore.timing import timed_iter
+from smartsexplore.util import ram_tempfile, stream_process
+
+
+"""A chunk of molecules to match, as a sequence of (label, SMILES pattern) tuples"""
+Chunk = Sequence[Tuple[int, str]]
+"""The matches of a chunk of molecules, as a list of (SMARTS ID, molecule label) tuples"""
+ChunkMatches = List[Tuple[int, int]]
+
+
+def get_max_workers() -> int:
+    """
+    Gets the maximum number of matcher processes to run in parallel, as defined by the
+    MATCHTOOL_MAX_WORKERS app config value, or the number of CPUs if that is not set.
+
+    Must be called from within a Flask appcontext.
+    """
+    return current_app.config['MATCHTOOL_MAX_WORKERS'] or os.cpu_count() or 1
+
+
+def _map_chunks(executor: Executor, fn: Callable[[Chunk], ChunkMatches],
+                chunks: Iterable[Chunk], max_pending: int) -> Iterator[ChunkMatches]:
+    """
+    Maps ``fn`` over the chunks on the executor, like ``executor.map``, but consumes the chunks
+    lazily: at most ``max_pending`` chunks are submitted and not yet yielded at any time.
+
+    :returns: An iterator over the results of ``fn`` for all chunks, in the order of the chunks.
+    """
+    chunks = iter(chunks)
+    pending = []
+    try:
+        while True:
+            while len(pending) < max_pending:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.append(executor.submit(fn, chunk))
+            if not pending:
+                return
+            yield pending.pop(0).result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class MatchingBackend:
+    """
+    The interface of all matching backends. A backend instance matches molecules against one fixed
+    set of SMARTS, e.g. all SMARTS in the database at the time the backend was created.
+    """
+
+    """The name of the backend, as used for the MATCHING_BACKEND app config value"""
+    name = None
+
+    def match_chunks(self, chunks: Iterable[Chunk]) -> Iterator[ChunkMatches]:
+        """
+        Matches chunks of molecules against the SMARTS of this backend, in parallel. The chunks
+        are consumed lazily, so that only a bounded number of them is held in memory at any time.
+
+        :param chunks: An iterable of chunks, each a sequence of (label, SMILES pattern) tuples,
+            where each label is an integer identifying the molecule (e.g., its ID).
+        :returns: An iterator over the match lists of all chunks, each a list of
+            (SMARTS ID, molecule label) tuples, in the order of the chunks.
+        :raises: An exception if matching any of the chunks fails.
+        """
+        raise NotImplementedError
+
+
+class ExternalMatchingBackend(MatchingBackend):
+    """
+    A matching backend that runs one SMARTSMoleculeMatcher process per chunk of molecules, at most
+    ``max_workers`` at once.
+
+    Optionally, molecules that the pre-screen rules out for all SMARTS are not passed to the
+    matcher at all. The number of pattern tests performed and saved this way is accumulated in
+    :attr:`stats`.
+    """
+    name = 'external'
+
+    def __init__(self, smarts_filename: str, matchtool_path: str, max_workers: int,
+                 prescreen: Optional[Prescreen] = None):
+        """
+        :param smarts_filename: The name of a .smarts file labelled by SMARTS IDs, as returned by
+            :func:`smartsexplore.database.get_smarts_export_file`.
+        :param matchtool_path: The path to the SMARTSMoleculeMatcher binary.
+        :param max_workers: The maximum number of matcher processes to run at once.
+        :param prescreen: An optional pre-screen of the SMARTS in the .smarts file.
+        """
+        self.smarts_filename = smarts_filename
+        self.matchtool_path = matchtool_path
+        self.max_workers = max_workers
+        self.prescreen = prescreen
+        self.stats = PruningStats()
+
+    def match_chunk(self, molecules: Chunk) -> ChunkMatches:
+        """
+        Matches a chunk of molecules with a single SMARTSMoleculeMatcher process.
+
+        Does not require a Flask app context, so that it can run in a worker thread.
+
+        :param molecules: A sequence of (label, SMILES pattern) tuples.
+        :returns: A list of all (SMARTS ID, molecule label) matches.
+        """
+        if not molecules:
+            return []
+        with ram_tempfile(mode='w+', suffix='.smiles') as moleculefile:
+            moleculefile.write('\n'.join(f'{pattern}\t{label}' for label, pattern in molecules))
+            moleculefile.flush()
+            match_cmd = [
+                self.matchtool_path,
+                '-i', '2',
+                '-m', moleculefile.name,
+                '-s', self.smarts_filename
+            ]
+            return list(parse_moleculematch(stream_process(match_cmd)))
+
+    def _prescreen_chunk(self, molecules: Chunk) -> Chunk:
+        """
+        Removes all molecules from a chunk that the pre-screen rules out for all SMARTS.
+        """
+        nof_smarts = len(self.prescreen.smarts_ids)
+        feasible = self.prescreen.feasible([pattern for _, pattern in molecules]).any(axis=1)
+        molecules = [molecule for molecule, keep in zip(molecules, feasible) if keep]
+        self.stats.tested += len(molecules) * nof_smarts
+        self.stats.screened += (len(feasible) - len(molecules)) * nof_smarts
+        return molecules
+
+    def match_chunks(self, chunks: Iterable[Chunk]) -> Iterator[ChunkMatches]:
+        if self.prescreen is not None:
+            chunks = (self._prescreen_chunk(chunk) for chunk in chunks)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # keep the workers busy, plus one chunk per worker queued up
+            yield from _map_chunks(executor, self.match_chunk, chunks, 2 * self.max_workers)
+
+
+class _RDKitMatcher:
+    """
+    Matches molecules against compiled SMARTS patterns with RDKit, optionally pruned by a
+    :class:`smartsexplore.molecules.hierarchy.SubsetHierarchy` and a
+    :class:`smartsexplore.molecules.prescreen.Prescreen`.
+    """
+
+    def __init__(self, smarts: Sequence[Tuple[int, str]],
+                 edges: Optional[Sequence[Tuple[int, int]]] = None, prescreen: bool = False):
+        """
+        Compiles the SMARTS patterns into RDKit query molecules. Patterns that RDKit cannot parse
+        are skipped with a warning.
+
+        :param smarts: A sequence of (SMARTS ID, SMARTS pattern) tuples.
+        :param edges: An optional sequence of (from ID, to ID) subset relationships between the
+            SMARTS. If given, matching is pruned by these relationships.
+        :param prescreen: Whether to skip all (molecule, SMARTS) pairs that the pre-screen rules
+            out.
+        """
+        from rdkit import Chem
+
+        self.queries = {}
+        patterns = []
+        for smarts_id, pattern in smarts:
+            query = Chem.MolFromSmarts(pattern)
+            if query is None:
+                logging.warning(f'RDKit could not parse SMARTS {smarts_id}: {pattern}')
+                continue
+            self.queries[smarts_id] = query
+            patterns.append((smarts_id, pattern))
+        self.hierarchy = SubsetHierarchy(self.queries.keys(), edges) \
+            if edges is not None else None
+        self.prescreen = Prescreen(patterns) if prescreen else None
+
+    def match_chunk(self, molecules: Chunk) -> Tuple[ChunkMatches, PruningStats]:
+        """
+        Matches a chunk of molecules. Molecules that RDKit cannot parse do not match any SMARTS.
+
+        :param molecules: A sequence of (label, SMILES pattern) tuples.
+        :returns: A tuple of a list of all (SMARTS ID, molecule label) matches, and the
+            :class:`smartsexplore.molecules.hierarchy.PruningStats` of the chunk.
+        """
+        from rdkit import Chem
+
+        matches = []
+        stats = PruningStats()
+        feasible = self.prescreen.feasible([pattern for _, pattern in molecules]) \
+            if self.prescreen is not None else None
+        for i, (label, pattern) in enumerate(molecules):
+            mol = Chem.MolFromSmiles(pattern)
+            if mol is None:
+                continue
+
+            mol_stats = PruningStats()
+            if feasible is None:
+                test = lambda smarts_id: mol.HasSubstructMatch(self.queries[smarts_id])
+            else:
+                row, column_of = feasible[i], self.prescreen.column_of
+
+                def test(smarts_id):
+                    if not row[column_of[smarts_id]]:
+                        mol_stats.screened += 1
+                        return False
+                    return mol.HasSubstructMatch(self.queries[smarts_id])
+
+            if self.hierarchy is None:
+                matched_ids = [smarts_id for smarts_id in self.queries if test(smarts_id)]
+                mol_stats.tested += len(self.queries)
+            else:
+                matched_ids, hierarchy_stats = self.hierarchy.match(test)
+                mol_stats += hierarchy_stats
+            mol_stats.tested -= mol_stats.screened  # screened tests were not actually performed
+            stats += mol_stats
+            matches.extend((smarts_id, label) for smarts_id in sorted(matched_ids))
+        return matches, stats
+
+
+"""The matcher of an RDKit worker process, created by :func:`_rdkit_worker_init`"""
+_rdkit_worker_matcher = None
+
+
+def _rdkit_worker_init(smarts: Sequence[Tuple[int, str]],
+                       edges: Optional[Sequence[Tuple[int, int]]], prescreen: bool) -> None:
+    """
+    Initializes an RDKit worker process by compiling all SMARTS patterns once.
+    """
+    from rdkit import RDLogger
+
+    global _rdkit_worker_matcher
+    RDLogger.DisableLog('rdApp.*')
+    _rdkit_worker_matcher = _RDKitMatcher(smarts, edges, prescreen)
+
+
+def _rdkit_worker_match_chunk(molecules: Chunk) -> Tuple[ChunkMatches, PruningStats]:
+    """
+    Matches a chunk of molecules with the matcher of this RDKit worker process.
+    """
+    return _rdkit_worker_matcher.match_chunk(molecules)
+
+
+class RDKitMatchingBackend(MatchingBackend):
+    """
+    A matching backend that matches in-process with RDKit, instead of starting an external process
+    and re-parsing all SMARTS patterns per chunk.
+
+    The SMARTS are compiled once per SMARTS set: with ``max_workers`` of 1, the compiled patterns
+    are cached in this process; otherwise, a pool of ``max_workers`` worker processes is kept
+    alive, each of which compiles the patterns once on startup. Both caches are keyed by the
+    database, the SMARTS set version and the pruning options, and replaced when any of them
+    changes; a replaced pool is only shut down once all backends matching with it are finished.
+
+    Optionally, matching is pruned by the subset relationships between the SMARTS, see
+    :mod:`smartsexplore.molecules.hierarchy`, and by the pre-screen of
+    :mod:`smartsexplore.molecules.prescreen`. The number of pattern tests performed and saved is
+    accumulated in :attr:`stats`.
+    """
+    name = 'rdkit'
+
+    _lock = threading.Lock()
+    """Matchers of this process, keyed by :attr:`cache_key`"""
+    _matchers: Dict[tuple, _RDKitMatcher] = {}
+    """Worker process pools, keyed by (:attr:`cache_key`, number of workers)"""
+    _pools: Dict[tuple, '_SharedPool'] = {}
+
+    def __init__(self, smarts_version: str, get_smarts: Callable[[], Sequence[Tuple[int, str]]],
+                 max_workers: int,
+                 get_edges: Optional[Callable[[], Sequence[Tuple[int, int]]]] = None,
+                 prescreen: bool = False, database: Optional[str] = None):
+        """
+        :param smarts_version: The version of the SMARTS set, see
+            :func:`smartsexplore.database.get_smarts_set_version`. Must also identify the
+            subset relationships if ``get_edges`` is given.
+        :param get_smarts: A function that returns a sequence of (SMARTS ID, SMARTS pattern)
+            tuples of the SMARTS set. Only called if the SMARTS set version is not cached yet.
+        :param max_workers: The number of worker processes to match with.
+        :param get_edges: An optional function that returns a sequence of (from ID, to ID) subset
+            relationships between the SMARTS. If given, matching is pruned by these relationships.
+            Only called if the SMARTS set version is not cached yet.
+        :param prescreen: Whether to skip all (molecule, SMARTS) pairs that the pre-screen rules
+            out.
+        :param database: The URL of the database the SMARTS are stored in, so that backends for
+            different databases with equal SMARTS set versions do not share cached SMARTS.
+        """
+        try:
+            import rdkit  # noqa: F401
+        except ImportError:
+            raise ImportError('The rdkit matching backend requires the rdkit package, '
+                              'try: pip install rdkit')
+        self.smarts_version = smarts_version
+        self.get_smarts = get_smarts
+        self.get_edges = get_edges
+        self.max_workers = max_workers
+        self.prescreen = prescreen
+        """Identifies the compiled SMARTS, see above"""
+        self.cache_key = (database, smarts_version, get_edges is not None, prescreen)
+        self.stats = PruningStats()
+
+    def _get_edges(self) -> Optional[list]:
+        return list(self.get_edges()) if self.get_edges is not None else None
+
+    def _get_matcher(self) -> _RDKitMatcher:
+        cls = RDKitMatchingBackend
+        with cls._lock:
+            record_cache_lookup('rdkit_matcher', self.cache_key in cls._matchers)
+            if self.cache_key not in cls._matchers:
+                cls._matchers.clear()
+                cls._matchers[self.cache_key] = _RDKitMatcher(
+                    self.get_smarts(), self._get_edges(), self.prescreen
+                )
+            return cls._matchers[self.cache_key]
+
+    def _acquire_pool(self) -> '_SharedPool':
+        """
+        Gets the worker process pool for the SMARTS set, creating it (and retiring the previous
+        pools) if it does not exist yet. Must be released with :meth:`_release_pool`.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        cls = RDKitMatchingBackend
+        key = (self.cache_key, self.max_workers)
+        with cls._lock:
+            record_cache_lookup('rdkit_pool', key in cls._pools)
+            if key not in cls._pools:
+                for pool in cls._pools.values():
+                    pool.retired = True
+                    if pool.users == 0:
+                        pool.executor.shutdown(wait=False)
+                cls._pools.clear()
+                # spawn rather than fork, since we are likely running in a multithreaded server
+                cls._pools[key] = _SharedPool(ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_rdkit_worker_init,
+                    initargs=(list(self.get_smarts()), self._get_edges(), self.prescreen)
+                ))
+            pool = cls._pools[key]
+            pool.users += 1
+            return pool
+
+    @staticmethod
+    def _release_pool(pool: '_SharedPool') -> None:
+        """Releases a pool, and shuts it down if it was retired and this was its last user."""
+        with RDKitMatchingBackend._lock:
+            pool.users -= 1
+            if pool.retired and pool.users == 0:
+                pool.executor.shutdown(wait=False)
+
+    def match_chunks(self, chunks: Iterable[Chunk]) -> Iterator[ChunkMatches]:
+        if self.max_workers == 1:
+            matcher = self._get_matcher()
+            yield from self._accumulate_stats(matcher.match_chunk(chunk) for chunk in chunks)
+            return
+        pool = self._acquire_pool()
+        try:
+            yield from self._accumulate_stats(_map_chunks(
+                pool.executor, _rdkit_worker_match_chunk, chunks, 2 * self.max_workers
+            ))
+        finally:
+            self._release_pool(pool)
+
+    def _accumulate_stats(self, results: Iterable[Tuple[ChunkMatches, PruningStats]]
+                          ) -> Iterator[ChunkMatches]:
+        for matches, stats in results:
+            self.stats += stats
+            yield matches
+
+
+class _SharedPool:
+    """
+    A worker process pool shared by the :class:`RDKitMatchingBackend` instances matching against
+    the same SMARTS set, with the number of backends currently matching with it.
+    """
+
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        """The number of backends currently matching with the pool"""
+        self.users = 0
+        """Whether the pool was replaced, and is to be shut down once it has no users anymore"""
+        self.retired = False
+
+
+_prescreen_lock = threading.Lock()
+"""Pre-screens of the external matching backend, keyed by SMARTS export filename"""
+_prescreens: Dict[str, Prescreen] = {}
+
+
+def _get_prescreen(smarts_filename: str,
+                   get_smarts: Callable[[], Sequence[Tuple[int, str]]]) -> Prescreen:
+    """
+    Gets the cached pre-screen of a SMARTS export file, whose name identifies the SMARTS set
+    version, or creates it from ``get_smarts`` if it is not cached yet.
+    """
+    with _prescreen_lock:
+        record_cache_lookup('prescreen', smarts_filename in _prescreens)
+        if smarts_filename not in _prescreens:
+            _prescreens.clear()
+            _prescreens[smarts_filename] = Prescreen(get_smarts())
+        return _prescreens[smarts_filename]
+
+
+def get_matching_backend(session=None) -> MatchingBackend:
+    """
+    Creates the matching backend defined by the MATCHING_BACKEND app config value, for matching
+    against all SMARTS currently stored in the database.
+
+    If the MATCHING_HIERARCHY_PRUNING app config value is set, the RDKit backend prunes matching
+    by the subset relationships (DirectedEdges) stored in the database. If the MATCHING_PRESCREEN
+    app config value is set, both backends skip (molecule, SMARTS) pairs that the pre-screen rules
+    out.
+
+    Must be called from within a Flask appcontext.
+
+    :param session: An optional SQLAlchemy session to use. Uses
+        :func:`smartsexplore.database.get_session` if not given.
+    :returns: The matching backend.
+    :raises: :class:`smartsexplore.database.NoSMARTSException`, if there are no SMARTS to match.
+        ValueError, if the configured backend is unknown.
+    """
+    session = session or get_session()
+    backend_name = current_app.config['MATCHING_BACKEND']
+    prescreen = current_app.config['MATCHING_PRESCREEN']
+    get_smarts = lambda: session.query(SMARTS.id, SMARTS.pattern).order_by(SMARTS.id).all()
+
+    if backend_name == ExternalMatchingBackend.name:
+        smarts_filename = get_smarts_export_file(session)
+        return ExternalMatchingBackend(
+            smarts_filename=smarts_filename,
+            matchtool_path=current_app.config['MATCHTOOL_PATH'],
+            max_workers=get_max_workers(),
+            prescreen=_get_prescreen(smarts_filename, get_smarts) if prescreen else None
+        )
+    elif backend_name == RDKitMatchingBackend.name:
+        smarts_version = get_smarts_set_version(session)
+        if smarts_version.startswith('0-'):
+            raise NoSMARTSException("No SMARTS in the database to match against!")
+
+        get_edges = None
+        if current_app.config['MATCHING_HIERARCHY_PRUNING']:
+            nof_edges, max_edge_id = session.query(
+                func.count(DirectedEdge.id), func.max(DirectedEdge.id)
+            ).one()
+            smarts_version += f'/edges-{nof_edges}-{max_edge_id or 0}'
+            get_edges = lambda: session.query(DirectedEdge.from_id, DirectedEdge.to_id).all()
+
+        return RDKitMatchingBackend(
+            smarts_version=smarts_version,
+            get_smarts=get_smarts,
+            max_workers=get_max_workers(),
+            get_edges=get_edges,
+            prescreen=prescreen,
+            database=current_app.config['DATABASE']
+        )
+    else:
+        raise ValueError(f'Unknown matching backend: {backend_name}. Must be one of '
+                         f'[{ExternalMatchingBackend.name}, {RDKitMatchingBackend.name}].')
+
+
+def match_molecules(molecules: Sequence[Tuple[int, str]],
+                    backend: MatchingBackend) -> Iterator[Tuple[int, int]]:
+    """
+    Matches molecules with a matching backend, split into chunks of MATCHTOOL_CHUNK_SIZE
+    molecules that are matched in parallel.
+
+    Must be called from within a Flask appcontext.
+
+    :param molecules: A sequence of (label, SMILES pattern) tuples.
+    :param backend: The matching backend to use, see :func:`get_matching_backend`.
+    :returns: An iterator over all (SMARTS ID, molecule label) matches.
+    """
+    chunk_size = current_app.config['MATCHTOOL_CHUNK_SIZE']
+    chunks = (molecules[i:i+chunk_size] for i in range(0, len(molecules), chunk_size))
+    for matches in timed_iter(backend.match_chunks(chunks), 'subprocess'):
+        yield from matches
+
+
+def screen_molecules(molecules: Iterable[Tuple[str, str]], backend: MatchingBackend,
+                     chunk_size: int) -> Iterator[Tuple[int, str, List[int]]]:
+    """
+    Screens a stream of molecules with a matching backend, without storing anything in the
+    database. The molecules are consumed lazily in chunks of ``chunk_size`` molecules that are
+    matched in parallel (see :meth:`MatchingBackend.match_chunks`), so that memory use is bounded
+    regardless of the number of molecules.
+
+    :param molecules: An iterable of (SMILES pattern, name) tuples, e.g. as yielded by
+        :func:`smartsexplore.parsers.parse_smiles`.
+    :param backend: The matching backend to use, see :func:`get_matching_backend`.
+    :param chunk_size: The number of molecules per chunk.
+    :returns: An iterator over (index, name, sorted list of matching SMARTS IDs) tuples, one per
+        molecule and in input order, where the index counts molecules starting from 1.
+    """
+    from collections import deque
+    from itertools import islice
+
+    pending_names = deque()
+
+    def _chunks():
+        index = 1
+        molecules_iter = iter(molecules)
+        while True:
+            chunk = list(islice(molecules_iter, chunk_size))
+            if not chunk:
+                return
+            pending_names.append([name for _, name in chunk])
+            yield [(index + i, pattern) for i, (pattern, _) in enumerate(chunk)]
+            index += len(chunk)
+
+    index = 1
+    for matches in backend.match_chunks(_chunks()):
+        names = pending_names.popleft()
+        smarts_ids = [[] for _ in names]
+        for smarts_id, label in matches:
+            smarts_ids[label - index].append(smarts_id)
+        for name, ids in zip(names, smarts_ids):
+            yield index, name, sorted(ids)
+            index += 1
@@ -0,0 +1,222 @@
+"""
+A cheap pre-screen that rules out (molecule, SMARTS) pairs that cannot possibly match, before any
+actual matching runs.
+
+For each SMARTS, a requirement signature is derived from the pattern text: the number of atoms of
+each element that the pattern certainly requires, and the number of rings it requires. For each
+molecule, the same features are counted from its SMILES. A SMARTS can only match a molecule if the
+molecule has at least as many of every feature as the SMARTS requires, which is checked for all
+pairs at once with NumPy.
+
+The requirements are derived conservatively: everything that cannot be interpreted with certainty
+(e.g., atom lists like ``[C,c]``, negations, recursive SMARTS, or implicit conjunctions like
+``[CH2]``) requires nothing. Aromatic atoms in a SMARTS require a ring, since SMILES written in
+Kekulé form do not reveal aromaticity without perception.
+"""
+import re
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+"""The elements whose atom counts are used as features, with their atomic numbers"""
+ELEMENTS = {
+    'B': 5, 'C': 6, 'N': 7, 'O': 8, 'F': 9, 'Si': 14, 'P': 15, 'S': 16, 'Cl': 17,
+    'Se': 34, 'Br': 35, 'I': 53
+}
+"""The names of all features, in the order of the feature vectors"""
+FEATURES = list(ELEMENTS.keys()) + ['rings']
+
+_ELEMENT_COLUMN = {symbol: i for i, symbol in enumerate(ELEMENTS)}
+_ATOMIC_NUMBER_COLUMN = {number: i for i, number in enumerate(ELEMENTS.values())}
+_RING_COLUMN = len(ELEMENTS)
+
+"""Aromatic atom symbols, mapped to their element symbols"""
+_AROMATIC_SYMBOLS = {'b': 'B', 'c': 'C', 'n': 'N', 'o': 'O', 'p': 'P', 's': 'S', 'se': 'Se',
+                     'si': 'Si'}
+_ORGANIC_SUBSET = re.compile(r'Cl|Br|[BCNOSPFI]|[bcnosp]')
+_BRACKET_SYMBOL = re.compile(r'^\d*(Cl|Br|Si|Se|se|si|[A-Z][a-z]?|[a-z])')
+
+
+def _split_top_level(expression: str, separator: str) -> List[str]:
+    """
+    Splits an atom expression at a separator character, ignoring separators inside parentheses
+    (i.e., inside recursive SMARTS).
+    """
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(expression):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(expression[start:i])
+            start = i + 1
+    parts.append(expression[start:])
+    return parts
+
+
+def _tokenize(pattern: str) -> Iterable[Tuple[str, str]]:
+    """
+    Splits a SMILES or SMARTS pattern into the tokens relevant for the features, yielding
+    ('atom', symbol) for atoms outside brackets, ('bracket', expression) for bracket atoms, and
+    ('ring', label) for ring closure labels.
+    """
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '[':
+            depth, j = 1, i + 1
+            while j < len(pattern) and depth > 0:
+                depth += {'[': 1, ']': -1}.get(pattern[j], 0)
+                j += 1
+            yield 'bracket', pattern[i+1:j-1]
+            i = j
+        elif char.isdigit():
+            yield 'ring', char
+            i += 1
+        elif char == '%':
+            if pattern.startswith('%(', i):  # extended ring closure label, e.g. %(123)
+                j = pattern.find(')', i)
+                j = len(pattern) if j == -1 else j + 1
+            else:
+                j = i + 3
+            yield 'ring', pattern[i+1:j]
+            i = j
+        else:
+            m = _ORGANIC_SUBSET.match(pattern, i)
+            if m:
+                yield 'atom', m.group(0)
+                i = m.end()
+            else:
+                if char == 'a':  # any aromatic atom (SMARTS only)
+                    yield 'atom', char
+                i += 1
+
+
+def _count_rings(ring_labels: List[str]) -> int:
+    """Counts ring closures, given all occurrences of ring closure labels (each label opens and
+    closes a ring, and can be reused afterwards)."""
+    return len(ring_labels) // 2
+
+
+def smarts_requirements(pattern: str) -> List[int]:
+    """
+    Derives the requirement signature of a SMARTS pattern, see the module documentation.
+
+    :param pattern: The SMARTS pattern.
+    :returns: A list of the required count of each feature, in the order of :data:`FEATURES`.
+    """
+    requirements = [0] * len(FEATURES)
+    ring_labels = []
+    aromatic = False
+    for kind, token in _tokenize(pattern):
+        if kind == 'ring':
+            ring_labels.append(token)
+            continue
+
+        if kind == 'atom':
+            symbols = [token]
+        else:  # bracket atom: only certain conjuncts of the lowest-precedence conjunction count
+            symbols = []
+            for piece in _split_top_level(token, ';'):
+                if ',' in piece:
+                    continue
+                symbols.extend(
+                    conjunct for conjunct in _split_top_level(piece, '&')
+                    if not conjunct.startswith('!')
+                )
+
+        columns = set()
+        for symbol in symbols:
+            if symbol in _AROMATIC_SYMBOLS or symbol == 'a':
+                aromatic = True
+            symbol = _AROMATIC_SYMBOLS.get(symbol, symbol)
+            if symbol in _ELEMENT_COLUMN:
+                columns.add(_ELEMENT_COLUMN[symbol])
+            elif symbol.startswith('#') and symbol[1:].isdigit() \
+                    and int(symbol[1:]) in _ATOMIC_NUMBER_COLUMN:
+                columns.add(_ATOMIC_NUMBER_COLUMN[int(symbol[1:])])
+        if len(columns) == 1:  # contradicting conjuncts cannot match anyway, but stay safe
+            requirements[columns.pop()] += 1
+
+    requirements[_RING_COLUMN] = max(_count_rings(ring_labels), 1 if aromatic else 0)
+    return requirements
+
+
+def molecule_features(pattern: str) -> List[int]:
+    """
+    Counts the features of a molecule given as a SMILES pattern, see the module documentation.
+
+    :param pattern: The SMILES pattern.
+    :returns: A list of the count of each feature, in the order of :data:`FEATURES`.
+    """
+    features = [0] * len(FEATURES)
+    ring_labels = []
+    for kind, token in _tokenize(pattern):
+        if kind == 'ring':
+            ring_labels.append(token)
+            continue
+        if kind == 'bracket':
+            m = _BRACKET_SYMBOL.match(token)
+            if m is None:
+                continue
+            token = m.group(1)
+        symbol = _AROMATIC_SYMBOLS.get(token, token)
+        if symbol in _ELEMENT_COLUMN:
+            features[_ELEMENT_COLUMN[symbol]] += 1
+    features[_RING_COLUMN] = _count_rings(ring_labels)
+    return features
+
+
+class Prescreen:
+    """
+    The requirement signatures of a set of SMARTS, for pre-screening molecules against them.
+    """
+
+    def __init__(self, smarts: Sequence[Tuple[int, str]]):
+        """
+        :param smarts: A sequence of (SMARTS ID, SMARTS pattern) tuples.
+        """
+        import numpy as np
+
+        """The SMARTS IDs, in the order of the rows of :attr:`requirements`"""
+        self.smarts_ids = [smarts_id for smarts_id, _ in smarts]
+        """The column index of each SMARTS ID"""
+        self.column_of = {smarts_id: i for i, smarts_id in enumerate(self.smarts_ids)}
+        """The requirement signatures, as an (nof. SMARTS x nof. features) array"""
+        self.requirements = np.array(
+            [smarts_requirements(pattern) for _, pattern in smarts], dtype=np.int32
+        ).reshape(len(self.smarts_ids), len(FEATURES))
+
+    def feasible(self, molecule_patterns: Sequence[str]):
+        """
+        Determines all (molecule, SMARTS) pairs that can possibly match.
+
+        :param molecule_patterns: The SMILES patterns of the molecules.
+        :returns: A boolean (nof. molecules x nof. SMARTS) NumPy array, which is False for all
+            pairs that certainly do not match. SMARTS are ordered like :attr:`smarts_ids`.
+        """
+        import numpy as np
+
+        features = np.array(
+            [molecule_features(pattern) for pattern in molecule_patterns], dtype=np.int32
+        ).reshape(len(molecule_patterns), len(FEATURES))
+        return (features[:, None, :] >= self.requirements[None, :, :]).all(axis=2)
+
+
+def prescreen_report(smarts: Sequence[Tuple[int, str, str]],
+                     molecule_patterns: Sequence[str]) -> Dict[str, Tuple[int, int]]:
+    """
+    Determines how many (molecule, SMARTS) pairs the pre-screen rules out, per SMARTS library.
+
+    :param smarts: A sequence of (SMARTS ID, SMARTS pattern, library) tuples.
+    :param molecule_patterns: The SMILES patterns of the molecules.
+    :returns: A dictionary mapping each library name to a tuple of (nof. pairs, nof. pairs ruled
+        out by the pre-screen).
+    """
+    prescreen = Prescreen([(smarts_id, pattern) for smarts_id, pattern, _ in smarts])
+    screened_out_per_smarts = (~prescreen.feasible(molecule_patterns)).sum(axis=0)
+    report = {}
+    for (_, _, library), screened_out in zip(smarts, screened_out_per_smarts):
+        nof_pairs, nof_screened_out = report.get(library, (0, 0))
+        report[library] = (nof_pairs + len(molecule_patterns),
+                           nof_screened_out + int(screened_out))
+    return report
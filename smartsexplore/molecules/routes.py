@@ -4,14 +4,23 @@ plus structure diagram images of these molecules.
 """
 import logging
 import os
+from typing import List, Tuple
 
 import werkzeug
 from flask import Blueprint, request, current_app, url_for, redirect, send_from_directory
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
 from smartsexplore.database import get_session, Molecule, MoleculeSet, Match
-from smartsexplore.molecules.actions import calculate_molecule_matches
-from smartsexplore.molecules.draw import draw_molecules_from_molset
+from smartsexplore.molecules.actions import calculate_molecule_matches, match_counts, \
+    forget_match_counts
+from smartsexplore.molecules.draw import draw_molecules_from_molset, \
+    MOLECULE_IMAGE_BUNDLE_FILENAME
+from smartsexplore.metrics import UPLOAD_BYTES, UPLOAD_MOLECULES
+from smartsexplore.molecules.eviction import touch_molecule_set
+from smartsexplore.parsers import parse_smiles_stream
+from smartsexplore.timing import timed
+from smartsexplore.util import parse_id_list
 
 
 def attach_to_blueprint(blueprint: Blueprint):
@@ -22,41 +31,72 @@ def attach_to_blueprint(blueprint: Blueprint):
     """
     blueprint.route('/upload', methods=['POST'])(upload_molecule_set)
     blueprint.route('/matches/<int:id>', methods=['GET'])(matches_for_molecule_set)
+    blueprint.route('/matches/counts', methods=['GET'])(match_counts_for_molecule_sets)
     blueprint.route('/images/<int:id>', methods=['GET'])(deliver_molecule_image)
+    blueprint.route('/images/set/<int:molset_id>', methods=['GET'])(deliver_molecule_set_images)
 
 
-def _check_valid_file(file: werkzeug.datastructures.FileStorage):
+"""The number of bytes a multipart/form-data upload may exceed the maximum size of the uploaded
+file by, for the boundaries and part headers"""
+MULTIPART_OVERHEAD = 16 * 1024
+
+
+class _BoundedStream:
+    """
+    Wraps the body stream of a request without a Content-Length header (i.e., with chunked
+    transfer encoding), for which werkzeug does not enforce the MAX_CONTENT_LENGTH app config
+    value, and aborts reading it once more than a maximum number of bytes were read.
+    """
+
+    def __init__(self, stream, max_bytes: int):
+        """
+        :param stream: The body stream to wrap.
+        :param max_bytes: The maximum number of bytes to read from the stream.
+        """
+        self.stream = stream
+        self.max_bytes = max_bytes
+        """The number of bytes read from the stream so far"""
+        self.nof_bytes = 0
+
+    def _count(self, data: bytes) -> bytes:
+        """:returns: The given data read from the stream, after counting its bytes."""
+        self.nof_bytes += len(data)
+        if self.nof_bytes > self.max_bytes:
+            raise RequestEntityTooLarge()
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        return self._count(self.stream.read(size))
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._count(self.stream.readline(size))
+
+
+def _read_molecule_file(file: werkzeug.datastructures.FileStorage) -> List[Tuple[str, str]]:
     """
     Verifies that a given file is a valid molecule file with respect to the restrictions
-    defined in the current app config (ALLOWED_MOLECULE_SET_EXTENSIONS and
-    MAX_UPLOADED_MOLECULE_NUMBER).
+    defined in the current app config (ALLOWED_MOLECULE_SET_EXTENSIONS,
+    MAX_UPLOADED_MOLECULE_NUMBER and MAX_UPLOADED_MOLECULE_FILE_SIZE), and parses its molecules.
 
-    Ignores lines starting with # when counting the number of molecules.
+    Validates and parses the file in a single pass over its stream, which is aborted as soon as a
+    limit is exceeded (see :func:`smartsexplore.parsers.parse_smiles_stream`).
 
-    .. warning:: Does not verify that the file adheres to the SMILES format!
+    .. warning:: Does not verify that the molecules are valid SMILES!
+
+    :returns: A list of (SMILES pattern, name) tuples.
+    :raises: ValueError, with a message that can be shown to users, if the file is invalid.
     """
     allowed_extensions = current_app.config['ALLOWED_MOLECULE_SET_EXTENSIONS']
     user_filename = file.filename
     if not ('.' in user_filename and user_filename.rsplit('.', 1)[1].lower() in allowed_extensions):
         raise ValueError("Please upload a .smi or .smiles file!")
 
-    try:
-        lines = [line.decode('utf-8') for line in file.readlines()]
-        print('\n'.join(lines))
-    except UnicodeError:
-        raise ValueError(
-            'Could not decode file as UTF8 text! Are you sure this is a molecule file?'
-        )
-
-    nof_molecule_lines = len([line for line in lines if not line.startswith('#')])
-    max_molecules = current_app.config['MAX_UPLOADED_MOLECULE_NUMBER']
-    if nof_molecule_lines > max_molecules:
-        raise ValueError(
-            f"You seem to have uploaded {nof_molecule_lines} molecules. "
-            f"Please upload a file with {max_molecules} molecules or less!"
-        )
-    file.seek(0)
-    return file
+    with timed('file_io'):
+        return list(parse_smiles_stream(
+            file.stream,
+            max_molecules=current_app.config['MAX_UPLOADED_MOLECULE_NUMBER'],
+            max_bytes=current_app.config['MAX_UPLOADED_MOLECULE_FILE_SIZE']
+        ))
 
 
 def upload_molecule_set():
@@ -67,21 +107,36 @@ def upload_molecule_set():
     MoleculeSet. Therefore, on success this returns the matches associated with the
     uploaded molecule set.
 
-    On failure, responds with a 400 error and JSON containing a descriptive error string
-    (key 'error'). This string can be displayed directly in the frontend.
+    On failure, responds with a 400 error (or a 413 error if the request is too large to contain
+    an acceptable file) and JSON containing a descriptive error string (key 'error'). This string
+    can be displayed directly in the frontend.
     """
-    if 'file' not in request.files or not request.files['file'].filename:
-        return {'error': 'Request seems to be missing a molecule file.'}, 400
+    max_bytes = current_app.config['MAX_UPLOADED_MOLECULE_FILE_SIZE']
+    if request.content_length is not None \
+            and request.content_length > max_bytes + MULTIPART_OVERHEAD:
+        return {'error': f"Please upload a file of {max_bytes} bytes or less!"}, 413
+    if request.content_length is None and request.environ.get('wsgi.input_terminated'):
+        request.environ['wsgi.input'] = _BoundedStream(request.environ['wsgi.input'],
+                                                       max_bytes + MULTIPART_OVERHEAD)
 
-    plain_file = request.files['file']
     try:
-        file = _check_valid_file(plain_file)
+        if 'file' not in request.files or not request.files['file'].filename:
+            return {'error': 'Request seems to be missing a molecule file.'}, 400
+    except RequestEntityTooLarge:
+        # raised by werkzeug (see the MAX_CONTENT_LENGTH app config value) or _BoundedStream
+        return {'error': f"Please upload a file of {max_bytes} bytes or less!"}, 413
+
+    try:
+        molecules = _read_molecule_file(request.files['file'])
     except ValueError as e:
         return {'error': str(e)}, 400
+    if request.content_length is not None:
+        UPLOAD_BYTES.observe(request.content_length)
+    UPLOAD_MOLECULES.observe(len(molecules))
 
     mol_set = None
     try:
-        mol_set = calculate_molecule_matches(file)
+        mol_set = calculate_molecule_matches(molecules)
         draw_molecules_from_molset(mol_set)
         return redirect(url_for('molecules.matches_for_molecule_set', id=mol_set.id))
     except Exception as e:
@@ -90,6 +145,7 @@ def upload_molecule_set():
             session = get_session()
             session.delete(mol_set)
             session.commit()
+            forget_match_counts(mol_set.id)
         return {'error': 'Unknown error occurred'}, 500
 
 
@@ -100,6 +156,9 @@ def matches_for_molecule_set(id: int):
     ``matches``. Each match in ``matches`` will have a ``molecule_id``, a ``molecule_name``
     and a ``smarts_id``.
 
+    Reads the matches directly from the molecule set's compressed match bitmap if its matches are
+    stored as one (see :func:`smartsexplore.molecules.actions.store_match_bitmap`).
+
     :param id: The ID of the MoleculeSet instance.
     :return: JSON as described above.
     """
@@ -107,21 +166,80 @@ def matches_for_molecule_set(id: int):
     molset = session.query(MoleculeSet).get(id)
     if molset is None:
         return {'error': 'Unknown molecule set.'}, 404
+    touch_molecule_set(session, molset.id)
+
+    with timed('orm'):
+        if molset.match_bitmap is not None:
+            molecule_names = dict(
+                session.query(Molecule.id, Molecule.name).filter_by(molset_id=molset.id)
+            )
+            matches = [
+                {
+                    'molecule_id': molecule_id,
+                    'molecule_name': molecule_names[molecule_id],
+                    'smarts_id': smarts_id
+                }
+                for smarts_id, molecule_id in molset.match_bitmap.to_bitmap().matches()
+            ]
+        else:
+            # a single join, rather than loading each match's molecule separately
+            matches = [
+                {
+                    'molecule_id': molecule_id,
+                    'molecule_name': molecule_name,
+                    'smarts_id': smarts_id
+                }
+                for molecule_id, molecule_name, smarts_id in
+                session.query(Match.molecule_id, Molecule.name, Match.smarts_id)
+                .join(Molecule, Match.molecule_id == Molecule.id)
+                .filter(Molecule.molset_id == molset.id)
+            ]
+
+    return {'molecule_set_id': molset.id, 'matches': matches}, 200
+
+
+def match_counts_for_molecule_sets():
+    """
+    A route that counts the matching molecules of each SMARTS within one or more molecule sets,
+    given their IDs as a comma-separated ``molsets`` query parameter (e.g. ``?molsets=1,2``).
+    Unlike :func:`matches_for_molecule_set`, the response size scales with the number of SMARTS
+    that match, not with the number of matches.
 
-    molecule_ids = session.query(Molecule.id).filter_by(molset_id=molset.id)
-    matches = session.query(Match).filter(Match.molecule_id.in_(molecule_ids))
+    Responds with a JSON object mapping each molecule set ID (key ``molecule_sets``) to an object
+    with its number of molecules (``nof_molecules``), and the number of matching molecules per
+    SMARTS ID (``counts``). If the ``fractions`` query parameter is set to ``1`` or ``true``, also
+    includes the fraction of matching molecules per SMARTS ID (``fractions``).
 
-    return {
-        'molecule_set_id': molset.id,
-        'matches': [
-            {
-                'molecule_id': match.molecule_id,
-                'molecule_name': match.molecule.name,
-                'smarts_id': match.smarts_id
+    See :func:`smartsexplore.molecules.actions.match_counts`.
+
+    :return: JSON as described above, a 400 response on invalid parameters, or a 404 response if
+        any of the molecule sets does not exist.
+    """
+    try:
+        molset_ids = parse_id_list(request.args.get('molsets', ''), 'molsets')
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    with_fractions = request.args.get('fractions', '').lower() in ('1', 'true')
+
+    session = get_session()
+    existing_ids = {molset_id for molset_id, in
+                    session.query(MoleculeSet.id).filter(MoleculeSet.id.in_(molset_ids))}
+    if len(existing_ids) < len(molset_ids):
+        return {'error': 'Unknown molecule set.'}, 404
+
+    result = {}
+    for molset_id in molset_ids:
+        touch_molecule_set(session, molset_id)
+        nof_molecules, counts = match_counts(session, molset_id)
+        result[str(molset_id)] = {
+            'nof_molecules': nof_molecules,
+            'counts': {str(smarts_id): count for smarts_id, count in counts.items()}
+        }
+        if with_fractions:
+            result[str(molset_id)]['fractions'] = {
+                str(smarts_id): count / nof_molecules for smarts_id, count in counts.items()
             }
-            for match in matches
-        ]
-    }, 200
+    return {'molecule_sets': result}, 200
 
 
 def deliver_molecule_image(id):
@@ -143,3 +261,22 @@ def deliver_molecule_image(id):
         os.path.join(current_app.config['STATIC_MOL2SVG_MOLECULE_SETS_PATH'], subdir),
         filename
     )
+
+
+def deliver_molecule_set_images(molset_id):
+    """
+    A route that delivers the images of all molecules of a molecule set in one response, given
+    the molecule set's ID. Responds with a JSON object mapping each molecule ID to the SVG source
+    of its image, as written by :func:`smartsexplore.molecules.draw.write_molecule_image_bundle`.
+
+    Does not query the database; responds with 404 if no image bundle exists for the molecule set.
+
+    :param molset_id: The ID of the molecule set.
+    :return: A file response on success, a 404 response on error.
+    """
+    subdir = secure_filename(str(molset_id))
+    return send_from_directory(
+        os.path.join(current_app.config['STATIC_MOL2SVG_MOLECULE_SETS_PATH'], subdir),
+        MOLECULE_IMAGE_BUNDLE_FILENAME,
+        mimetype='application/json'
+    )
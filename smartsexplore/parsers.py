@@ -62,3 +62,71 @@ def parse_moleculematch(iterable):
         linelist=line.split("\t")
         yield int(linelist[0].strip()),\
               int(linelist[1].strip())
+
+
+def parse_smiles(iterable):
+    """
+    Parses an iterable of lines of a .smiles file, and yields:
+
+    * for each molecule: a 2-tuple of (SMILES pattern, name), where the name is empty if the line
+      does not contain one
+
+    Lines starting with # and blank lines are skipped.
+    """
+    for line in iterable:
+        if line.startswith('#'):
+            continue
+        line_contents = line.split(None, 1)
+        if len(line_contents) == 0:
+            continue
+        elif len(line_contents) == 2:
+            pattern, name = line_contents
+        else:
+            pattern = line_contents[0]
+            name = ''
+        yield pattern.strip(), name.strip()
+
+
+def _limited_lines(stream, max_bytes=None):
+    """
+    Reads a binary stream line by line, and yields each line decoded as UTF-8. Never reads more
+    than ``max_bytes`` + 1 bytes from the stream, even if it contains no line breaks.
+
+    :raises: ValueError, if the stream is longer than ``max_bytes`` or is not valid UTF-8.
+    """
+    nof_bytes = 0
+    while True:
+        line = stream.readline(-1 if max_bytes is None else max_bytes - nof_bytes + 1)
+        if not line:
+            return
+        nof_bytes += len(line)
+        if max_bytes is not None and nof_bytes > max_bytes:
+            raise ValueError(f"Please upload a file of {max_bytes} bytes or less!")
+        try:
+            yield line.decode('utf-8')
+        except UnicodeError:
+            raise ValueError(
+                'Could not decode file as UTF8 text! Are you sure this is a molecule file?'
+            )
+
+
+def parse_smiles_stream(stream, max_molecules=None, max_bytes=None):
+    """
+    Parses a binary stream of a UTF-8 encoded .smiles file (e.g. an uploaded file) in a single
+    pass, like :func:`parse_smiles`. Enforces the given limits while reading, so that files
+    exceeding them are rejected without reading them fully, and at most ``max_bytes`` bytes are
+    ever read.
+
+    :param stream: A binary stream, e.g. a file opened in binary mode.
+    :param max_molecules: The maximum number of molecules, or None for no limit.
+    :param max_bytes: The maximum size of the file in bytes, or None for no limit.
+    :raises: ValueError, with a message that can be shown to users, if the file exceeds either
+        limit or is not valid UTF-8.
+    """
+    for i, molecule in enumerate(parse_smiles(_limited_lines(stream, max_bytes))):
+        if max_molecules is not None and i >= max_molecules:
+            raise ValueError(
+                f"You seem to have uploaded more than {max_molecules} molecules. "
+                f"Please upload a file with {max_molecules} molecules or less!"
+            )
+        yield molecule
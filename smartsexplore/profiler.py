@@ -0,0 +1,174 @@
+"""
+On-demand profiling of single requests, e.g. to find out why a ``/smarts/data`` or upload request
+is slow on production data, without profiling (and slowing down) any other request.
+
+If the PROFILER app config value is set, a request is profiled if it has an ``X-Profile: 1``
+header or a ``profile=1`` query parameter, and comes from one of the addresses in the
+PROFILER_ALLOWED_ADDRESSES app config value (only the local host by default; None allows all
+addresses). The profile is written to the directory given by the PROFILER_DIR app config value
+(``profiles`` in the instance folder by default), and its file name is returned in the
+``X-Profile-File`` response header.
+
+The client address is the one of the direct peer, so behind a reverse proxy on the same host, all
+requests come from the local host, and any client could trigger the profiler. In that case, set
+the PROFILER_TOKEN app config value to a secret: the header or query parameter must then be that
+secret instead of ``1`` (e.g. ``X-Profile: <secret>``).
+
+The profiler is chosen by the PROFILER_BACKEND app config value:
+
+* ``'cprofile'``: A deterministic profile with :mod:`cProfile`, written as a ``.prof`` file, which
+  can be read with :mod:`pstats` or visualized with, e.g., ``snakeviz``
+* ``'pyinstrument'``: A sampling profile with ``pyinstrument``, which has less overhead on
+  requests executing many small Python functions, written as an ``.html`` file
+* ``'auto'`` (the default): ``'pyinstrument'`` if it is installed, ``'cprofile'`` otherwise
+
+Only the thread handling the request is profiled; work done in other threads (e.g., drawing
+molecules in a thread pool) shows up as time waiting for them. At most one request is profiled at
+a time; requests triggering the profiler while another one is profiled are handled unprofiled.
+
+If the PROFILER app config value is not set (the default), nothing is installed, so there is no
+overhead at all; if it is set, requests not triggering the profiler only pay for a lookup of the
+header and the query string.
+"""
+import hmac
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Iterable, Optional
+from urllib.parse import parse_qs
+
+from flask import Flask
+from werkzeug.utils import secure_filename
+
+"""The request header that triggers profiling"""
+TRIGGER_HEADER = 'X-Profile'
+"""The query parameter that triggers profiling"""
+TRIGGER_PARAMETER = 'profile'
+"""The response header containing the file name of the profile of a profiled request"""
+PROFILE_FILE_HEADER = 'X-Profile-File'
+
+_TRIGGER_ENVIRON_KEY = 'HTTP_' + TRIGGER_HEADER.upper().replace('-', '_')
+_TRUE_VALUES = ('1', 'true', 'yes')
+
+
+def _resolve_backend(backend: str) -> str:
+    """:returns: The profiler backend to use for a PROFILER_BACKEND app config value."""
+    if backend == 'auto':
+        try:
+            import pyinstrument  # noqa: F401
+            return 'pyinstrument'
+        except ImportError:
+            return 'cprofile'
+    if backend not in ('cprofile', 'pyinstrument'):
+        raise ValueError(f"Unknown profiler backend: {backend}. "
+                         f"Must be one of [auto, cprofile, pyinstrument].")
+    return backend
+
+
+class ProfilerMiddleware:
+    """
+    A WSGI middleware that profiles single requests on demand, see above. Wraps the whole app,
+    so that the profile also includes ``before_request`` and ``after_request`` functions (e.g.,
+    compression), and the iteration over streamed response bodies.
+    """
+
+    def __init__(self, wsgi_app, directory: str, allowed_addresses: Optional[Iterable[str]],
+                 backend: str = 'auto', token: Optional[str] = None):
+        """
+        :param wsgi_app: The WSGI app to wrap.
+        :param directory: The directory to write the profiles to.
+        :param allowed_addresses: The client addresses allowed to trigger the profiler, or None
+            to allow all addresses.
+        :param backend: The profiler backend, see above.
+        :param token: If given, the secret the trigger header or query parameter must be set to,
+            see above.
+        """
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+        self.allowed_addresses = frozenset(allowed_addresses) \
+            if allowed_addresses is not None else None
+        self.backend = _resolve_backend(backend)
+        self.token = token.encode() if token is not None else None
+        """Held while a request is profiled"""
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if not self._triggered(environ) or not self.lock.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+        try:
+            return self._profile(environ, start_response)
+        finally:
+            self.lock.release()
+
+    def _triggered(self, environ) -> bool:
+        """:returns: Whether a request triggers the profiler, and is allowed to."""
+        values = [environ[_TRIGGER_ENVIRON_KEY]] if _TRIGGER_ENVIRON_KEY in environ else []
+        query_string = environ.get('QUERY_STRING', '')
+        if TRIGGER_PARAMETER in query_string:  # only parsed if it could contain the parameter
+            values += parse_qs(query_string).get(TRIGGER_PARAMETER, [])
+        if self.token is not None:
+            triggered = any(hmac.compare_digest(value.encode(), self.token) for value in values)
+        else:
+            triggered = any(value.lower() in _TRUE_VALUES for value in values)
+        return triggered and (self.allowed_addresses is None
+                              or environ.get('REMOTE_ADDR') in self.allowed_addresses)
+
+    def _profile_filename(self, environ) -> str:
+        """:returns: A unique file name for the profile of a request, naming its route."""
+        route = secure_filename(environ.get('PATH_INFO', '').strip('/').replace('/', '.'))
+        extension = 'prof' if self.backend == 'cprofile' else 'html'
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{environ.get('REQUEST_METHOD', 'GET')}-" \
+               f"{route or 'index'}-{uuid.uuid4().hex[:8]}.{extension}"
+
+    def _profile(self, environ, start_response):
+        """Handles a request under the profiler, and writes the profile."""
+        filename = self._profile_filename(environ)
+
+        def start_response_with_header(status, headers, exc_info=None):
+            return start_response(status, headers + [(PROFILE_FILE_HEADER, filename)], exc_info)
+
+        if self.backend == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        try:
+            app_iter = self.wsgi_app(environ, start_response_with_header)
+            try:
+                # consumed here, so that generating streamed response bodies is profiled as well
+                body = list(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+        finally:
+            path = os.path.join(self.directory, filename)
+            if self.backend == 'cprofile':
+                profiler.disable()
+                profiler.dump_stats(path)
+            else:
+                profiler.stop()
+                with open(path, 'w') as profile_file:
+                    profile_file.write(profiler.output_html())
+            logging.info(f"Wrote the profile of {environ.get('REQUEST_METHOD')} "
+                         f"{environ.get('PATH_INFO')} to {path}")
+        return body
+
+
+def init_app(app: Flask) -> None:
+    """
+    Installs the :class:`ProfilerMiddleware` for an app, if the PROFILER app config value is set.
+
+    :param app: The app to profile requests of.
+    """
+    if not app.config['PROFILER']:
+        return
+    os.makedirs(app.config['PROFILER_DIR'], exist_ok=True)
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, app.config['PROFILER_DIR'],
+                                      app.config['PROFILER_ALLOWED_ADDRESSES'],
+                                      app.config['PROFILER_BACKEND'],
+                                      app.config['PROFILER_TOKEN'])
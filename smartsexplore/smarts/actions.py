@@ -7,7 +7,7 @@ import logging
 import click
 from flask import current_app
 
-from smartsexplore.database import SMARTS, get_session, write_smarts_to_tempfile, UndirectedEdge, \
+from smartsexplore.database import SMARTS, get_session, get_smarts_export_file, UndirectedEdge, \
     DirectedEdge, NoSMARTSException
 from smartsexplore.parsers import parse_smartscompare
 
@@ -45,6 +45,10 @@ def add_library(name: str, filename: str) -> None:
                 ignored_lines.append(i+1)  # take care of 0 indexing!
 
     session.commit()
+    try:  # regenerate the SMARTS export file for the new SMARTS set version
+        get_smarts_export_file(session)
+    except NoSMARTSException:
+        pass
     click.echo(f"Added {nof_added_smarts} SMARTS to the database as library {name}.")
     if ignored_lines:
         click.echo("Ignored lines: " + ", ".join(map(str, ignored_lines)))
@@ -62,8 +66,8 @@ def calculate_edges(mode):
     similarity value lower bound; otherwise a too large number of
     edges for our purposes would (generally) be generated.
     """
-    import tempfile, os, sys
-    from smartsexplore.util import run_process
+    import os, sys
+    from smartsexplore.util import stream_process
 
     # Check validity of chosen mode
     implemented_modes = ('Similarity', 'SubsetOfFirst')
@@ -71,23 +75,22 @@ def calculate_edges(mode):
         raise ValueError(f"{mode} is not an implemented mode. Implemented modes are: "
                          f"{', '.join(implemented_modes)}")
 
-    # Get a DB session, retrieve all SMARTS patterns, and write them into file
+    # Get a DB session, and the file of all SMARTS patterns
     session = get_session()
     try:
-        smartsfile = write_smarts_to_tempfile()
+        smartsfilename = get_smarts_export_file(session)
     except NoSMARTSException:
         logging.warning("No SMARTS in the database! Exiting the edge calculation process...")
+        return
 
     # Get mode ID
     mode_map = {'Identical': 1, 'SubsetOfFirst': 2, 'SubsetOfSecond': 3, 'Similarity': 4}
     mode_id = mode_map[mode]
 
-    # Run SMARTScompare on the temporary SMARTS file, and write the
-    # stdout to a new temporary result output file.
-    smartscomparefile = tempfile.NamedTemporaryFile(mode='w+')
+    # Run SMARTScompare on the exported SMARTS file, and parse its output while it runs
     compare_cmd = [
         current_app.config['SMARTSCOMPARE_PATH'],
-        smartsfile.name,
+        smartsfilename,
         '-M', '-1',
         # discard edges with <= 0.1 similarity when using (undirected) mode "Similarity"
         *(['-t', '0.1'] if mode == 'Similarity' else []),
@@ -96,19 +99,17 @@ def calculate_edges(mode):
         '-D', '`',
         '-m', str(mode_id)
     ]
-    run_process(compare_cmd, stdout=smartscomparefile, stderr=sys.stderr)
-    smartscomparefile.seek(0)  # must rewind before further usage
-
-    # Parse the SMARTScompare output
-    parse_iterator = parse_smartscompare(smartscomparefile)
+    parse_iterator = parse_smartscompare(stream_process(compare_cmd, stderr=sys.stderr))
     resultfile_mode = next(parse_iterator)
     assert resultfile_mode == mode,\
         f"Mode of the SMARTScompare output, {resultfile_mode}, does not match specified mode, {mode}!"
 
     # --- Code to store results in the database starts here ---
 
-    # Get the existing edges in the database and store them in memory, for efficient checks
+    # Get the existing edges and all SMARTS IDs in the database and store them in memory, for
+    # efficient checks without one query per output line
     existing_edges = _get_existing_edges(mode, session)
+    smarts_ids = {smarts_id for smarts_id, in session.query(SMARTS.id)}
     nof_added_edges = 0
     duplicate_edges = []
 
@@ -120,39 +121,56 @@ def calculate_edges(mode):
         else:
             return False
 
-    # Different loops and logic based on mode
+    # Different loops and logic based on mode; new edges are inserted in bulk, batch_size rows
+    # per statement, rather than as ORM objects
+    batch_size = 10000
+    batch = []
     if mode == 'Similarity':
+        insert = UndirectedEdge.__table__.insert()
         for (line_no, lname, rname, mcssim, spsim) in parse_iterator:
-            lsmarts = session.query(SMARTS).filter_by(id=int(lname)).first()
-            rsmarts = session.query(SMARTS).filter_by(id=int(rname)).first()
-            losmarts, hismarts = (lsmarts, rsmarts) if lsmarts.id < rsmarts.id\
-                else (rsmarts, lsmarts)
-            assert losmarts.id != hismarts.id, f'   {lname} {lsmarts}\n== {rname} {rsmarts}'
-            assert losmarts.id < hismarts.id
-
-            if not _check_for_duplicates(losmarts.id, hismarts.id):
-                edge = UndirectedEdge(low_smarts=losmarts, high_smarts=hismarts,
-                                      mcssim=mcssim, spsim=spsim)
-                existing_edges.add((losmarts.id, hismarts.id))
-                session.add(edge)
+            lid, rid = _known_smarts_id(lname, smarts_ids), _known_smarts_id(rname, smarts_ids)
+            loid, hiid = (lid, rid) if lid < rid else (rid, lid)
+            assert loid != hiid, f'   {lname} == {rname}'
+
+            if not _check_for_duplicates(loid, hiid):
+                batch.append({'low_id': loid, 'high_id': hiid, 'mcssim': mcssim, 'spsim': spsim})
+                existing_edges.add((loid, hiid))
                 nof_added_edges += 1
+            if len(batch) >= batch_size:
+                session.execute(insert, batch)
+                batch = []
     elif mode == 'SubsetOfFirst':
+        insert = DirectedEdge.__table__.insert()
         for (line_no, lname, rname, mcssim, spsim) in parse_iterator:
-            lsmarts = session.query(SMARTS).filter_by(id=int(lname)).first()
-            rsmarts = session.query(SMARTS).filter_by(id=int(rname)).first()
-            fromsmarts, tosmarts = rsmarts, lsmarts
-
-            if not _check_for_duplicates(fromsmarts.id, tosmarts.id):
-                edge = DirectedEdge(from_smarts=fromsmarts, to_smarts=tosmarts,
-                                    mcssim=mcssim, spsim=spsim)
-                existing_edges.add((fromsmarts.id, tosmarts.id))
-                session.add(edge)
+            lid, rid = _known_smarts_id(lname, smarts_ids), _known_smarts_id(rname, smarts_ids)
+            fromid, toid = rid, lid
+
+            if not _check_for_duplicates(fromid, toid):
+                batch.append({'from_id': fromid, 'to_id': toid, 'mcssim': mcssim, 'spsim': spsim})
+                existing_edges.add((fromid, toid))
                 nof_added_edges += 1
+            if len(batch) >= batch_size:
+                session.execute(insert, batch)
+                batch = []
+    if batch:
+        session.execute(insert, batch)
 
-    # Commit the session and close all temporary files
+    # Commit the session
     session.commit()
-    smartsfile.close()
-    smartscomparefile.close()
+    logging.info(f"Added {nof_added_edges} edges to the database, "
+                 f"skipped {len(duplicate_edges)} existing edges.")
+
+
+def _known_smarts_id(name: str, smarts_ids) -> int:
+    """
+    Converts a SMARTS label from the SMARTScompare output (the ID of the SMARTS) to an ID.
+
+    :raises: ValueError, if the SMARTS is not in ``smarts_ids``.
+    """
+    smarts_id = int(name)
+    if smarts_id not in smarts_ids:
+        raise ValueError(f"SMARTScompare output contains an unknown SMARTS ID: {smarts_id}")
+    return smarts_id
 
 
 def _get_existing_edges(mode, session):
@@ -161,12 +179,8 @@ def _get_existing_edges(mode, session):
     The set will contain 2-tuples representing each edge.
     """
     if mode == 'Similarity':
-        return set(
-            (e.low_id, e.high_id) for e in session.query(UndirectedEdge).all()
-        )
+        return set(session.query(UndirectedEdge.low_id, UndirectedEdge.high_id))
     elif mode == 'SubsetOfFirst':
-        return set(
-            (e.from_id, e.to_id) for e in session.query(DirectedEdge).all()
-        )
+        return set(session.query(DirectedEdge.from_id, DirectedEdge.to_id))
     else:
         raise ValueError(f"Unimplemented mode: {mode}")
\ No newline at end of file
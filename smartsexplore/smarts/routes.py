@@ -3,10 +3,15 @@ Routes for retrieving SMARTS and SMARTS-SMARTS relationship data stored in the d
 image representations of these objects using the SMARTSViewer visual language [Schomburg2010]_.
 """
 
+import os
+
 from werkzeug.utils import secure_filename
 from flask import Blueprint, request, jsonify, send_from_directory, current_app
 
+from smartsexplore.database import SMARTS, get_session
 from smartsexplore.smarts import to_json
+from smartsexplore.timing import timed
+from smartsexplore.util import parse_id_list
 
 
 def attach_to_blueprint(blueprint: Blueprint):
@@ -18,6 +23,9 @@ def attach_to_blueprint(blueprint: Blueprint):
     blueprint.route('/data', methods=['POST', 'GET'])(data)
     blueprint.route('/smartsview/<int:id>')(deliver_smartsview)
     blueprint.route('/smartssubsets/<int:id>')(deliver_smartssubset)
+    blueprint.route('/smartsview/batch')(deliver_smartsview_batch)
+    blueprint.route('/smartssubsets/batch')(deliver_smartssubset_batch)
+    blueprint.route('/<int:id>/matches')(matches_for_smarts)
 
 
 def data():
@@ -78,3 +86,122 @@ def deliver_smartssubset(id: int):
         current_app.config['STATIC_SMARTSVIEW_SUBSETS_PATH'],
         filename
     )
+
+
+def _parse_batch_ids():
+    """
+    Parses the ``ids`` query parameter of a batch image request, given as a comma-separated list
+    of integer IDs, and checks it against the MAX_IMAGE_BATCH_SIZE app config value.
+
+    :return: The list of unique requested IDs, in request order.
+    :raises: ValueError, if the parameter is missing or malformed, or too many IDs were requested.
+    """
+    ids = parse_id_list(request.args.get('ids', ''), 'ids')
+
+    max_batch_size = current_app.config['MAX_IMAGE_BATCH_SIZE']
+    if len(ids) > max_batch_size:
+        raise ValueError(f'At most {max_batch_size} images can be requested at once.')
+    return ids
+
+
+def _deliver_svg_batch(directory: str):
+    """
+    Reads the SVG images {id}.svg for all IDs requested via :func:`_parse_batch_ids` from the
+    given directory, and responds with a JSON object mapping each ID to its SVG source (key
+    ``images``) plus a list of IDs for which no image exists (key ``missing``).
+
+    :param directory: The directory to read the SVG images from.
+    :return: JSON as described above, or a 400 response with an ``error`` key on invalid requests.
+    """
+    try:
+        ids = _parse_batch_ids()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    images, missing = {}, []
+    with timed('file_io'):
+        for id_ in ids:
+            try:
+                with open(os.path.join(directory, secure_filename(f'{id_}.svg')), 'r') as file:
+                    images[str(id_)] = file.read()
+            except FileNotFoundError:
+                missing.append(id_)
+    return jsonify({'images': images, 'missing': missing})
+
+
+def deliver_smartsview_batch():
+    """A route that delivers multiple SMARTSview images at once, given the IDs of the SMARTS
+    objects as a comma-separated ``ids`` query parameter (e.g. ``?ids=1,2,3``).
+
+    Saves a round trip per image compared to :func:`deliver_smartsview`. The number of IDs per
+    request is bounded by the MAX_IMAGE_BATCH_SIZE app config value.
+
+    :return: JSON with the keys ``images`` (mapping ID to SVG source) and ``missing`` (list of IDs
+        without an image), or a 400 response on invalid requests.
+    """
+    return _deliver_svg_batch(current_app.config['STATIC_SMARTSVIEW_PATH'])
+
+
+def deliver_smartssubset_batch():
+    """A route that delivers multiple SMARTScompareViewer subset images at once, given the IDs of
+    the DirectedEdge objects as a comma-separated ``ids`` query parameter (e.g. ``?ids=1,2,3``).
+
+    Works like :func:`deliver_smartsview_batch`, but for the images of
+    :func:`deliver_smartssubset`.
+
+    :return: JSON with the keys ``images`` (mapping ID to SVG source) and ``missing`` (list of IDs
+        without an image), or a 400 response on invalid requests.
+    """
+    return _deliver_svg_batch(current_app.config['STATIC_SMARTSVIEW_SUBSETS_PATH'])
+
+
+def matches_for_smarts(id: int):
+    """A route that retrieves the molecules matching a SMARTS, across all uploaded molecule sets.
+
+    Accepts the optional query parameters ``molsets`` (a comma-separated list of molecule set IDs
+    to restrict the lookup to), ``limit`` (the page size, at most MAX_MATCHES_PAGE_SIZE) and
+    ``after`` (a molecule ID to continue after, as given by ``next_after`` of the previous page).
+
+    Responds with a JSON object containing the ``smarts_id``, the ``total`` number of matching
+    molecules, their ``counts`` per molecule set ID, the page of ``matches`` (each with a
+    ``molecule_id``, a ``molecule_name`` and a ``molecule_set_id``, ordered by molecule ID), and
+    ``next_after``, which is null on the last page.
+
+    See :func:`smartsexplore.molecules.actions.molecules_matching_smarts`.
+
+    :param id: The ID of the SMARTS.
+    :return: JSON as described above, a 400 response on invalid parameters, or a 404 response if
+        the SMARTS does not exist.
+    """
+    from smartsexplore.molecules.actions import molecules_matching_smarts
+
+    max_page_size = current_app.config['MAX_MATCHES_PAGE_SIZE']
+    try:
+        molset_ids = parse_id_list(request.args['molsets'], 'molsets') \
+            if 'molsets' in request.args else None
+        try:
+            limit = int(request.args.get('limit', min(100, max_page_size)))
+            after = int(request.args['after']) if 'after' in request.args else None
+        except ValueError:
+            raise ValueError('Parameters limit and after must be integers.')
+        if not 0 < limit <= max_page_size:
+            raise ValueError(f'Parameter limit must be in [1, {max_page_size}].')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    session = get_session()
+    if session.query(SMARTS.id).filter_by(id=id).first() is None:
+        return jsonify({'error': 'Unknown SMARTS.'}), 404
+
+    molecules, counts = molecules_matching_smarts(session, id, molset_ids=molset_ids,
+                                                  after=after, limit=limit)
+    return jsonify({
+        'smarts_id': id,
+        'total': sum(counts.values()),
+        'counts': {str(molset_id): count for molset_id, count in counts.items()},
+        'matches': [
+            {'molecule_id': molecule_id, 'molecule_name': name, 'molecule_set_id': molset_id}
+            for molecule_id, name, molset_id in molecules
+        ],
+        'next_after': molecules[-1][0] if len(molecules) == limit else None
+    })
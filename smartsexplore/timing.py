@@ -0,0 +1,174 @@
+"""
+Instrumentation that times named phases of each request, and reports them in a ``Server-Timing``
+response header (see https://www.w3.org/TR/server-timing/), so that browser devtools and load
+tests can break down the latency of a request, e.g.
+``Server-Timing: db;dur=12.1, orm;dur=30.5, serialize;dur=8.2, compress;dur=4.0, total;dur=60.3``.
+
+The following phases are recorded:
+
+* ``db``: Executing SQL statements, for all statements of the request (see :func:`init_app`)
+* ``orm``: Loading ORM objects and building response data from them, excluding ``db``
+* ``serialize``: Encoding JSON responses (see :class:`TimedJSONEncoder`)
+* ``compress``: Compressing responses with Flask-Compress
+* ``subprocess``: Waiting for external processes, e.g. for matching and drawing molecules
+* ``file_io``: Reading and writing files, e.g. uploaded molecule files and image bundles
+* ``total``: The time from the start of the request until the header is added
+
+Phases are exclusive: the time of a phase does not include the time of phases nested in it, so
+that, e.g., SQL executed while iterating over an ORM query counts as ``db`` and not as ``orm``.
+Time spent outside of request contexts (e.g., in management commands or worker threads) is not
+recorded. Files sent with ``send_from_directory`` are streamed after the header was sent, so
+their I/O is not recorded either.
+
+Enabled by the SERVER_TIMING app config value (True by default).
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List
+
+from flask import Flask, g, has_request_context, json
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class RequestTimings:
+    """
+    The exclusive durations of the phases of one request. Phases are started and stopped in
+    stack order; the time of a nested phase is subtracted from the phase it is nested in.
+    """
+
+    def __init__(self):
+        """The start time of the request, as given by time.perf_counter"""
+        self.start_time = time.perf_counter()
+        """The exclusive duration of each phase so far, in seconds"""
+        self.durations: Dict[str, float] = {}
+        """The running phases, as [phase, start time, time of nested phases] lists"""
+        self.stack: List[list] = []
+
+    def start(self, phase: str) -> None:
+        self.stack.append([phase, time.perf_counter(), 0.])
+
+    def stop(self, phase: str) -> None:
+        """
+        Stops the innermost running phase named ``phase``, and any phases nested in it that were
+        not stopped (e.g., because of an exception).
+        """
+        if not any(running[0] == phase for running in self.stack):
+            return
+        while True:
+            name, start, nested = self.stack.pop()
+            elapsed = time.perf_counter() - start
+            self.durations[name] = self.durations.get(name, 0.) + elapsed - nested
+            if self.stack:
+                self.stack[-1][2] += elapsed
+            if name == phase:
+                return
+
+    def header(self) -> str:
+        """:returns: The value of the ``Server-Timing`` header for all phases so far."""
+        total = time.perf_counter() - self.start_time
+        return ', '.join(f'{phase};dur={duration * 1000:.2f}' for phase, duration in
+                         [*self.durations.items(), ('total', total)])
+
+
+def current_timings():
+    """
+    :returns: The :class:`RequestTimings` of the current request, or None if there is none (e.g.,
+        outside of request contexts, or if SERVER_TIMING is disabled).
+    """
+    return g.get('server_timings') if has_request_context() else None
+
+
+@contextmanager
+def timed(phase: str):
+    """
+    A context manager (or function decorator) that records the time spent within it as the given
+    phase of the current request. Does nothing outside of request contexts.
+
+    :param phase: The name of the phase, see above.
+    """
+    timings = current_timings()
+    if timings is None:
+        yield
+        return
+    timings.start(phase)
+    try:
+        yield
+    finally:
+        timings.stop(phase)
+
+
+def timed_iter(iterable: Iterable, phase: str) -> Iterator:
+    """
+    Iterates over an iterable, recording the time spent waiting for each item (but not the time
+    spent by the consumer of the items) as the given phase of the current request.
+
+    :param iterable: The iterable, e.g. a generator that waits for external processes.
+    :param phase: The name of the phase, see above.
+    """
+    iterator = iter(iterable)
+    while True:
+        with timed(phase):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class TimedJSONEncoder(json.JSONEncoder):
+    """A JSON encoder that records the time spent encoding as the ``serialize`` phase."""
+
+    def encode(self, o):
+        with timed('serialize'):
+            return super().encode(o)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = current_timings()
+    if timings is not None:
+        timings.start('db')
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = current_timings()
+    if timings is not None:
+        timings.stop('db')
+
+
+def _handle_error(exception_context):
+    timings = current_timings()
+    if timings is not None:
+        timings.stop('db')
+
+
+def _start_request():
+    g.server_timings = RequestTimings()
+
+
+def _add_header(response):
+    timings = current_timings()
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.header()
+    return response
+
+
+def init_app(app: Flask) -> None:
+    """
+    Sets up the instrumentation for an app, if the SERVER_TIMING app config value is set.
+
+    Must be called before other ``after_request`` functions are registered (e.g., by
+    Flask-Compress), so that the header is added after they ran and includes their time.
+
+    :param app: The app to instrument.
+    """
+    if not app.config['SERVER_TIMING']:
+        return
+    app.json_encoder = TimedJSONEncoder
+    app.before_request(_start_request)
+    app.after_request(_add_header)
+    for name, listener in [('before_cursor_execute', _before_cursor_execute),
+                           ('after_cursor_execute', _after_cursor_execute),
+                           ('handle_error', _handle_error)]:
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
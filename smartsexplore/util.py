@@ -2,18 +2,188 @@
 Contains reusable utility code for the SMARTSexplore application.
 """
 
+import json
+import os
+import signal
 import subprocess
 import logging
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Iterable, Iterator, List, Optional
+
+from smartsexplore.metrics import record_process
+
+
+class ProcessStats:
+    """
+    The resource usage of one run of an external process, as recorded by :func:`run_process` and
+    :func:`stream_process`.
+    """
+
+    def __init__(self, cmd, returncode: Optional[int], wall_time: float,
+                 user_time: Optional[float] = None, system_time: Optional[float] = None,
+                 max_rss: Optional[int] = None, stdout_bytes: Optional[int] = None,
+                 stderr_bytes: Optional[int] = None):
+        """
+        :param cmd: The command of the process.
+        :param returncode: The return code of the process (negative if it was killed by a
+            signal), or None if it could not be started.
+        :param wall_time: The time from starting the process until it exited, in seconds.
+        :param user_time: The user CPU time of the process, in seconds.
+        :param system_time: The system CPU time of the process, in seconds.
+        :param max_rss: The maximum resident set size of the process, in KiB.
+        :param stdout_bytes: The size of the process's standard output, if captured. Counted in
+            characters by :func:`stream_process`, which is the same for ASCII output.
+        :param stderr_bytes: The size of the process's standard error, if captured.
+        """
+        self.cmd = [str(part) for part in cmd]
+        self.returncode = returncode
+        self.wall_time = wall_time
+        self.user_time = user_time
+        self.system_time = system_time
+        self.max_rss = max_rss
+        self.stdout_bytes = stdout_bytes
+        self.stderr_bytes = stderr_bytes
+        """The time the process finished, as a UNIX timestamp"""
+        self.finished_at = time.time()
+
+    @property
+    def tool(self) -> str:
+        """The file name of the executable of the process."""
+        return os.path.basename(self.cmd[0]) if self.cmd else ''
+
+    def to_dict(self, with_cmd: bool = True) -> dict:
+        """
+        :param with_cmd: Whether to include the command line of the process.
+        :returns: The fields of this object, and the tool name, as a dictionary.
+        """
+        fields = {'tool': self.tool, **vars(self)}
+        if not with_cmd:
+            del fields['cmd']
+        return fields
+
+    def __repr__(self):
+        return f"<ProcessStats(tool={self.tool}, returncode={self.returncode}, "\
+               f"wall_time={self.wall_time:.3f}, max_rss={self.max_rss})>"
+
+
+"""The maximum number of process runs kept by :func:`recent_process_runs`"""
+MAX_RECENT_PROCESS_RUNS = 1000
+"""The most recent process runs of this process, oldest first"""
+_recent_process_runs: 'deque[ProcessStats]' = deque(maxlen=MAX_RECENT_PROCESS_RUNS)
+
+
+def recent_process_runs(tool: Optional[str] = None, limit: Optional[int] = None
+                        ) -> List[ProcessStats]:
+    """
+    Gets the most recent runs of external processes in this process (at most
+    :data:`MAX_RECENT_PROCESS_RUNS`), newest first.
+
+    :param tool: If given, only returns runs of the tool with this executable file name.
+    :param limit: If given, returns at most this many runs.
+    :returns: A list of :class:`ProcessStats`.
+    """
+    runs = [run for run in reversed(list(_recent_process_runs))
+            if tool is None or run.tool == tool]
+    return runs[:limit] if limit is not None else runs
+
+
+def _wait_with_rusage(process: subprocess.Popen, lock: threading.Lock):
+    """
+    Waits for a process to exit like ``process.wait()``, and sets its return code.
+
+    The process is only reaped (after which its ID may be reused by another process) while
+    holding ``lock``, which is also held by :func:`_kill_unless_reaped`, so that a timeout of the
+    process can never kill another process.
+
+    :param process: The process to wait for.
+    :param lock: The lock guarding the reaping and killing of the process.
+    :returns: The resource usage of the process, as given by os.wait4, or None if it is not
+        available (e.g., not on Linux, or if the process was already waited for).
+    """
+    if not hasattr(os, 'wait4') or not hasattr(os, 'waitid') or process.returncode is not None:
+        process.wait()
+        return None
+    try:
+        # waits for the process to exit, but leaves it a zombie, so that its ID is not reused yet
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+    except ChildProcessError:  # already waited for, e.g. by process.kill()
+        process.wait()
+        return None
+    with lock:
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except ChildProcessError:  # already waited for, e.g. by process.kill()
+            process.wait()
+            return None
+        process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) \
+            else os.WEXITSTATUS(status)
+    return rusage
+
+
+def _kill_unless_reaped(process: subprocess.Popen, lock: threading.Lock) -> bool:
+    """
+    Kills a process, unless it has already exited (and might be reaped by
+    :func:`_wait_with_rusage`, or already was).
+
+    :param process: The process to kill.
+    :param lock: The lock guarding the reaping and killing of the process.
+    :returns: Whether the process was still running, and was killed.
+    """
+    with lock:
+        if process.returncode is not None:
+            return False
+        if not hasattr(os, 'waitid'):  # reaped by process.wait(), which process.kill() respects
+            process.kill()
+            return True
+        try:
+            # checks whether the process has exited, without reaping it (see _wait_with_rusage)
+            exited = os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+        except ChildProcessError:  # already reaped
+            return False
+        if exited is not None:
+            return False
+        # not process.kill(), which would reap the process if it exits in the meantime
+        os.kill(process.pid, signal.SIGKILL)
+        return True
+
+
+def _finish_run(cmd, returncode: Optional[int], start: float, rusage=None,
+                stdout_bytes: Optional[int] = None, stderr_bytes: Optional[int] = None
+                ) -> ProcessStats:
+    """
+    Records a finished process run: logs it as a structured ``process_run`` event (with the
+    :meth:`ProcessStats.to_dict` fields as JSON, and in the ``process_run`` attribute of the log
+    record), keeps it for :func:`recent_process_runs`, and adds it to the metrics of
+    :mod:`smartsexplore.metrics`.
+    """
+    stats = ProcessStats(
+        cmd, returncode, time.perf_counter() - start,
+        user_time=rusage.ru_utime if rusage is not None else None,
+        system_time=rusage.ru_stime if rusage is not None else None,
+        max_rss=rusage.ru_maxrss if rusage is not None else None,
+        stdout_bytes=stdout_bytes, stderr_bytes=stderr_bytes
+    )
+    _recent_process_runs.append(stats)
+    logging.info('process_run ' + json.dumps(stats.to_dict()),
+                 extra={'process_run': stats.to_dict()})
+    record_process(stats)
+    return stats
 
 
 def run_process(cmd, timeout=None, stdout=None, stderr=None, reraise_exceptions=False, **kwargs):
     """
-    Helper function that wraps subprocess.run with some additional
+    Helper function that runs a process like subprocess.run, with some additional
     exception handling that is useful to us.
 
+    Records the wall time, CPU time, peak memory and output sizes of the process (see
+    :class:`ProcessStats` and :func:`recent_process_runs`).
+
     .. note::
         Will log an error message via the ``logging`` module if anything goes wrong.
-        Passes shell=False to subprocess.run.
+        Passes shell=False to subprocess.Popen.
 
     :param cmd: Just like for subprocess.run.
     :param timeout: Just like for subprocess.run.
@@ -22,28 +192,199 @@ def run_process(cmd, timeout=None, stdout=None, stderr=None, reraise_exceptions=
     :param reraise_exceptions: False by default. If True, caught exceptions will be re-raised.
         The False case is likely more useful for console-based interactions; the True case for
         interactions of a running web application to properly handle errors.
-    :param kwargs: Will be passed directly to subprocess.run.
+    :param kwargs: Will be passed directly to subprocess.Popen.
+    :returns: A subprocess.CompletedProcess (with an additional ``stats`` attribute holding the
+        :class:`ProcessStats`), or None if the process could not be started.
     """
     stdout = stdout or subprocess.PIPE
     stderr = stderr or subprocess.PIPE
     process = None
+    start = time.perf_counter()
     try:
-        process = subprocess.run(
-            cmd, stdout=stdout, stderr=stderr,
-            shell=False, timeout=timeout, **kwargs
+        try:
+            popen = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, shell=False, **kwargs)
+        except Exception:
+            _finish_run(cmd, None, start)
+            raise
+
+        outputs = {}
+        readers = [
+            threading.Thread(target=lambda name=name, stream=stream:
+                             outputs.__setitem__(name, stream.read()), daemon=True)
+            for name, stream in [('stdout', popen.stdout), ('stderr', popen.stderr)]
+            if stream is not None
+        ]
+        timed_out = threading.Event()
+        reap_lock = threading.Lock()
+        timer = threading.Timer(timeout, lambda: _kill_unless_reaped(popen, reap_lock)
+                                and timed_out.set()) if timeout is not None else None
+        for thread in readers + ([timer] if timer is not None else []):
+            thread.start()
+        rusage = _wait_with_rusage(popen, reap_lock)
+        if timer is not None:
+            timer.cancel()
+        for thread in readers:
+            thread.join()
+        for stream in (popen.stdout, popen.stderr):
+            if stream is not None:
+                stream.close()
+
+        process = subprocess.CompletedProcess(cmd, popen.returncode, outputs.get('stdout'),
+                                              outputs.get('stderr'))
+        process.stats = _finish_run(
+            cmd, popen.returncode, start, rusage,
+            *(len(outputs[name]) if name in outputs else None for name in ('stdout', 'stderr'))
         )
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout, process.stdout, process.stderr)
         if process.returncode != 0:
             raise Exception("Return code != 0, it is " + str(process.returncode))
     except Exception as e:
         if process is not None:
             logging.error("Process FAILED during runtime. Command was:" + " ".join(cmd))
             logging.error("Output on standard out:")
-            logging.error(process.stdout.decode('utf-8'))
+            logging.error((process.stdout or b'').decode('utf-8'))
             logging.error("Output on standard error:")
-            logging.error(process.stderr.decode('utf-8'))
+            logging.error((process.stderr or b'').decode('utf-8'))
         else:
             logging.error("Process FAILED starting up. Command was:" + " ".join(cmd))
 
         if reraise_exceptions:
             raise e
     return process
+
+
+def stream_process(cmd, input_lines: Optional[Iterable[str]] = None, timeout=None,
+                   stderr=None, **kwargs) -> Iterator[str]:
+    """
+    Runs a process and yields the lines it writes to standard out while it is running, so that
+    its output can be parsed without being buffered in memory or in a temporary file first.
+
+    .. note::
+        Like :func:`run_process`, logs an error message via the ``logging`` module if anything goes
+        wrong, records the resource usage of the process, and passes shell=False to
+        subprocess.Popen. Unlike :func:`run_process`, exceptions are always raised, since the
+        consumer of the output lines cannot meaningfully continue. If the consumer stops iterating
+        early, the process is killed.
+
+    :param cmd: Just like for subprocess.Popen.
+    :param input_lines: An optional iterable (e.g., a generator) of lines to feed to the standard
+        input of the process. Lines must include their line endings. Fed from a separate thread.
+    :param timeout: An optional number of seconds after which the process is killed.
+    :param stderr: Just like for subprocess.Popen. By default, standard error is collected and
+        logged if the process fails.
+    :param kwargs: Will be passed directly to subprocess.Popen.
+    :raises: An exception if the process cannot be started, exits with a non-zero return code,
+        or times out.
+    """
+    capture_stderr = stderr is None
+    start = time.perf_counter()
+    try:
+        process = subprocess.Popen(
+            cmd, stdin=subprocess.DEVNULL if input_lines is None else subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE if capture_stderr else stderr,
+            shell=False, universal_newlines=True, encoding='utf-8', **kwargs
+        )
+    except Exception:
+        _finish_run(cmd, None, start)
+        logging.error("Process FAILED starting up. Command was:" + " ".join(cmd))
+        raise
+
+    threads = []
+    if input_lines is not None:
+        threads.append(threading.Thread(target=_feed_lines, args=(process.stdin, input_lines),
+                                        daemon=True))
+    stderr_lines = []
+    if capture_stderr:
+        threads.append(threading.Thread(target=lambda: stderr_lines.extend(process.stderr),
+                                        daemon=True))
+    reap_lock = threading.Lock()
+    timer = threading.Timer(timeout, _kill_unless_reaped, args=(process, reap_lock)) \
+        if timeout is not None else None
+    for thread in threads:
+        thread.start()
+    if timer is not None:
+        timer.start()
+
+    finished = False
+    stdout_bytes = 0
+    rusage = None
+    try:
+        for line in process.stdout:
+            stdout_bytes += len(line)
+            yield line
+        rusage = _wait_with_rusage(process, reap_lock)
+        for thread in threads:
+            thread.join()
+        finished = True
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if not finished:
+            _kill_unless_reaped(process, reap_lock)
+            rusage = _wait_with_rusage(process, reap_lock)
+        process.stdout.close()
+        if capture_stderr:
+            process.stderr.close()
+        _finish_run(cmd, process.returncode, start, rusage, stdout_bytes,
+                    sum(map(len, stderr_lines)) if capture_stderr else None)
+
+    if process.returncode != 0:
+        logging.error("Process FAILED during runtime. Command was:" + " ".join(cmd))
+        if capture_stderr:
+            logging.error("Output on standard error:")
+            logging.error(''.join(stderr_lines))
+        raise Exception("Return code != 0, it is " + str(process.returncode))
+
+
+def _feed_lines(stream, lines: Iterable[str]) -> None:
+    """
+    Writes all lines to a stream and closes it. Used by :func:`stream_process` to feed the
+    standard input of a process. Stops silently if the process closes its standard input early.
+    """
+    try:
+        for line in lines:
+            stream.write(line)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            stream.close()
+        except BrokenPipeError:
+            pass
+
+
+"""The directory of a RAM-backed filesystem, used for temporary files if available"""
+RAM_TEMPDIR = '/dev/shm'
+
+
+def ram_tempfile(mode='w+', suffix=None) -> tempfile.NamedTemporaryFile:
+    """
+    Creates a named temporary file in a RAM-backed filesystem (:data:`RAM_TEMPDIR`) if one is
+    available, and in the default temporary directory otherwise. Meant for passing inputs to
+    external tools that insist on reading from a file path, without any disk I/O.
+
+    :param mode: Just like for tempfile.NamedTemporaryFile.
+    :param suffix: Just like for tempfile.NamedTemporaryFile.
+    :returns: A handle to the created temporary file, which is deleted once closed.
+    """
+    ram_dir = RAM_TEMPDIR if os.access(RAM_TEMPDIR, os.W_OK) else None
+    return tempfile.NamedTemporaryFile(mode=mode, suffix=suffix, dir=ram_dir)
+
+
+def parse_id_list(raw_ids: str, name: str = 'ids') -> List[int]:
+    """
+    Parses a comma-separated list of integer IDs, e.g. as given in a query parameter.
+
+    :param raw_ids: The comma-separated list.
+    :param name: The name of the parameter, for error messages.
+    :returns: The list of unique IDs, in the given order.
+    :raises: ValueError, if the list is empty or malformed.
+    """
+    try:
+        ids = list(dict.fromkeys(int(id_) for id_ in raw_ids.split(',') if id_.strip()))
+    except ValueError:
+        raise ValueError(f'Parameter {name} must be a comma-separated list of integers.')
+    if not ids:
+        raise ValueError(f'Parameter {name} must contain at least one ID.')
+    return ids
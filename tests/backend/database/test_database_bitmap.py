@@ -0,0 +1,91 @@
+import random
+
+import pytest
+
+from smartsexplore.database import Molecule, MoleculeSet, MoleculeSetMatches, SMARTS
+from smartsexplore.database.bitmap import MatchBitmap, smarts_matching_any, smarts_matching_all
+from smartsexplore.molecules.actions import store_match_bitmap
+
+
+@pytest.fixture
+def random_matches():
+    random.seed(42)
+    molecule_ids = list(range(100, 400))
+    smarts_ids = random.sample(range(1, 1000), 50)
+    matches = {(smarts_id, molecule_id) for molecule_id in molecule_ids
+               for smarts_id in random.sample(smarts_ids, random.randint(0, 5))}
+    return molecule_ids, smarts_ids, matches
+
+
+def test_bitmap_lookups(random_matches):
+    molecule_ids, smarts_ids, matches = random_matches
+    bitmap = MatchBitmap.from_matches(molecule_ids, smarts_ids, matches | {(5000, 100), (1, 1)})
+
+    assert len(bitmap) == len(matches)  # matches of unknown molecules or SMARTS are ignored
+    assert set(bitmap.matches(block_size=7)) == matches
+    for molecule_id in molecule_ids[:20]:
+        assert bitmap.smarts_for_molecule(molecule_id) == \
+            sorted(s for s, m in matches if m == molecule_id)
+    for smarts_id in smarts_ids[:20]:
+        assert bitmap.molecules_for_smarts(smarts_id) == \
+            sorted(m for s, m in matches if s == smarts_id)
+    assert bitmap.smarts_for_molecule(1) == []
+    assert bitmap.molecules_for_smarts(5000) == []
+
+
+def test_bitmap_set_operations_across_molecule_sets(session):
+    smartss = [SMARTS(name=f'smarts{i}', pattern=pattern, library='test')
+               for i, pattern in enumerate(['C', 'N', 'O', 'S', 'P'])]
+    molsets = [MoleculeSet(), MoleculeSet()]
+    molecules = [[Molecule(name=pattern, pattern=pattern, molset=molset) for pattern in patterns]
+                 for molset, patterns in zip(molsets, (['CC', 'CO'], ['CN', 'OS', 'NC']))]
+    session.add_all(smartss + molsets + molecules[0] + molecules[1])
+    session.commit()
+
+    bitmaps = []
+    for molset, set_molecules in zip(molsets, molecules):
+        store_match_bitmap(session, molset,
+                           [(molecule.id, molecule.pattern) for molecule in set_molecules],
+                           [(smarts.id, molecule.id) for smarts in smartss
+                            for molecule in set_molecules if smarts.pattern in molecule.pattern])
+        session.commit()
+        bitmaps.append(session.query(MoleculeSetMatches).get(molset.id).to_bitmap())
+    # e.g. a set stored before a SMARTS was added, so over different SMARTS
+    bitmaps.append(MatchBitmap.from_matches([molecules[0][0].id], [smartss[0].id],
+                                            [(smartss[0].id, molecules[0][0].id)]))
+    ids = {smarts.pattern: smarts.id for smarts in smartss}
+
+    assert smarts_matching_any(bitmaps[:2]) == [ids['C'], ids['N'], ids['O'], ids['S']]
+    assert smarts_matching_all(bitmaps[:2]) == [ids['C'], ids['O']]
+    assert smarts_matching_all(bitmaps) == [ids['C']]
+    assert smarts_matching_any(bitmaps[1:]) == smarts_matching_any(bitmaps[:2])
+    assert smarts_matching_any(bitmaps[2:]) == smarts_matching_all(bitmaps[2:]) == [ids['C']]
+    assert smarts_matching_any([]) == smarts_matching_all([]) == []
+    assert smarts_matching_all([bitmaps[0], MatchBitmap.from_matches([], [], [])]) == []
+
+
+def test_bitmap_serialization_is_compact(random_matches):
+    molecule_ids, smarts_ids, matches = random_matches
+    bitmap = MatchBitmap.from_matches(molecule_ids, smarts_ids, matches)
+    columns = bitmap.to_columns()
+    assert MatchBitmap.from_columns(**columns) == bitmap
+    assert sum(map(len, columns.values())) < len(matches) * 8  # less than 8 bytes per match
+
+    empty = MatchBitmap.from_matches([], [], [])
+    assert len(empty) == 0
+    assert list(MatchBitmap.from_columns(**empty.to_columns()).matches()) == []
+
+
+def test_bitmap_storage(session, random_matches):
+    molecule_ids, smarts_ids, matches = random_matches
+    molset = MoleculeSet()
+    session.add(MoleculeSetMatches(molset,
+                                   MatchBitmap.from_matches(molecule_ids, smarts_ids, matches)))
+    session.commit()
+
+    stored = session.query(MoleculeSet).get(molset.id).match_bitmap
+    assert set(stored.to_bitmap().matches()) == matches
+
+    session.delete(molset)
+    session.commit()
+    assert session.query(MoleculeSetMatches).count() == 0
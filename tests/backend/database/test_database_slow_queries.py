@@ -0,0 +1,60 @@
+from smartsexplore.database import SMARTS, get_session, close_session
+from smartsexplore.database.slow_queries import normalize_statement, read_slow_query_log, \
+    summarize_slow_queries
+
+
+def test_normalize_statement():
+    assert normalize_statement(
+        "SELECT a.id FROM a\n  WHERE a.id IN (?, ?, ?) AND a.name = 'x''y' LIMIT 10"
+    ) == 'SELECT a.id FROM a WHERE a.id IN (?, ...) AND a.name = ? LIMIT ?'
+    assert normalize_statement('SELECT anon_1.id FROM t1 WHERE x IN (1,2)') == \
+        'SELECT anon_1.id FROM t1 WHERE x IN (?, ...)'
+
+
+def test_slow_query_log(app, client, tmp_path):
+    log_filename = str(tmp_path / 'slow.jsonl')
+    app.config['SLOW_QUERY_THRESHOLD'] = 0  # log every statement
+    app.config['SLOW_QUERY_LOG'] = log_filename
+    close_session()  # so that a new engine with the slow-query log is created
+    session = get_session()
+    session.add_all([SMARTS(name=f'smarts{i}', pattern='C', library='test') for i in range(3)])
+    session.commit()
+
+    assert client.get('/molecules/matches/counts?molsets=1').status_code == 404
+    entries = read_slow_query_log(log_filename)
+    assert sum(entry['statement'].startswith('INSERT INTO smarts ') for entry in entries) == 3
+    request_entries = [entry for entry in entries
+                       if entry['context'] == 'GET molecules.match_counts_for_molecule_sets']
+    assert len(request_entries) == 1
+    assert request_entries[0]['parameters'] == '(1,)'
+    assert request_entries[0]['plan'] and 'molecule_sets' in request_entries[0]['plan'][0]
+
+
+def test_summarize_slow_queries():
+    entries = [
+        {'normalized': 'SELECT ?', 'duration': 0.5, 'context': 'a', 'plan': ['x']},
+        {'normalized': 'SELECT ?', 'duration': 0.2, 'context': 'b', 'plan': ['y']},
+        {'normalized': 'DELETE', 'duration': 0.6, 'context': 'a', 'plan': None},
+    ]
+    top = summarize_slow_queries(entries, top=1)
+    assert top == [{'normalized': 'SELECT ?', 'count': 2, 'total': 0.7, 'max': 0.5, 'mean': 0.35,
+                    'contexts': {'a': 1, 'b': 1}, 'plan': ['x']}]
+    assert summarize_slow_queries(entries, sort='max')[0]['normalized'] == 'DELETE'
+
+
+def test_slow_queries_command(app, tmp_path):
+    log_filename = tmp_path / 'slow.jsonl'
+    log_filename.write_text(
+        '{"normalized": "SELECT * FROM molecule_smarts_matches WHERE smarts_id = ?", '
+        '"duration": 0.25, "context": "GET smarts.matches_for_smarts", '
+        '"plan": ["SCAN molecule_smarts_matches"]}\nmalformed\n'
+    )
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['db', 'slow_queries', '--log', str(log_filename)])
+    assert result.exit_code == 0
+    assert '#1: 1x, total 250.0 ms' in result.output
+    assert 'GET smarts.matches_for_smarts (1x)' in result.output
+    assert 'plan: SCAN molecule_smarts_matches  <-- full scan' in result.output
+
+    app.config['SLOW_QUERY_LOG'] = str(tmp_path / 'missing.jsonl')
+    assert runner.invoke(args=['db', 'slow_queries']).exit_code != 0
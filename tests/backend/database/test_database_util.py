@@ -60,3 +60,145 @@ def test_molecule_tempfile(session):
         db_id = session.query(Molecule).filter_by(pattern=pattern).first().id
         expected_line = f'{pattern}\t{db_id}'
         assert expected_line in striplines
+
+
+def test_smarts_export_file(session):
+    import os
+    import pytest
+    from smartsexplore.database import get_smarts_export_file, get_smarts_set_version, \
+        NoSMARTSException
+
+    with pytest.raises(NoSMARTSException):
+        get_smarts_export_file()
+
+    session.add_all([SMARTS(name=f'smarts{i}', pattern='C' * (i+1), library='test')
+                     for i in range(5)])
+    session.commit()
+    version = get_smarts_set_version()
+
+    filename = get_smarts_export_file()
+    assert version in os.path.basename(filename)
+    with open(filename) as file:
+        lines = [line.strip() for line in file]
+    assert lines == [f'{smarts.pattern}\t{smarts.id}'
+                     for smarts in session.query(SMARTS).order_by(SMARTS.id)]
+
+    # unchanged SMARTS set: the existing export is reused without rewriting it
+    mtime = os.stat(filename).st_mtime_ns
+    assert get_smarts_export_file() == filename
+    assert os.stat(filename).st_mtime_ns == mtime
+
+    # changed SMARTS set: a new export replaces the old one, which is kept for one more version
+    session.add(SMARTS(name='new', pattern='N', library='test'))
+    session.commit()
+    assert get_smarts_set_version() != version
+    new_filename = get_smarts_export_file()
+    assert new_filename != filename
+    assert os.path.exists(filename)
+    with open(new_filename) as file:
+        assert len(file.readlines()) == 6
+
+    # removing the SMARTS with the highest ID and adding another one changes the version, too
+    stale_tmp_filename = os.path.join(os.path.dirname(filename), 'interrupted.tmp')
+    open(stale_tmp_filename, 'w').close()
+    os.utime(stale_tmp_filename, (0, 0))
+    version = get_smarts_set_version()
+    session.delete(session.query(SMARTS).filter_by(name='new').one())
+    session.commit()
+    session.add(SMARTS(name='newer', pattern='O', library='test'))
+    session.commit()
+    assert get_smarts_set_version() != version
+    newest_filename = get_smarts_export_file()
+    assert newest_filename not in (filename, new_filename)
+    assert not os.path.exists(filename)
+    assert os.path.exists(new_filename)
+    assert not os.path.exists(stale_tmp_filename)
+
+
+def test_init_db_creates_missing_indexes(app, session):
+    from sqlalchemy import inspect
+    from smartsexplore.database import init_db
+
+    def _match_indexes():
+        return {index['name']
+                for index in inspect(session.bind).get_indexes('molecule_smarts_matches')}
+
+    assert 'ix_molecule_smarts_matches_smarts_id' in _match_indexes()
+    session.execute('DROP INDEX ix_molecule_smarts_matches_smarts_id')
+    session.commit()
+    assert 'ix_molecule_smarts_matches_smarts_id' not in _match_indexes()
+
+    init_db()
+    assert 'ix_molecule_smarts_matches_smarts_id' in _match_indexes()
+
+
+def test_init_db_adds_missing_columns(app, session):
+    from sqlalchemy import inspect
+    from smartsexplore.database import init_db
+
+    def _molset_columns():
+        return {column['name'] for column in inspect(session.bind).get_columns('molecule_sets')}
+
+    session.add(MoleculeSet())
+    session.commit()
+    session.execute('DROP INDEX ix_molecule_sets_last_accessed')
+    session.execute('ALTER TABLE molecule_sets DROP COLUMN last_accessed')
+    session.commit()
+    assert 'last_accessed' not in _molset_columns()
+
+    init_db()
+    assert 'last_accessed' in _molset_columns()
+    session.expire_all()
+    assert session.query(MoleculeSet).filter(MoleculeSet.last_accessed.is_(None)).count() == 0
+
+
+def test_init_db_enables_molecule_set_autoincrement(app, session):
+    from smartsexplore.database import init_db
+
+    def _molset_table_sql():
+        return session.execute("SELECT sql FROM sqlite_master WHERE name = 'molecule_sets'")\
+            .scalar()
+
+    # created like before MoleculeSet was declared with AUTOINCREMENT
+    session.execute('DROP TABLE molecule_sets')
+    session.execute('CREATE TABLE molecule_sets (id INTEGER NOT NULL, last_accessed DATETIME, '
+                    'PRIMARY KEY (id))')
+    session.execute("INSERT INTO molecule_sets VALUES (5, '2020-01-01 00:00:00')")
+    session.commit()
+    assert 'AUTOINCREMENT' not in _molset_table_sql()
+
+    init_db()
+    init_db()
+    assert 'AUTOINCREMENT' in _molset_table_sql()
+    assert [molset.id for molset in session.query(MoleculeSet)] == [5]
+    molset = MoleculeSet()
+    session.add(molset)
+    session.commit()
+    assert molset.id == 6
+    session.delete(molset)
+    session.commit()
+    molset = MoleculeSet()
+    session.add(molset)
+    session.commit()
+    assert molset.id == 7
+
+
+def test_init_db_adds_missing_molecule_set_smarts_counts(app, session):
+    from smartsexplore.database import init_db, MoleculeSet, MoleculeSetMatches, \
+        MoleculeSetSMARTSCount
+    from smartsexplore.database.bitmap import MatchBitmap
+
+    smarts = SMARTS(name='carbon', pattern='C', library='test')
+    molset = MoleculeSet()
+    session.add_all([smarts, molset])
+    session.commit()
+    # stored like before MoleculeSetSMARTSCount was added
+    session.add(MoleculeSetMatches(molset, MatchBitmap.from_matches([1, 2], [smarts.id],
+                                                                    [(smarts.id, 2)])))
+    session.commit()
+    assert session.query(MoleculeSetSMARTSCount).count() == 0
+
+    init_db()
+    init_db()
+    assert [(row.molset_id, row.smarts_id, row.nof_molecules)
+            for row in session.query(MoleculeSetSMARTSCount)] == [(molset.id, smarts.id, 1)]
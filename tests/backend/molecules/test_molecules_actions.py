@@ -3,6 +3,7 @@ import pytest
 from smartsexplore.database import MoleculeSet, Molecule, SMARTS, Match
 from smartsexplore.molecules.actions import calculate_molecule_matches, \
     create_molecules_from_smiles_file
+from smartsexplore.parsers import parse_smiles_stream
 
 
 def test_nodematches(session):
@@ -20,7 +21,7 @@ def test_nodematches(session):
     molset_count = session.query(MoleculeSet).count()
 
     with open("./tests/backend/testdata/test_molecules.smi", "rb") as file:
-        calculate_molecule_matches(file)
+        calculate_molecule_matches(parse_smiles_stream(file))
 
     assert session.query(Match).count() != 0
     assert session.query(MoleculeSet).count() == molset_count + 1
@@ -79,7 +80,7 @@ def test_molmatches_succeeds_even_when_no_smarts_are_available(session):
     assert session.query(Molecule).count() == 0
 
     with open("./tests/backend/testdata/test_molecules.smi", "rb") as file:
-        calculate_molecule_matches(file)
+        calculate_molecule_matches(parse_smiles_stream(file))
 
     assert session.query(SMARTS).count() == 0
     assert session.query(Match).count() == 0
@@ -100,6 +101,6 @@ def test_molmatches_deletes_molset_if_error_occurs(session, app):
     nof_mols = session.query(Molecule).count()
     with open("./tests/backend/testdata/test_molecules.smi", "rb") as file:
         with pytest.raises(Exception):
-            calculate_molecule_matches(file)
+            calculate_molecule_matches(parse_smiles_stream(file))
     assert session.query(MoleculeSet).count() == nof_molsets
     assert session.query(Molecule).count() == nof_mols
\ No newline at end of file
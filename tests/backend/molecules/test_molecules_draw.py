@@ -3,7 +3,8 @@ import os
 import tempfile
 
 from smartsexplore.database import Molecule, MoleculeSet, current_app
-from smartsexplore.molecules.draw import draw_molecules_from_molset
+from smartsexplore.molecules.draw import draw_molecules_from_molset, \
+    MOLECULE_IMAGE_BUNDLE_FILENAME
 
 
 def test_draw_molset(session):
@@ -39,3 +40,28 @@ def test_draw_molset(session):
             assert os.path.isdir(expected_output_path)
             for molecule in molset.molecules:
                 assert os.path.isfile(os.path.join(expected_output_path, f'{molecule.id}.svg'))
+            assert os.path.isfile(
+                os.path.join(expected_output_path, MOLECULE_IMAGE_BUNDLE_FILENAME)
+            )
+
+
+def test_draw_molset_in_chunks(session, app, fake_tools):
+    molset = MoleculeSet()
+    for i in range(23):
+        session.add(Molecule(pattern='C' * (i+1), name=str(i), molset=molset))
+    session.commit()
+
+    for chunk_size in [1, 4, 10, 23, 100]:
+        app.config['MOL2SVG_CHUNK_SIZE'] = chunk_size
+        with tempfile.TemporaryDirectory() as fake_outdir:
+            app.config['STATIC_MOL2SVG_MOLECULE_SETS_PATH'] = fake_outdir
+            draw_molecules_from_molset(molset)
+
+            output_path = os.path.join(fake_outdir, str(molset.id))
+            assert sorted(os.listdir(output_path)) == sorted(
+                [f'{molecule.id}.svg' for molecule in molset.molecules]
+                + [MOLECULE_IMAGE_BUNDLE_FILENAME]
+            )
+            for molecule in molset.molecules:
+                with open(os.path.join(output_path, f'{molecule.id}.svg')) as file:
+                    assert f'<title>{molecule.pattern}</title>' in file.read()
@@ -0,0 +1,187 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from smartsexplore.database import Match, Molecule, MoleculeSet, MoleculeSetMatches, \
+    MoleculeSetSMARTSCount, SMARTS
+from smartsexplore.molecules.actions import store_match_bitmap
+from smartsexplore.molecules.eviction import touch_molecule_set, find_evictable_molecule_sets, \
+    collect_molecule_sets, evict_molecule_sets, TOUCH_INTERVAL
+
+
+@pytest.fixture
+def aged_molecule_sets(session):
+    """
+    Three molecule sets of 2, 3 and 4 molecules, last accessed 3 hours, 2 hours and 10 minutes ago.
+    The first one stores its matches as rows, the second one as a bitmap.
+    """
+    now = datetime.utcnow()
+    smarts = SMARTS(name='carbon', pattern='C', library='test')
+    molsets = [
+        MoleculeSet(last_accessed=now - timedelta(hours=3)),
+        MoleculeSet(last_accessed=now - timedelta(hours=2)),
+        MoleculeSet(last_accessed=now - timedelta(minutes=10))
+    ]
+    for molset, nof_molecules in zip(molsets, (2, 3, 4)):
+        for i in range(nof_molecules):
+            session.add(Molecule(name=f'mol{i}', pattern='CC', molset=molset))
+    session.add(smarts)
+    session.add_all(molsets)
+    session.commit()
+
+    for molecule in molsets[0].molecules:
+        session.add(Match(molecule=molecule, smarts=smarts))
+    molecules = [(molecule.id, molecule.pattern) for molecule in molsets[1].molecules]
+    store_match_bitmap(session, molsets[1], molecules,
+                       [(smarts.id, molecule_id) for molecule_id, _ in molecules])
+    session.commit()
+    return [molset.id for molset in molsets]
+
+
+def test_new_molecule_sets_are_accessed_now(session):
+    molset = MoleculeSet()
+    session.add(molset)
+    session.commit()
+    assert datetime.utcnow() - molset.last_accessed < timedelta(minutes=1)
+
+
+def test_touch_molecule_set(session, aged_molecule_sets):
+    molset = session.query(MoleculeSet).get(aged_molecule_sets[0])
+    touch_molecule_set(session, molset.id)
+    session.refresh(molset)
+    touched = molset.last_accessed
+    assert datetime.utcnow() - touched < TOUCH_INTERVAL
+
+    # touching again within the interval does not update it
+    touch_molecule_set(session, molset.id)
+    session.refresh(molset)
+    assert molset.last_accessed == touched
+
+
+def test_find_evictable_molecule_sets_by_ttl(session, aged_molecule_sets):
+    assert find_evictable_molecule_sets(session) == []
+    assert find_evictable_molecule_sets(session, ttl=timedelta(hours=4)) == []
+    assert find_evictable_molecule_sets(session, ttl=timedelta(hours=2.5)) == \
+        [aged_molecule_sets[0]]
+    assert set(find_evictable_molecule_sets(session, ttl=timedelta(hours=1))) == \
+        set(aged_molecule_sets[:2])
+
+
+def test_find_evictable_molecule_sets_by_budget(session, aged_molecule_sets):
+    assert find_evictable_molecule_sets(session, budget=9) == []
+    assert find_evictable_molecule_sets(session, budget=7) == [aged_molecule_sets[0]]
+    assert set(find_evictable_molecule_sets(session, budget=5)) == set(aged_molecule_sets[:2])
+    # the most recently accessed molecule set is within the grace period
+    assert set(find_evictable_molecule_sets(session, budget=0,
+                                            now=datetime.utcnow() - timedelta(minutes=30))) == \
+        set(aged_molecule_sets[:2])
+
+
+def test_find_evictable_molecule_sets_by_budget_is_least_recently_used(session):
+    now = datetime.utcnow()
+    molsets = []
+    # 4, 5 and 2 molecules, from the most to the least recently accessed
+    for hours, nof_molecules in ((1, 4), (2, 5), (3, 2)):
+        molset = MoleculeSet(last_accessed=now - timedelta(hours=hours))
+        session.add_all([molset] + [Molecule(name=f'mol{i}', pattern='C', molset=molset)
+                                    for i in range(nof_molecules)])
+        molsets.append(molset)
+    session.commit()
+
+    # the least recently accessed set is evicted, although it would still fit into the budget
+    assert find_evictable_molecule_sets(session, budget=7) == [molsets[1].id, molsets[2].id]
+
+
+def test_sweeper_lock_is_held_by_one_process(app):
+    from smartsexplore.molecules.eviction import _acquire_sweeper_lock
+
+    lock_path = os.path.join(app.instance_path, 'molecule_set_gc.lock')
+    lock_file = _acquire_sweeper_lock(lock_path)
+    assert lock_file is not None
+    assert _acquire_sweeper_lock(lock_path) is None
+    lock_file.close()
+    other_lock_file = _acquire_sweeper_lock(lock_path)
+    assert other_lock_file is not None
+    other_lock_file.close()
+
+
+def test_collect_molecule_sets(app, session, aged_molecule_sets):
+    image_dirs = [os.path.join(app.config['STATIC_MOL2SVG_MOLECULE_SETS_PATH'], str(molset_id))
+                  for molset_id in aged_molecule_sets]
+    for image_dir in image_dirs:
+        os.makedirs(image_dir)
+
+    evicted = collect_molecule_sets(session, ttl=timedelta(hours=1))
+    assert set(evicted) == set(aged_molecule_sets[:2])
+
+    session.expire_all()
+    assert [molset_id for molset_id, in session.query(MoleculeSet.id)] == [aged_molecule_sets[2]]
+    assert session.query(Molecule).count() == 4
+    assert session.query(Match).count() == 0
+    assert session.query(MoleculeSetMatches).count() == 0
+    assert session.query(MoleculeSetSMARTSCount).count() == 0
+    assert [os.path.isdir(image_dir) for image_dir in image_dirs] == [False, False, True]
+
+
+def test_collect_molecule_sets_uses_config(app, session, aged_molecule_sets):
+    assert collect_molecule_sets(session) == []
+    app.config['MOLECULE_SET_BUDGET'] = 7
+    assert collect_molecule_sets(session) == [aged_molecule_sets[0]]
+
+
+def test_gc_command(app, session, aged_molecule_sets):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['molecules', 'gc', '--ttl', '9000', '--dry-run'])
+    assert result.exit_code == 0, result.output
+    assert f'[{aged_molecule_sets[0]}]' in result.output
+    assert session.query(MoleculeSet).count() == 3
+
+    result = runner.invoke(args=['molecules', 'gc', '--ttl', '9000'])
+    assert result.exit_code == 0, result.output
+    assert f'Evicted 1 molecule sets: [{aged_molecule_sets[0]}]' in result.output
+    assert session.query(MoleculeSet).count() == 2
+
+
+def test_routes_touch_molecule_sets(client, session, aged_molecule_sets):
+    molset_id = aged_molecule_sets[0]
+    assert client.get(f'/molecules/matches/{molset_id}').status_code == 200
+    last_accessed, = session.query(MoleculeSet.last_accessed).filter_by(id=molset_id).one()
+    assert datetime.utcnow() - last_accessed < TOUCH_INTERVAL
+
+
+def test_eviction_vacuums_sqlite_database(session):
+    molset = MoleculeSet(last_accessed=datetime.utcnow() - timedelta(hours=3))
+    session.add_all([Molecule(name=f'mol{i}' * 10, pattern='C' * 100, molset=molset)
+                     for i in range(5000)])
+    session.commit()
+    molset_id = molset.id
+    page_count = session.execute('PRAGMA page_count').scalar()
+
+    assert collect_molecule_sets(session, ttl=timedelta(hours=1)) == [molset_id]
+    assert session.execute('PRAGMA freelist_count').scalar() == 0
+    assert session.execute('PRAGMA page_count').scalar() < page_count / 2
+
+
+def test_match_counts_of_new_molecule_set_after_eviction_elsewhere(session, monkeypatch):
+    from smartsexplore.molecules import actions
+
+    smarts = SMARTS(name='carbon', pattern='C', library='test')
+    evicted = MoleculeSet()
+    molecules = [Molecule(name=f'mol{i}', pattern='CC', molset=evicted) for i in range(2)]
+    session.add_all([smarts, evicted] + molecules)
+    session.commit()
+    session.add(Match(molecule=molecules[0], smarts=smarts))
+    session.commit()
+    evicted_id = evicted.id
+    assert actions.match_counts(session, evicted_id) == (2, {smarts.id: 1})
+
+    # evicted by another process, so the cache of this process is not cleared
+    monkeypatch.setattr(actions, 'forget_match_counts', lambda molset_id: None)
+    evict_molecule_sets(session, [evicted_id])
+
+    uploaded = MoleculeSet()
+    session.add_all([Molecule(name=f'mol{i}', pattern='N', molset=uploaded) for i in range(3)])
+    session.commit()
+    assert uploaded.id != evicted_id
+    assert actions.match_counts(session, uploaded.id) == (3, {})
@@ -0,0 +1,89 @@
+import itertools
+import random
+
+import pytest
+
+from smartsexplore.database import SMARTS, DirectedEdge
+from smartsexplore.molecules.hierarchy import SubsetHierarchy, brute_force_match
+from smartsexplore.molecules.matching import get_matching_backend, match_molecules
+
+
+def _substring_subset_edges(patterns):
+    """All (from, to) edges where pattern `from` describes a subset of pattern `to`, using
+    substring matching as the matching semantics."""
+    return [(i, j) for (i, p), (j, q) in itertools.permutations(enumerate(patterns), 2)
+            if q in p]
+
+
+def test_hierarchy_orders_general_before_specific():
+    patterns = ['C', 'CO', 'CCO', 'N', 'CN', 'C']  # 0 and 5 are equivalent
+    hierarchy = SubsetHierarchy(range(len(patterns)), _substring_subset_edges(patterns))
+
+    assert sorted(map(sorted, hierarchy.components)) == [[0, 5], [1], [2], [3], [4]]
+    position = {smarts_id: i for i, component in enumerate(hierarchy.components)
+                for smarts_id in component}
+    for from_id, to_id in _substring_subset_edges(patterns):
+        assert position[to_id] <= position[from_id]
+
+
+def test_hierarchy_matches_like_brute_force():
+    random.seed(42)
+    alphabet = 'CNO'
+    patterns = list({''.join(random.choices(alphabet, k=random.randint(1, 4)))
+                     for _ in range(60)})
+    patterns += patterns[:5]  # add some equivalent patterns
+    molecules = [''.join(random.choices(alphabet, k=random.randint(1, 12))) for _ in range(200)]
+    hierarchy = SubsetHierarchy(range(len(patterns)), _substring_subset_edges(patterns))
+
+    total_stats = None
+    for molecule in molecules:
+        def test(smarts_id):
+            return patterns[smarts_id] in molecule
+
+        matched_ids, stats = hierarchy.match(test)
+        assert matched_ids == brute_force_match(range(len(patterns)), test)
+        assert stats.tested + stats.pruned + stats.inferred == len(patterns)
+        total_stats = stats if total_stats is None else total_stats + stats
+
+    assert total_stats.pruned > 0
+    assert total_stats.inferred > 0
+    assert 0 < total_stats.saved_ratio < 1
+
+
+def test_hierarchy_ignores_unknown_smarts_and_self_loops():
+    hierarchy = SubsetHierarchy([1, 2], [(1, 2), (2, 2), (1, 3), (4, 1)])
+    assert hierarchy.components == [[2], [1]]
+    assert hierarchy.parents == [[], [0]]
+
+
+def test_rdkit_backend_with_hierarchy_pruning(session, app):
+    pytest.importorskip('rdkit')
+    patterns = {
+        'carbon': '[#6]', 'carbon_alt': '[C,c]', 'co': 'CO', 'carbonyl': 'C=O',
+        'acid': 'CC(=O)O', 'nitrogen': '[#7]', 'amine': 'N', 'sulfur': 'S'
+    }
+    smartss = {name: SMARTS(name=name, pattern=pattern, library='test')
+               for name, pattern in patterns.items()}
+    session.add_all(smartss.values())
+    subsets = [('carbon', 'carbon_alt'), ('carbon_alt', 'carbon'), ('co', 'carbon'),
+               ('carbonyl', 'carbon'), ('acid', 'co'), ('acid', 'carbonyl'),
+               ('amine', 'nitrogen')]
+    session.add_all([DirectedEdge(from_smarts=smartss[f], to_smarts=smartss[t],
+                                  mcssim=0.5, spsim=0.5) for f, t in subsets])
+    session.commit()
+
+    molecules = list(enumerate(['CC(=O)O', 'CCO', 'N', 'c1ccncc1', 'O', 'S', 'CS', 'OCCN'] * 5))
+    app.config['MATCHING_BACKEND'] = 'rdkit'
+    app.config['MATCHTOOL_MAX_WORKERS'] = 1
+
+    app.config['MATCHING_HIERARCHY_PRUNING'] = False
+    unpruned_matches = set(match_molecules(molecules, get_matching_backend()))
+
+    app.config['MATCHING_HIERARCHY_PRUNING'] = True
+    backend = get_matching_backend()
+    pruned_matches = set(match_molecules(molecules, backend))
+
+    assert pruned_matches == unpruned_matches
+    assert backend.stats.pruned > 0
+    assert backend.stats.inferred > 0
+    assert backend.stats.tested < len(molecules) * len(patterns)
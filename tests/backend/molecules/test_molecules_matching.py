@@ -0,0 +1,193 @@
+import os
+
+import pytest
+
+from smartsexplore.database import Match, MoleculeSet
+from smartsexplore.molecules.actions import calculate_molecule_matches
+from smartsexplore.molecules.matching import match_molecules, get_matching_backend, \
+    screen_molecules, RDKitMatchingBackend
+from smartsexplore.parsers import parse_smiles_stream
+
+
+@pytest.fixture(params=['external', 'rdkit'])
+def backend_name(request, app, fake_matcher):
+    """
+    Parametrizes a test over all matching backends. The SMARTS and molecules of the tests below
+    are chosen so that the substring semantics of the fake matcher agree with RDKit.
+    """
+    if request.param == 'rdkit':
+        pytest.importorskip('rdkit')
+    app.config['MATCHING_BACKEND'] = request.param
+    return request.param
+
+
+def _expected_matches(smartss, molecules):
+    return {
+        (smarts.id, label)
+        for smarts in smartss
+        for label, pattern in molecules
+        if smarts.pattern in pattern
+    }
+
+
+def test_match_molecules_in_chunks(app, backend_name, substring_smarts):
+    molecules = [(i, pattern) for i, pattern in enumerate(['CCO', 'CN', 'NN', 'O', 'CCCOS'] * 11)]
+
+    for chunk_size in [1, 3, 50, 1000]:
+        for max_workers in [1, 4]:
+            app.config['MATCHTOOL_CHUNK_SIZE'] = chunk_size
+            app.config['MATCHTOOL_MAX_WORKERS'] = max_workers
+            matches = list(match_molecules(molecules, get_matching_backend()))
+            assert len(matches) == len(set(matches))
+            assert set(matches) == _expected_matches(substring_smarts, molecules)
+
+
+def test_match_chunks_keeps_chunk_order(app, backend_name, substring_smarts):
+    app.config['MATCHTOOL_MAX_WORKERS'] = 3
+    chunks = ([(i, 'C')] for i in range(20))
+    results = list(get_matching_backend().match_chunks(chunks))
+    assert [[label for _, label in matches] for matches in results] == [[i] for i in range(20)]
+
+
+def test_match_molecules_raises_on_failing_chunk(app, fake_matcher, substring_smarts):
+    app.config['MATCHTOOL_CHUNK_SIZE'] = 2
+    molecules = [(1, 'C'), (2, 'N'), (3, 'FAIL'), (4, 'CO')]
+    with pytest.raises(Exception):
+        list(match_molecules(molecules, get_matching_backend()))
+
+
+def test_calculate_molecule_matches_in_chunks(session, app, backend_name, substring_smarts,
+                                              tmp_path):
+    app.config['MATCHTOOL_CHUNK_SIZE'] = 7
+    patterns = ['CCO', 'CN', 'NN', 'O', 'CCCOS'] * 10
+    smiles_filename = tmp_path / 'molecules.smi'
+    smiles_filename.write_text(''.join(f'{pattern} mol{i}\n' for i, pattern in enumerate(patterns)))
+
+    with open(smiles_filename, 'rb') as file:
+        molset = calculate_molecule_matches(parse_smiles_stream(file))
+
+    molecules = [(molecule.id, molecule.pattern) for molecule in molset.molecules]
+    stored_matches = {(match.smarts_id, match.molecule_id) for match in session.query(Match)}
+    assert stored_matches == _expected_matches(substring_smarts, molecules)
+    assert session.query(MoleculeSet).count() == 1
+
+
+def test_calculate_molecule_matches_into_bitmap(session, app, fake_matcher, substring_smarts,
+                                                tmp_path):
+    app.config['MATCH_STORAGE'] = 'bitmap'
+    patterns = ['CCO', 'CN', 'NN', 'O', 'CCCOS'] * 10
+    smiles_filename = tmp_path / 'molecules.smi'
+    smiles_filename.write_text(''.join(f'{pattern} mol{i}\n' for i, pattern in enumerate(patterns)))
+
+    with open(smiles_filename, 'rb') as file:
+        molset = calculate_molecule_matches(parse_smiles_stream(file))
+
+    molecules = [(molecule.id, molecule.pattern) for molecule in molset.molecules]
+    assert session.query(Match).count() == 0
+    bitmap = session.query(MoleculeSet).get(molset.id).match_bitmap.to_bitmap()
+    assert set(bitmap.matches()) == _expected_matches(substring_smarts, molecules)
+
+
+def test_screen_molecules(app, backend_name, substring_smarts):
+    app.config['MATCHTOOL_MAX_WORKERS'] = 2
+    patterns = ['CCO', 'CN', 'NN', 'O', 'CCCOS'] * 20
+    molecules = ((pattern, f'mol{i}') for i, pattern in enumerate(patterns))
+
+    results = list(screen_molecules(molecules, get_matching_backend(), chunk_size=7))
+    assert [index for index, _, _ in results] == list(range(1, len(patterns) + 1))
+    for (index, name, smarts_ids), pattern in zip(results, patterns):
+        assert name == f'mol{index - 1}'
+        assert smarts_ids == sorted(smarts.id for smarts in substring_smarts
+                                    if smarts.pattern in pattern)
+
+
+def test_screen_command(app, fake_matcher, substring_smarts, tmp_path):
+    smiles_filename = tmp_path / 'catalog.smi'
+    smiles_filename.write_text('# a comment\nCCO ethanol\n\nNN\nCCCOS thing\n')
+    output_filename = tmp_path / 'screen.tsv'
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['molecules', 'screen', '--chunk-size', '2',
+                                 str(smiles_filename), str(output_filename)])
+    assert result.exit_code == 0, result.output
+    assert 'Screened 3 molecules' in result.output
+
+    ids = {smarts.pattern: smarts.id for smarts in substring_smarts}
+    lines = [line for line in output_filename.read_text().splitlines()
+             if not line.startswith('#')]
+    assert lines == [
+        f"1\tethanol\t{','.join(map(str, sorted([ids['C'], ids['CO']])))}",
+        f"2\t\t{ids['N']}",
+        f"3\tthing\t{','.join(map(str, sorted([ids['C'], ids['CO'], ids['S']])))}",
+    ]
+
+
+def test_screen_command_without_smarts(app, tmp_path):
+    smiles_filename = tmp_path / 'catalog.smi'
+    smiles_filename.write_text('CCO ethanol\n')
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['molecules', 'screen', str(smiles_filename),
+                                 str(tmp_path / 'screen.tsv')])
+    assert result.exit_code != 0
+    assert 'no SMARTS in the database' in result.output
+    assert result.exception is None or isinstance(result.exception, SystemExit)
+
+
+def test_unknown_matching_backend_raises(app, substring_smarts):
+    app.config['MATCHING_BACKEND'] = 'nonsense'
+    with pytest.raises(ValueError):
+        get_matching_backend()
+
+
+def test_rdkit_backend_agrees_with_external_matcher(session, app):
+    """
+    Cross-checks the RDKit backend against the real SMARTSMoleculeMatcher on the test data.
+    """
+    pytest.importorskip('rdkit')
+    if not os.path.isfile(app.config['MATCHTOOL_PATH']) \
+            or not os.access(app.config['MATCHTOOL_PATH'], os.X_OK):
+        pytest.skip('requires the SMARTSMoleculeMatcher binary (MATCHTOOL_PATH)')
+    from smartsexplore.parsers import parse_smiles
+    from smartsexplore.smarts.actions import add_library
+
+    add_library('test', './tests/backend/testdata/test_smarts.smarts')
+    with open('./tests/backend/testdata/test_molecules.smi') as file:
+        molecules = [(i, pattern) for i, (pattern, _) in enumerate(parse_smiles(file))]
+
+    app.config['MATCHING_BACKEND'] = 'external'
+    external_matches = set(match_molecules(molecules, get_matching_backend()))
+    app.config['MATCHING_BACKEND'] = 'rdkit'
+    rdkit_matches = set(match_molecules(molecules, get_matching_backend()))
+
+    assert len(external_matches) > 0
+    assert rdkit_matches == external_matches
+
+
+def test_rdkit_pools_are_shared_per_database_and_retired_after_use():
+    pytest.importorskip('rdkit')
+    get_smarts = lambda: [(1, 'C'), (2, 'N')]
+    backend = RDKitMatchingBackend('2-2-1', get_smarts, max_workers=2, database='sqlite:///a')
+    same = RDKitMatchingBackend('2-2-1', get_smarts, max_workers=2, database='sqlite:///a')
+    other_database = RDKitMatchingBackend('2-2-1', get_smarts, max_workers=2,
+                                          database='sqlite:///b')
+    prescreened = RDKitMatchingBackend('2-2-1', get_smarts, max_workers=2, prescreen=True,
+                                       database='sqlite:///b')
+
+    pool = backend._acquire_pool()
+    assert same._acquire_pool() is pool
+    other_pool = other_database._acquire_pool()
+    assert other_pool is not pool
+    # the replaced pool stays usable until its users released it
+    assert pool.executor.submit(abs, -1).result() == 1
+    backend._release_pool(pool)
+    assert pool.executor.submit(abs, -2).result() == 2
+    same._release_pool(pool)
+    with pytest.raises(RuntimeError):
+        pool.executor.submit(abs, -3)
+
+    assert prescreened._acquire_pool() is not other_pool
+    other_database._release_pool(other_pool)
+    with pytest.raises(RuntimeError):
+        other_pool.executor.submit(abs, -4)
+    prescreened._release_pool(RDKitMatchingBackend._pools[(prescreened.cache_key, 2)])
@@ -0,0 +1,113 @@
+import itertools
+
+import pytest
+
+from smartsexplore.database import SMARTS
+from smartsexplore.molecules.matching import get_matching_backend, match_molecules
+from smartsexplore.molecules.prescreen import FEATURES, Prescreen, molecule_features, \
+    prescreen_report, smarts_requirements
+
+SMARTS_PATTERNS = [
+    'C', 'CO', 'C=O', '[#6][#7]', '[C,c]', '[N;H2]', '[!C]', '[Cl,Br]', 'ClCCl', 'c1ccccc1',
+    'a', 'C1CC1', '[$(C=O)]O', '[CH2]', 'S(=O)(=O)', '[#9]', '[O-][N+](=O)', '*~*', 'n',
+    'C1CCCCC1.C1CCCCC1', '[Se]', 'O=C-[OH]'
+]
+MOLECULE_PATTERNS = [
+    'CCO', 'CC(=O)O', 'c1ccccc1', 'C1=CC=CC=C1', 'ClCCl', 'C1CC1', 'NCC(=O)O', 'FC(F)F',
+    'O=[N+]([O-])c1ccccc1', 'CS(=O)(=O)C', 'c1ccncc1', 'C1CCCCC1C1CCCCC1', '[Se]', 'O', 'Br',
+    'C%10CC%10', 'c1ccc2ccccc2c1'
+]
+
+
+def _feature(features, name):
+    return features[FEATURES.index(name)]
+
+
+def test_smarts_requirements():
+    assert _feature(smarts_requirements('CC(=O)O'), 'C') == 2
+    assert _feature(smarts_requirements('CC(=O)O'), 'O') == 2
+    assert _feature(smarts_requirements('[#6;R][Cl]'), 'C') == 1
+    assert _feature(smarts_requirements('[#6;R][Cl]'), 'Cl') == 1
+    assert _feature(smarts_requirements('c1ccccc1'), 'rings') == 1
+    assert _feature(smarts_requirements('a'), 'rings') == 1
+    # nothing certain can be derived from lists, negations, recursion and implicit conjunctions
+    for pattern in ['[C,N]', '[!C]', '[$(CO)]', '[CH2]', '*', '[C&N]']:
+        assert smarts_requirements(pattern) == [0] * len(FEATURES)
+
+
+def test_molecule_features():
+    features = molecule_features('O=[N+]([O-])c1ccc(Cl)cc1')
+    assert _feature(features, 'N') == 1
+    assert _feature(features, 'O') == 2
+    assert _feature(features, 'C') == 6
+    assert _feature(features, 'Cl') == 1
+    assert _feature(features, 'rings') == 1
+    assert _feature(molecule_features('C%10CC%10C1CC1'), 'rings') == 2
+    assert _feature(molecule_features('[13CH3][Sc]'), 'C') == 1
+    assert _feature(molecule_features('[13CH3][Sc]'), 'S') == 0
+
+
+def test_prescreen_never_rules_out_rdkit_matches():
+    Chem = pytest.importorskip('rdkit.Chem')
+    prescreen = Prescreen(list(enumerate(SMARTS_PATTERNS)))
+    feasible = prescreen.feasible(MOLECULE_PATTERNS)
+    assert feasible.shape == (len(MOLECULE_PATTERNS), len(SMARTS_PATTERNS))
+
+    for (i, mol_pattern), (j, smarts_pattern) in itertools.product(
+            enumerate(MOLECULE_PATTERNS), enumerate(SMARTS_PATTERNS)):
+        mol, query = Chem.MolFromSmiles(mol_pattern), Chem.MolFromSmarts(smarts_pattern)
+        if mol.HasSubstructMatch(query):
+            assert feasible[i, j], (mol_pattern, smarts_pattern)
+    assert not feasible.all()
+
+
+def test_rdkit_backend_with_prescreen(session, app):
+    pytest.importorskip('rdkit')
+    session.add_all([SMARTS(name=f'smarts{i}', pattern=pattern, library='test')
+                     for i, pattern in enumerate(SMARTS_PATTERNS)])
+    session.commit()
+    molecules = list(enumerate(MOLECULE_PATTERNS * 3))
+    app.config['MATCHING_BACKEND'] = 'rdkit'
+    app.config['MATCHTOOL_MAX_WORKERS'] = 1
+
+    app.config['MATCHING_PRESCREEN'] = False
+    unscreened_matches = set(match_molecules(molecules, get_matching_backend()))
+
+    app.config['MATCHING_PRESCREEN'] = True
+    backend = get_matching_backend()
+    screened_matches = set(match_molecules(molecules, backend))
+
+    assert screened_matches == unscreened_matches
+    assert backend.stats.screened > 0
+    assert backend.stats.tested + backend.stats.screened == \
+        len(molecules) * len(SMARTS_PATTERNS)
+
+
+def test_external_backend_skips_screened_out_molecules(app, fake_matcher, substring_smarts):
+    # 'FAIL' would make the fake matcher fail, but cannot match any SMARTS, so it is never passed
+    molecules = list(enumerate(['CCO', 'O', 'FAIL', 'CN', 'OO']))
+    app.config['MATCHING_PRESCREEN'] = True
+    backend = get_matching_backend()
+    matches = set(match_molecules(molecules, backend))
+
+    ids = {smarts.pattern: smarts.id for smarts in substring_smarts}
+    assert matches == {(ids['C'], 0), (ids['CO'], 0), (ids['C'], 3), (ids['N'], 3)}
+    assert backend.stats.screened == 3 * len(substring_smarts)
+
+
+def test_prescreen_report_and_command(session, app):
+    smarts = [(1, 'ClCCl', 'halogens'), (2, 'C', 'basic'), (3, 'N', 'basic')]
+    report = prescreen_report(smarts, ['CCO', 'ClCCl', 'CN'])
+    assert report == {'halogens': (3, 2), 'basic': (6, 2)}
+
+    session.add_all([SMARTS(id=id, pattern=pattern, name=str(id), library=library)
+                     for id, pattern, library in smarts])
+    session.commit()
+    runner = app.test_cli_runner()
+    with runner.isolated_filesystem():
+        with open('molecules.smiles', 'w') as f:
+            f.write('CCO\tethanol\nClCCl\tdcm\nCN\tmethylamine\n')
+        result = runner.invoke(args=['molecules', 'prescreen', 'molecules.smiles'])
+    assert result.exit_code == 0, result.output
+    assert 'halogens\t3\t2\t66.7%\t3.00x' in result.output
+    assert 'basic\t6\t2\t33.3%\t1.50x' in result.output
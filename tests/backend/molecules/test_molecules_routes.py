@@ -11,12 +11,14 @@ import werkzeug
 
 from sqlalchemy.sql.expression import func
 
-from smartsexplore.database import MoleculeSet, Molecule, SMARTS, Match
-from smartsexplore.molecules.draw import draw_molecules_from_molset
+from smartsexplore.database import MoleculeSet, MoleculeSetMatches, Molecule, SMARTS, Match
+from smartsexplore.database.bitmap import MatchBitmap
+from smartsexplore.molecules.draw import draw_molecules_from_molset, write_molecule_image_bundle
 
 MOLECULE_UPLOAD_URL = '/molecules/upload'
 GET_MATCHES_URL = '/molecules/matches/'
 GET_IMAGES_URL = '/molecules/images/'
+GET_SET_IMAGES_URL = '/molecules/images/set/'
 
 
 @pytest.fixture
@@ -79,6 +81,32 @@ def test_matches_for_existing_molsets_have_valid_format(client, session, smarts_
             assert session.query(Molecule).get(match['molecule_id']).name == match['molecule_name']
 
 
+def test_matches_for_molsets_stored_as_bitmap(client, session, smarts_molecules_and_matches):
+    molset = smarts_molecules_and_matches['molsets'][0]
+    response = client.get(GET_MATCHES_URL + str(molset.id))
+    expected_matches = response.json['matches']
+
+    # move the matches of the molset from rows into a bitmap
+    molecules = [molecule for molecule in smarts_molecules_and_matches['molecules']
+                 if molecule.molset == molset]
+    matches = [(match.smarts_id, match.molecule_id)
+               for match in smarts_molecules_and_matches['matches'] if match.molecule in molecules]
+    bitmap = MatchBitmap.from_matches(
+        [molecule.id for molecule in molecules],
+        [smarts.id for smarts in smarts_molecules_and_matches['smartss']],
+        matches
+    )
+    session.add(MoleculeSetMatches(molset, bitmap))
+    session.query(Match).filter(Match.molecule_id.in_([m.id for m in molecules]))\
+        .delete(synchronize_session=False)
+    session.commit()
+
+    response = client.get(GET_MATCHES_URL + str(molset.id))
+    assert response.status_code == 200
+    key = lambda match: (match['molecule_id'], match['smarts_id'])
+    assert sorted(response.json['matches'], key=key) == sorted(expected_matches, key=key)
+
+
 def test_matches_for_inexistent_molsets_return_404(client, session, smarts_molecules_and_matches):
     highest_molset_id = session.query(func.max(MoleculeSet.id)).first()[0]
     for i in range(1, 10):
@@ -114,6 +142,32 @@ def test_get_inexistent_molecule_image(client, session, smarts_molecules_and_mat
         assert response.status_code == 404
 
 
+def test_get_molecule_set_images(client, app, smarts_molecules_and_matches):
+    import os
+    molsets = smarts_molecules_and_matches['molsets']
+    for molset in molsets:
+        output_dir = os.path.join(app.config['STATIC_MOL2SVG_MOLECULE_SETS_PATH'], str(molset.id))
+        os.makedirs(output_dir)
+        for molecule in molset.molecules:
+            with open(os.path.join(output_dir, f'{molecule.id}.svg'), 'w') as file:
+                file.write(f'<svg id="{molecule.id}"></svg>')
+        write_molecule_image_bundle(output_dir, [molecule.id for molecule in molset.molecules])
+
+    for molset in molsets:
+        response = client.get(GET_SET_IMAGES_URL + str(molset.id))
+        assert response.status_code == 200
+        assert response.json == {
+            str(molecule.id): f'<svg id="{molecule.id}"></svg>'
+            for molecule in molset.molecules
+        }
+
+
+def test_get_inexistent_molecule_set_images(client, session, smarts_molecules_and_matches):
+    highest_molset_id = session.query(func.max(MoleculeSet.id)).first()[0]
+    response = client.get(GET_SET_IMAGES_URL + str(highest_molset_id + 1))
+    assert response.status_code == 404
+
+
 def test_molecule_upload_should_fail_without_file(client):
     response = client.post(MOLECULE_UPLOAD_URL)
     assert response.status_code == 400
@@ -172,6 +226,48 @@ def test_molecule_upload_should_fail_for_too_many_molecules(client, app, smarts_
     assert response.status_code == 400
 
 
+def test_molecule_upload_should_fail_for_too_large_files(client, app, smarts_molecules_and_matches):
+    app.config['MAX_UPLOADED_MOLECULE_FILE_SIZE'] = 100
+    too_large_smiles_file = _mk_file(b'CCC triplecarbon\n' * 10, filename='toolarge.smi')
+    response = _upload_molecule(client, too_large_smiles_file)
+    assert response.status_code == 400
+    assert 'bytes' in response.json['error']
+
+
+def test_molecule_upload_should_fail_early_for_too_large_requests(client, app, session,
+                                                                  smarts_molecules_and_matches):
+    nof_molecule_sets_pre = session.query(MoleculeSet).count()
+    app.config['MAX_UPLOADED_MOLECULE_FILE_SIZE'] = 100
+    too_large_smiles_file = _mk_file(b'C' * 10**6, filename='toolarge.smi')
+    response = _upload_molecule(client, too_large_smiles_file)
+    assert response.status_code == 413
+    assert 'bytes' in response.json['error']
+    assert session.query(MoleculeSet).count() == nof_molecule_sets_pre
+
+
+def test_molecule_upload_should_fail_for_too_large_chunked_requests(client, app, session,
+                                                                    smarts_molecules_and_matches):
+    nof_molecule_sets_pre = session.query(MoleculeSet).count()
+    app.config['MAX_UPLOADED_MOLECULE_FILE_SIZE'] = 100
+    boundary, body = werkzeug.test.encode_multipart(
+        {'file': _mk_file(b'C' * 10**6, filename='toolarge.smi')}
+    )
+    # no Content-Length header, as with chunked transfer encoding
+    response = client.post(MOLECULE_UPLOAD_URL, input_stream=io.BytesIO(body),
+                           content_type=f'multipart/form-data; boundary={boundary}',
+                           environ_overrides={'CONTENT_LENGTH': '',
+                                              'wsgi.input_terminated': True})
+    assert response.status_code == 413
+    assert 'bytes' in response.json['error']
+    assert session.query(MoleculeSet).count() == nof_molecule_sets_pre
+
+
+def test_max_content_length_should_follow_max_uploaded_molecule_file_size(app):
+    from smartsexplore.molecules.routes import MULTIPART_OVERHEAD
+    assert app.config['MAX_CONTENT_LENGTH'] == \
+        app.config['MAX_UPLOADED_MOLECULE_FILE_SIZE'] + MULTIPART_OVERHEAD
+
+
 def test_molecule_upload_should_fail_for_wrong_smiles(client, smarts_molecules_and_matches):
     smiles_file = _mk_file(b'ABXYZ affe\n', filename='elwrongo.smi')
     response = _upload_molecule(client, smiles_file)
@@ -209,3 +305,59 @@ def test_successful_molecule_upload_should_return_matches(client, session, smart
     for match in json['matches']:
         assert match['molecule_id'] == new_mol.id
         assert match['molecule_name'] == 'singlecarbon'
+
+
+GET_MATCH_COUNTS_URL = '/molecules/matches/counts'
+
+
+def test_match_counts_for_molsets(client, session, smarts_molecules_and_matches):
+    molsets = smarts_molecules_and_matches['molsets']
+    query = '?fractions=1&molsets=' + ','.join(str(molset.id) for molset in molsets)
+    response = client.get(GET_MATCH_COUNTS_URL + query)
+    assert response.status_code == 200
+
+    for molset in molsets:
+        result = response.json['molecule_sets'][str(molset.id)]
+        molecules = [molecule for molecule in smarts_molecules_and_matches['molecules']
+                     if molecule.molset == molset]
+        expected_counts = {}
+        for match in smarts_molecules_and_matches['matches']:
+            if match.molecule in molecules:
+                smarts_id = str(match.smarts_id)
+                expected_counts[smarts_id] = expected_counts.get(smarts_id, 0) + 1
+        assert result['nof_molecules'] == len(molecules)
+        assert result['counts'] == expected_counts
+        assert result['fractions'] == {smarts_id: count / len(molecules)
+                                       for smarts_id, count in expected_counts.items()}
+
+    # the same counts are computed from a match bitmap (and are cached per molset)
+    molset = molsets[0]
+    expected = client.get(GET_MATCH_COUNTS_URL + f'?molsets={molset.id}').json
+    molecules = [molecule for molecule in smarts_molecules_and_matches['molecules']
+                 if molecule.molset == molset]
+    bitmap = MatchBitmap.from_matches(
+        [molecule.id for molecule in molecules],
+        [smarts.id for smarts in smarts_molecules_and_matches['smartss']],
+        [(match.smarts_id, match.molecule_id) for match in smarts_molecules_and_matches['matches']
+         if match.molecule in molecules]
+    )
+    session.add(MoleculeSetMatches(molset, bitmap))
+    session.query(Match).filter(Match.molecule_id.in_([m.id for m in molecules]))\
+        .delete(synchronize_session=False)
+    session.commit()
+    assert client.get(GET_MATCH_COUNTS_URL + f'?molsets={molset.id}').json == expected
+
+    from smartsexplore.molecules.actions import forget_match_counts
+    forget_match_counts(molset.id)
+    assert client.get(GET_MATCH_COUNTS_URL + f'?molsets={molset.id}').json == expected
+
+
+def test_match_counts_invalid_request(client, session, smarts_molecules_and_matches):
+    for query in ['', '?molsets=', '?molsets=1,x']:
+        response = client.get(GET_MATCH_COUNTS_URL + query)
+        assert response.status_code == 400
+        assert 'error' in response.json
+
+    highest_molset_id = session.query(func.max(MoleculeSet.id)).first()[0]
+    response = client.get(GET_MATCH_COUNTS_URL + f'?molsets=1,{highest_molset_id + 1}')
+    assert response.status_code == 404
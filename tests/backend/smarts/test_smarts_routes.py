@@ -149,3 +149,148 @@ def test_get_inexistent_edge_image(client, session, drawn_smarts_with_edges):
         nonexistent_id = highest_smarts_id + i
         response = client.get(IMAGE_URL + str(nonexistent_id))
         assert response.status_code == 404
+
+
+BATCH_IMAGE_URL = '/smarts/smartsview/batch'
+BATCH_SUBSET_IMAGE_URL = '/smarts/smartssubsets/batch'
+
+
+def _write_fake_svgs(directory, ids):
+    import os
+    os.makedirs(directory, exist_ok=True)
+    for id_ in ids:
+        with open(os.path.join(directory, f'{id_}.svg'), 'w') as file:
+            file.write(f'<svg id="{id_}"></svg>')
+
+
+def test_get_smarts_image_batch(client, app, smarts_with_edges):
+    smarts_ids = [smarts.id for smarts in smarts_with_edges['smarts']]
+    _write_fake_svgs(app.config['STATIC_SMARTSVIEW_PATH'], smarts_ids[:10])
+
+    ids = smarts_ids[:10] + [max(smarts_ids) + 1]
+    response = client.get(BATCH_IMAGE_URL + '?ids=' + ','.join(map(str, ids)))
+    assert response.status_code == 200
+    assert set(response.json['images'].keys()) == set(map(str, smarts_ids[:10]))
+    for id_, svg in response.json['images'].items():
+        assert svg == f'<svg id="{id_}"></svg>'
+    assert response.json['missing'] == [max(smarts_ids) + 1]
+
+
+def test_get_edge_image_batch(client, app, smarts_with_edges):
+    edge_ids = [edge.id for edge in smarts_with_edges['edges']]
+    _write_fake_svgs(app.config['STATIC_SMARTSVIEW_SUBSETS_PATH'], edge_ids)
+
+    response = client.get(BATCH_SUBSET_IMAGE_URL + '?ids=' + ','.join(map(str, edge_ids)))
+    assert response.status_code == 200
+    assert set(response.json['images'].keys()) == set(map(str, edge_ids))
+    assert response.json['missing'] == []
+
+
+def test_image_batch_invalid_request(client, app):
+    for query in ['', '?ids=', '?ids=1,x,3', '?ids=1;2']:
+        response = client.get(BATCH_IMAGE_URL + query)
+        assert response.status_code == 400
+        assert 'error' in response.json
+
+    too_many_ids = range(1, app.config['MAX_IMAGE_BATCH_SIZE'] + 2)
+    response = client.get(BATCH_IMAGE_URL + '?ids=' + ','.join(map(str, too_many_ids)))
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def smarts_with_matches(session):
+    from smartsexplore.database import MoleculeSet, Molecule, Match
+    from smartsexplore.molecules.actions import store_match_bitmap
+
+    smartss = [SMARTS(name=f'xyz{i}', pattern='C', library='test') for i in range(3)]
+    molsets = [MoleculeSet() for _ in range(3)]
+    molecules = [Molecule(name=f'mol{i}', pattern='CC', molset=molsets[i % 3]) for i in range(30)]
+    session.add_all(smartss + molsets + molecules)
+    session.commit()
+
+    # the first two molecule sets store their matches as rows, the last one as a bitmap
+    matches = {(smartss[i % 2].id, molecule.id) for i, molecule in enumerate(molecules)}
+    session.add_all([Match(molecule=molecule, smarts=smartss[i % 2])
+                     for i, molecule in enumerate(molecules) if molecule.molset != molsets[2]])
+    bitmap_molecules = [(molecule.id, molecule.pattern) for molecule in molecules
+                        if molecule.molset == molsets[2]]
+    bitmap_molecule_ids = {molecule_id for molecule_id, _ in bitmap_molecules}
+    store_match_bitmap(session, molsets[2], bitmap_molecules,
+                       [(s, m) for s, m in matches if m in bitmap_molecule_ids])
+    session.commit()
+    return {'smarts': smartss, 'molsets': molsets, 'molecules': molecules, 'matches': matches}
+
+
+def test_get_matches_for_smarts(client, smarts_with_matches):
+    smarts = smarts_with_matches['smarts'][0]
+    expected = sorted(m for s, m in smarts_with_matches['matches'] if s == smarts.id)
+    molecule_set_of = {molecule.id: molecule.molset_id
+                       for molecule in smarts_with_matches['molecules']}
+
+    molecule_ids, after = [], None
+    while True:
+        response = client.get(f'/smarts/{smarts.id}/matches?limit=4'
+                              + (f'&after={after}' if after is not None else ''))
+        assert response.status_code == 200
+        json = response.json
+        assert json['total'] == len(expected)
+        assert sum(json['counts'].values()) == len(expected)
+        for match in json['matches']:
+            assert match['molecule_set_id'] == molecule_set_of[match['molecule_id']]
+            assert match['molecule_name'].startswith('mol')
+        molecule_ids += [match['molecule_id'] for match in json['matches']]
+        after = json['next_after']
+        if after is None:
+            break
+    assert molecule_ids == expected
+
+    # the last molecule set stores its matches as a bitmap
+    bitmap_molset = smarts_with_matches['molsets'][2]
+    response = client.get(f'/smarts/{smarts.id}/matches?molsets={bitmap_molset.id}')
+    assert list(response.json['counts'].keys()) == [str(bitmap_molset.id)]
+    assert [match['molecule_id'] for match in response.json['matches']] == \
+        [m for m in expected if molecule_set_of[m] == bitmap_molset.id]
+    assert response.json['next_after'] is None
+
+
+def test_get_matches_for_smarts_only_decompresses_matching_bitmaps(client, session, monkeypatch,
+                                                                   smarts_with_matches):
+    from smartsexplore.database import MoleculeSet, MoleculeSetMatches, Molecule
+    from smartsexplore.molecules.actions import store_match_bitmap
+
+    smartss = smarts_with_matches['smarts']
+    molset = MoleculeSet()
+    molecule = Molecule(name='other', pattern='N', molset=molset)
+    session.add_all([molset, molecule])
+    session.commit()
+    store_match_bitmap(session, molset, [(molecule.id, molecule.pattern)],
+                       [(smartss[2].id, molecule.id)])  # only matches the third SMARTS
+    session.commit()
+
+    decompressed = []
+    to_bitmap = MoleculeSetMatches.to_bitmap
+    monkeypatch.setattr(MoleculeSetMatches, 'to_bitmap',
+                        lambda stored: decompressed.append(stored.molset_id) or to_bitmap(stored))
+    response = client.get(f'/smarts/{smartss[0].id}/matches')
+    assert response.status_code == 200
+    assert decompressed == [smarts_with_matches['molsets'][2].id]
+    assert str(molset.id) not in response.json['counts']
+
+    decompressed.clear()
+    response = client.get(f'/smarts/{smartss[2].id}/matches')
+    assert decompressed == [molset.id]
+    assert response.json['counts'] == {str(molset.id): 1}
+
+
+
+def test_get_matches_for_smarts_invalid_request(client, app, smarts_with_matches):
+    smarts = smarts_with_matches['smarts'][0]
+    max_page_size = app.config['MAX_MATCHES_PAGE_SIZE']
+    for query in ['?limit=0', f'?limit={max_page_size + 1}', '?limit=x', '?after=x',
+                  '?molsets=', '?molsets=1,x']:
+        response = client.get(f'/smarts/{smarts.id}/matches{query}')
+        assert response.status_code == 400
+        assert 'error' in response.json
+
+    response = client.get(f'/smarts/{smarts.id + 1000}/matches')
+    assert response.status_code == 404
@@ -0,0 +1,100 @@
+import os
+import time
+
+import pytest
+
+from smartsexplore.database import SMARTS, DirectedEdge, UndirectedEdge, MoleculeSet, Molecule
+from smartsexplore.molecules.matching import match_molecules, get_matching_backend
+
+
+@pytest.fixture
+def nested_smarts(session):
+    smartss = [SMARTS(name=f'smarts{i}', pattern=pattern, library='test')
+               for i, pattern in enumerate(['CCO', 'CC', 'C', 'N'])]
+    session.add_all(smartss)
+    session.commit()
+    return smartss
+
+
+def test_fake_smartscompare_subsets(session, fake_tools, nested_smarts):
+    from smartsexplore.smarts.actions import calculate_edges
+
+    calculate_edges('SubsetOfFirst')
+    patterns = {smarts.id: smarts.pattern for smarts in nested_smarts}
+    assert {(patterns[edge.from_id], patterns[edge.to_id])
+            for edge in session.query(DirectedEdge)} == {('CC', 'CCO'), ('C', 'CCO'), ('C', 'CC')}
+
+
+def test_fake_smartscompare_output_volume(session, fake_tools, nested_smarts, monkeypatch):
+    from smartsexplore.smarts.actions import calculate_edges
+
+    monkeypatch.setenv('FAKE_SMARTSCOMPARE_EDGES', '5')
+    calculate_edges('Similarity')
+    edges = session.query(UndirectedEdge).all()
+    assert len(edges) == 5
+    assert all(0.1 < edge.spsim <= 1 for edge in edges)
+
+
+def test_fake_smartscompare_fails_while_streaming(session, fake_tools, nested_smarts,
+                                                  monkeypatch):
+    from smartsexplore.smarts.actions import calculate_edges
+
+    monkeypatch.setenv('FAKE_SMARTSCOMPARE_FAIL_AFTER', '4')
+    with pytest.raises(Exception):
+        calculate_edges('SubsetOfFirst')
+
+
+def test_fake_matcher_match_rate(app, fake_tools, nested_smarts, monkeypatch):
+    molecules = [(i, 'CCCC') for i in range(50)]
+    assert len(list(match_molecules(molecules, get_matching_backend()))) == 50 * 2
+
+    monkeypatch.setenv('FAKE_MATCHTOOL_MATCH_RATE', '0')
+    assert list(match_molecules(molecules, get_matching_backend())) == []
+    monkeypatch.setenv('FAKE_MATCHTOOL_MATCH_RATE', '1')
+    assert len(list(match_molecules(molecules, get_matching_backend()))) == 50 * 4
+    monkeypatch.setenv('FAKE_MATCHTOOL_MATCH_RATE', '0.5')
+    matches = list(match_molecules(molecules, get_matching_backend()))
+    assert 0 < len(matches) < 50 * 4
+    assert list(match_molecules(molecules, get_matching_backend())) == matches
+
+
+def test_fake_tools_failure_and_latency(app, fake_tools, nested_smarts, monkeypatch):
+    monkeypatch.setenv('FAKE_TOOLS_FAIL', '1')
+    with pytest.raises(Exception):
+        list(match_molecules([(1, 'C')], get_matching_backend()))
+
+    monkeypatch.setenv('FAKE_TOOLS_FAIL', '0')
+    monkeypatch.setenv('FAKE_MATCHTOOL_LATENCY', '0.3')
+    start = time.perf_counter()
+    assert list(match_molecules([(1, 'C')], get_matching_backend())) == \
+        [(nested_smarts[2].id, 1)]
+    assert time.perf_counter() - start >= 0.3
+
+
+def test_fake_mol2svg(app, session, fake_tools, monkeypatch):
+    from smartsexplore.molecules.draw import draw_molecules_from_molset
+
+    monkeypatch.setenv('FAKE_MOL2SVG_SVG_BYTES', '1000')
+    app.config['MOL2SVG_CHUNK_SIZE'] = 12
+    molset = MoleculeSet()
+    session.add_all([Molecule(name=f'mol{i}', pattern='CCO', molset=molset) for i in range(30)])
+    session.commit()
+
+    draw_molecules_from_molset(molset)
+    output_dir = os.path.join(app.config['STATIC_MOL2SVG_MOLECULE_SETS_PATH'], str(molset.id))
+    for molecule in molset.molecules:
+        assert os.path.getsize(os.path.join(output_dir, f'{molecule.id}.svg')) == 1000
+
+
+def test_fake_smartscompare_viewer(app, session, fake_tools, nested_smarts, tmp_path):
+    from smartsexplore.smarts.draw import draw_one_smarts, draw_one_smarts_subset_relation
+
+    draw_one_smarts(nested_smarts[0], fake_tools['SMARTSCOMPARE_VIEWER_PATH'], str(tmp_path))
+    assert 'CCO' in (tmp_path / f'{nested_smarts[0].id}.svg').read_text()
+
+    edge = DirectedEdge(nested_smarts[1], nested_smarts[0], 0.5, 0.5)
+    session.add(edge)
+    session.commit()
+    draw_one_smarts_subset_relation(edge, fake_tools['SMARTSCOMPARE_VIEWER_PATH'],
+                                    str(tmp_path))
+    assert 'CC | CCO' in (tmp_path / f'{edge.id}.svg').read_text()
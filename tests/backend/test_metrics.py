@@ -0,0 +1,139 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+from smartsexplore.database import SMARTS
+from smartsexplore.metrics import Registry, Counter, Gauge, Histogram, PROCESS_RUNS, \
+    CACHE_REQUESTS
+from smartsexplore.util import run_process, stream_process
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = Registry()
+    registry.directory = str(tmp_path)
+    return registry
+
+
+def test_render_prometheus_text_format(registry):
+    counter = Counter('test_total', 'A counter.', ['route'], registry=registry)
+    histogram = Histogram('test_seconds', 'A histogram.', buckets=(0.1, 1), registry=registry)
+    counter.inc(route='/a')
+    counter.inc(2, route='/b "quoted"')
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    assert registry.render().splitlines() == [
+        '# HELP test_total A counter.',
+        '# TYPE test_total counter',
+        'test_total{route="/a"} 1.0',
+        'test_total{route="/b \\"quoted\\""} 2.0',
+        '# HELP test_seconds A histogram.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{le="0.1"} 2.0',
+        'test_seconds_bucket{le="1.0"} 3.0',
+        'test_seconds_bucket{le="+Inf"} 4.0',
+        'test_seconds_sum 5.65',
+        'test_seconds_count 4.0',
+    ]
+    with pytest.raises(ValueError):
+        counter.inc()
+
+
+def test_multiprocess_directory(registry, tmp_path):
+    counter = Counter('test_total', 'A counter.', registry=registry)
+    gauge = Gauge('test_gauge', 'A gauge.', registry=registry)
+    histogram = Histogram('test_seconds', 'A histogram.', buckets=(1,), registry=registry)
+    counter.inc()
+    gauge.inc(3)
+    histogram.observe(0.5)
+    registry.flush()
+    assert os.path.isfile(tmp_path / f'{os.getpid()}.json')
+
+    # an alive and an exited worker process
+    for pid in (os.getppid(), 2**22 + 1):
+        with open(tmp_path / f'{pid}.json', 'w') as f:
+            json.dump({'test_total': [[[], 2.]], 'test_gauge': [[[], 5.]],
+                       'test_seconds': [[[], [0., 1., 2.]]]}, f)
+
+    collected = registry.collect()
+    assert collected['test_total'] == {(): 5.}
+    assert collected['test_gauge'] == {(): 8.}  # the exited process's gauge is dropped
+    assert collected['test_seconds'] == {(): [1., 2., 4.5]}
+
+
+def test_values_reset_after_fork(registry):
+    counter = Counter('test_total', 'A counter.', registry=registry)
+    counter.inc()
+    registry.pid = -1  # as if the values were inherited from a parent process
+    counter.inc()
+    assert registry.collect()['test_total'] == {(): 1.}
+
+
+def test_metrics_route(client, fake_tools, session):
+    session.add(SMARTS(name='smarts', pattern='C', library='test'))
+    session.commit()
+    tool = os.path.basename(fake_tools['MATCHTOOL_PATH'])
+    runs_before = PROCESS_RUNS.values.get((tool, '0'), 0)
+
+    assert client.post('/smarts/data', json={'spsim_min': 0, 'spsim_max': 1}).status_code == 200
+    assert client.post('/molecules/upload', data={
+        'file': (io.BytesIO(b'CCO ethanol\nCC ethane\n'), 'molecules.smi')
+    }).status_code == 302
+    assert client.get('/molecules/matches/counts?molsets=1').status_code == 200
+    assert client.get('/molecules/matches/counts?molsets=1').status_code == 200
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'smartsexplore_requests_total{endpoint="smarts.data",method="POST",status="200"}' \
+        in text
+    assert 'smartsexplore_request_duration_seconds_count{endpoint="smarts.data"}' in text
+    assert 'smartsexplore_upload_molecules_count' in text
+    assert 'smartsexplore_molecule_set_matches_sum' in text
+    assert 'smartsexplore_db_checkouts_total' in text
+    assert PROCESS_RUNS.values[(tool, '0')] > runs_before
+    assert CACHE_REQUESTS.values[('match_counts', 'hit')] >= 1
+
+
+def test_metrics_route_only_allows_configured_addresses(app, client):
+    assert client.get('/metrics').status_code == 200
+    response = client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.7'})
+    assert response.status_code == 403
+    assert 'error' in response.json
+
+    app.config['METRICS_ALLOWED_ADDRESSES'] = None
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.7'}).status_code == 200
+
+
+def test_process_metrics():
+    tool = os.path.basename(sys.executable)
+    before = {key: value for key, value in PROCESS_RUNS.values.items() if key[0] == tool}
+
+    run_process([sys.executable, '-c', 'pass'])
+    run_process([sys.executable, '-c', 'import sys; sys.exit(3)'])
+    with pytest.raises(Exception):
+        list(stream_process([sys.executable, '-c', 'import sys; sys.exit(3)']))
+    run_process(['/nonexistent/tool'])
+
+    assert PROCESS_RUNS.values[(tool, '0')] == before.get((tool, '0'), 0) + 1
+    assert PROCESS_RUNS.values[(tool, '3')] == before.get((tool, '3'), 0) + 2
+    assert PROCESS_RUNS.values[('tool', 'error')] >= 1
+
+
+def test_process_runs_route(client):
+    run_process([sys.executable, '-c', 'pass'])
+    runs = client.get('/metrics/processes?limit=1').get_json()['runs']
+    assert len(runs) == 1
+    assert runs[0]['tool'] == os.path.basename(sys.executable)
+    assert runs[0]['returncode'] == 0
+    assert runs[0]['max_rss'] > 0
+    assert 'cmd' not in runs[0]
+    assert client.get('/metrics/processes?tool=nothing').get_json() == {'runs': []}
+    assert client.get('/metrics/processes?limit=x').status_code == 400
+    assert client.get('/metrics/processes',
+                      environ_base={'REMOTE_ADDR': '203.0.113.7'}).status_code == 403
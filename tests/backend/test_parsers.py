@@ -1,3 +1,42 @@
-from smartsexplore.parsers import parse_smartscompare
+import io
+
+import pytest
+
+from smartsexplore.parsers import parse_smartscompare, parse_smiles, parse_smiles_stream
 
 #def test_parse_smartscompare(session):
+
+
+def test_parse_smiles():
+    lines = [
+        '# comment\n',
+        'CCO ethanol\n',
+        'c1ccccc1\tbenzene ring\n',
+        '\n',
+        'N\n',
+    ]
+    assert list(parse_smiles(lines)) == [
+        ('CCO', 'ethanol'),
+        ('c1ccccc1', 'benzene ring'),
+        ('N', ''),
+    ]
+
+
+def test_parse_smiles_stream():
+    contents = b'# comment\nCCO ethanol\n\nN\n'
+    assert list(parse_smiles_stream(io.BytesIO(contents), max_molecules=2,
+                                    max_bytes=len(contents))) == [('CCO', 'ethanol'), ('N', '')]
+
+    with pytest.raises(ValueError, match='1 molecules or less'):
+        list(parse_smiles_stream(io.BytesIO(contents), max_molecules=1))
+    with pytest.raises(ValueError, match='bytes or less'):
+        list(parse_smiles_stream(io.BytesIO(contents), max_bytes=len(contents) - 1))
+    with pytest.raises(ValueError, match='decode'):
+        list(parse_smiles_stream(io.BytesIO(b'CCO \xfa\xfb\n')))
+
+
+def test_parse_smiles_stream_stops_reading_at_limit():
+    stream = io.BytesIO(b'C' * 10**6)  # a single line without line breaks
+    with pytest.raises(ValueError):
+        list(parse_smiles_stream(stream, max_bytes=100))
+    assert stream.tell() == 101
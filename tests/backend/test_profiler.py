@@ -0,0 +1,80 @@
+import os
+import pstats
+
+import pytest
+
+from smartsexplore import create_app
+from smartsexplore.database import SMARTS
+from smartsexplore.profiler import ProfilerMiddleware, init_app, PROFILE_FILE_HEADER
+
+
+@pytest.fixture
+def profiled_client(app, session, tmp_path):
+    session.add(SMARTS(name='smarts', pattern='C', library='test'))
+    session.commit()
+    app.config.update(PROFILER=True, PROFILER_BACKEND='cprofile',
+                      PROFILER_DIR=str(tmp_path / 'profiles'))
+    init_app(app)
+    with app.test_client() as client:
+        yield client
+
+
+def test_profiler_not_installed_by_default(tmp_path):
+    app = create_app({'TESTING': True}, instance_path=str(tmp_path))
+    assert not isinstance(app.wsgi_app, ProfilerMiddleware)
+
+
+def test_profile_triggered_by_header(profiled_client, tmp_path):
+    response = profiled_client.post('/smarts/data', json={'spsim_min': 0, 'spsim_max': 1},
+                                    headers={'X-Profile': '1'})
+    assert response.status_code == 200
+    assert len(response.json['nodes']) == 1
+    filename = response.headers[PROFILE_FILE_HEADER]
+    assert '-POST-smarts.data-' in filename and filename.endswith('.prof')
+
+    stats = pstats.Stats(str(tmp_path / 'profiles' / filename))
+    assert any(function == 'from_db' for _, _, function in stats.stats)
+
+
+def test_profile_triggered_by_query_parameter(profiled_client, tmp_path):
+    response = profiled_client.get('/molecules/matches/counts?molsets=1&profile=true')
+    assert response.status_code == 404
+    assert os.listdir(tmp_path / 'profiles') == [response.headers[PROFILE_FILE_HEADER]]
+
+
+def test_profile_not_triggered(profiled_client, tmp_path):
+    responses = [
+        profiled_client.get('/smarts/data'),
+        profiled_client.get('/smarts/data?profile=0', headers={'X-Profile': 'no'}),
+        # not an allowed client address
+        profiled_client.get('/smarts/data', headers={'X-Profile': '1'},
+                            environ_base={'REMOTE_ADDR': '10.0.0.1'}),
+    ]
+    assert all(response.status_code == 200 for response in responses)
+    assert not any(PROFILE_FILE_HEADER in response.headers for response in responses)
+    assert os.listdir(tmp_path / 'profiles') == []
+
+
+def test_profile_triggered_by_token(app, session, tmp_path):
+    app.config.update(PROFILER=True, PROFILER_BACKEND='cprofile', PROFILER_TOKEN='s3cret',
+                      PROFILER_ALLOWED_ADDRESSES=None, PROFILER_DIR=str(tmp_path / 'profiles'))
+    init_app(app)
+    with app.test_client() as client:
+        untriggered = [
+            client.get('/smarts/data', headers={'X-Profile': '1'}),
+            client.get('/smarts/data?profile=wrong'),
+        ]
+        assert not any(PROFILE_FILE_HEADER in response.headers for response in untriggered)
+
+        # e.g. behind a reverse proxy, which every request comes from
+        response = client.get('/smarts/data', headers={'X-Profile': 's3cret'},
+                              environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        assert PROFILE_FILE_HEADER in response.headers
+        response = client.get('/smarts/data?profile=s3cret')
+        assert PROFILE_FILE_HEADER in response.headers
+
+
+def test_unknown_profiler_backend(app):
+    app.config.update(PROFILER=True, PROFILER_BACKEND='nonexistent')
+    with pytest.raises(ValueError):
+        init_app(app)
@@ -0,0 +1,95 @@
+import io
+
+import pytest
+
+from smartsexplore.database import SMARTS, DirectedEdge, UndirectedEdge, MoleculeSet, \
+    MoleculeSetMatches, Molecule, Match
+from smartsexplore.database.bitmap import MatchBitmap
+
+"""The data sizes each route is checked at; its maximum statement count must hold for all"""
+SIZES = (5, 50, 500)
+
+
+def populate(session, size: int, bitmap: bool = False) -> MoleculeSet:
+    """
+    Adds ``size`` SMARTS with edges between consecutive SMARTS, and a molecule set of ``size``
+    molecules each matching two SMARTS, stored as rows or as a match bitmap.
+    """
+    smartss = [SMARTS(name=f'smarts{i}', pattern='C', library='test') for i in range(size)]
+    molset = MoleculeSet()
+    molecules = [Molecule(name=f'mol{j}', pattern='CC', molset=molset) for j in range(size)]
+    session.add_all(smartss + molecules)
+    session.flush()
+    for low, high in zip(smartss, smartss[1:]):
+        session.add_all([UndirectedEdge(low, high, 0.5, 0.5), DirectedEdge(low, high, 0.5, 0.5)])
+    matches = [(smartss[(j + k) % size], molecule)
+               for j, molecule in enumerate(molecules) for k in range(2)]
+    if bitmap:
+        session.add(MoleculeSetMatches(molset, MatchBitmap.from_matches(
+            [molecule.id for molecule in molecules], [smarts.id for smarts in smartss],
+            [(smarts.id, molecule.id) for smarts, molecule in matches]
+        )))
+    else:
+        session.add_all([Match(molecule=molecule, smarts=smarts) for smarts, molecule in matches])
+    session.commit()
+    return molset
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_graph_data_queries(client, session, count_queries, size):
+    populate(session, size)
+    with count_queries() as queries:
+        response = client.post('/smarts/data', json={'spsim_min': 0, 'spsim_max': 1})
+    assert len(response.json['edges']) == size - 1
+    assert len(queries) <= 2
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('bitmap', (False, True))
+def test_molecule_set_matches_queries(client, session, count_queries, size, bitmap):
+    molset_id = populate(session, size, bitmap=bitmap).id
+    with count_queries() as queries:
+        response = client.get(f'/molecules/matches/{molset_id}')
+    assert len(response.json['matches']) == 2 * size
+    assert len(queries) <= 5
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_molecule_image_queries(client, session, count_queries, size):
+    molset = populate(session, size)
+    molecule_ids = [molecule.id for molecule in molset.molecules]
+    with count_queries() as queries:
+        client.get(f'/molecules/images/{molecule_ids[-1]}')
+    assert len(queries) <= 1
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_molecule_upload_queries(app, client, session, fake_tools, count_queries, monkeypatch,
+                                 size):
+    app.config['MAX_UPLOADED_MOLECULE_NUMBER'] = size
+    # few enough matches for a single bulk insert batch, which hold up to 10000 matches each
+    monkeypatch.setenv('FAKE_MATCHTOOL_MATCH_RATE', str(1 / size))
+    populate(session, size)
+    smiles = ''.join(f'{"C" * (i % 10 + 1)} mol{i}\n' for i in range(size))
+    with count_queries() as queries:
+        response = client.post('/molecules/upload', data={
+            'file': (io.BytesIO(smiles.encode()), 'molecules.smi')
+        })
+    assert response.status_code == 302
+    assert session.query(Molecule).count() == 2 * size
+    assert len(queries) <= 10
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('mode', ('SubsetOfFirst', 'Similarity'))
+def test_calculate_edges_queries(session, fake_tools, count_queries, monkeypatch, size, mode):
+    from smartsexplore.smarts.actions import calculate_edges
+
+    session.add_all([SMARTS(name=f'smarts{i}', pattern='C' * (i + 1), library='test')
+                     for i in range(size)])
+    session.commit()
+    monkeypatch.setenv('FAKE_SMARTSCOMPARE_EDGES', str(2 * size))
+    with count_queries() as queries:
+        calculate_edges(mode)
+    assert session.query(UndirectedEdge if mode == 'Similarity' else DirectedEdge).count() > 0
+    assert len(queries) <= 6
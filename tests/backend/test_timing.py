@@ -0,0 +1,71 @@
+import time
+
+from smartsexplore import create_app
+from smartsexplore.database import SMARTS
+from smartsexplore.timing import RequestTimings, timed, timed_iter
+
+
+def _phases(response):
+    return {entry.split(';dur=')[0]: float(entry.split(';dur=')[1])
+            for entry in response.headers['Server-Timing'].split(', ')}
+
+
+def test_request_timings_are_exclusive():
+    timings = RequestTimings()
+    timings.start('orm')
+    time.sleep(0.02)
+    timings.start('db')
+    time.sleep(0.05)
+    timings.stop('db')
+    timings.stop('orm')
+    assert 0.05 <= timings.durations['db'] < 0.07
+    assert 0.02 <= timings.durations['orm'] < 0.04
+
+
+def test_request_timings_stop_unfinished_nested_phases():
+    timings = RequestTimings()
+    timings.start('orm')
+    timings.start('db')
+    timings.stop('orm')
+    timings.stop('db')  # no longer running, ignored
+    assert timings.stack == []
+    assert set(timings.durations) == {'orm', 'db'}
+    assert timings.header().split(', ')[-1].startswith('total;dur=')
+
+
+def test_timed_outside_request_does_nothing(app):
+    with timed('db'):
+        pass
+    assert list(timed_iter([1, 2], 'subprocess')) == [1, 2]
+
+
+def test_server_timing_header(client, session):
+    session.add_all([SMARTS(name=f'smarts{i}', pattern='C', library='test') for i in range(100)])
+    session.commit()
+
+    response = client.post('/smarts/data', json={'spsim_min': 0, 'spsim_max': 1},
+                           headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    phases = _phases(response)
+    assert {'db', 'orm', 'serialize', 'compress', 'total'} <= set(phases)
+    assert phases['total'] >= sum(duration for phase, duration in phases.items()
+                                  if phase != 'total')
+
+
+def test_server_timing_upload(client, fake_tools, session):
+    import io
+
+    session.add(SMARTS(name='smarts', pattern='C', library='test'))
+    session.commit()
+    response = client.post('/molecules/upload', data={
+        'file': (io.BytesIO(b'CCO ethanol\nCC ethane\n'), 'molecules.smi')
+    })
+    assert response.status_code == 302
+    assert {'db', 'file_io', 'subprocess'} <= set(_phases(response))
+
+
+def test_server_timing_disabled(tmp_path):
+    app = create_app({'DATABASE': 'sqlite:///' + str(tmp_path / 'db.sqlite'),
+                      'SERVER_TIMING': False}, instance_path=str(tmp_path))
+    assert 'Server-Timing' not in app.test_client().get('/').headers
@@ -0,0 +1,126 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from smartsexplore.util import run_process, stream_process, ram_tempfile, recent_process_runs, \
+    RAM_TEMPDIR, _wait_with_rusage, _kill_unless_reaped
+
+
+def _python(code):
+    return [sys.executable, '-c', code]
+
+
+def test_stream_process_yields_stdout_lines():
+    lines = list(stream_process(_python('for i in range(3): print(i)')))
+    assert lines == ['0\n', '1\n', '2\n']
+
+
+def test_stream_process_feeds_stdin_from_generator():
+    def numbers():
+        for i in range(1000):
+            yield f'{i}\n'
+
+    lines = stream_process(
+        _python('import sys\nfor line in sys.stdin: print(int(line) * 2)'),
+        input_lines=numbers()
+    )
+    assert [int(line) for line in lines] == [i * 2 for i in range(1000)]
+
+
+def test_stream_process_raises_on_failure():
+    with pytest.raises(Exception):
+        list(stream_process(_python('import sys; print("partial"); sys.exit(3)')))
+
+    with pytest.raises(FileNotFoundError):
+        list(stream_process(['/this/tool/does/not/exist']))
+
+
+def test_stream_process_kills_on_timeout():
+    with pytest.raises(Exception):
+        list(stream_process(_python('import time; time.sleep(10)'), timeout=0.2))
+
+
+def test_stream_process_kills_when_consumer_stops_early():
+    lines = stream_process(_python('import itertools\nfor i in itertools.count(): print(i)'))
+    assert next(lines) == '0\n'
+    lines.close()  # must not hang
+
+
+def test_run_process_records_resource_usage():
+    process = run_process(_python(
+        'import sys\n'
+        'data = bytearray(64 * 1024 * 1024)\n'
+        'sum(range(2000000))\n'
+        'print("x" * 99); print("err", file=sys.stderr)'
+    ))
+    assert process.returncode == 0
+    assert process.stdout == b'x' * 99 + b'\n'
+    stats = process.stats
+    assert stats.tool == os.path.basename(sys.executable)
+    assert stats.max_rss >= 64 * 1024
+    assert stats.user_time + stats.system_time > 0
+    assert stats.wall_time > 0
+    assert (stats.stdout_bytes, stats.stderr_bytes) == (100, 4)
+    assert recent_process_runs(limit=1) == [stats]
+
+
+def test_run_process_failures():
+    assert run_process(_python('import sys; sys.exit(3)')).returncode == 3
+    assert recent_process_runs(limit=1)[0].returncode == 3
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        run_process(_python('import time; time.sleep(10)'), timeout=0.2, reraise_exceptions=True)
+    assert recent_process_runs(limit=1)[0].returncode < 0
+
+    assert run_process(['/this/tool/does/not/exist']) is None
+    assert recent_process_runs(tool='exist', limit=1)[0].returncode is None
+
+
+def test_exited_process_is_not_killed(monkeypatch):
+    killed = []
+    monkeypatch.setattr(os, 'kill', lambda pid, sig: killed.append(pid))
+    monkeypatch.setattr(subprocess.Popen, 'kill', lambda self: killed.append(self.pid))
+    lock = threading.Lock()
+
+    # a timeout firing after the process exited, but before _wait_with_rusage reaped it
+    process = subprocess.Popen(_python('pass'))
+    if hasattr(os, 'waitid'):
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        assert not _kill_unless_reaped(process, lock)
+    rusage = _wait_with_rusage(process, lock)
+    assert process.returncode == 0
+    assert rusage is None or rusage.ru_maxrss > 0
+
+    # a timeout firing after the process was reaped, when its ID may have been reused
+    assert not _kill_unless_reaped(process, lock)
+    assert killed == []
+
+
+def test_running_process_is_killed():
+    lock = threading.Lock()
+    process = subprocess.Popen(_python('import time; time.sleep(10)'))
+    assert _kill_unless_reaped(process, lock)
+    _wait_with_rusage(process, lock)
+    assert process.returncode < 0
+
+
+def test_stream_process_records_resource_usage():
+    assert len(list(stream_process(_python('for i in range(10): print(i)')))) == 10
+    stats = recent_process_runs(limit=1)[0]
+    assert stats.returncode == 0
+    assert stats.stdout_bytes == 20
+    assert stats.max_rss > 0
+
+
+def test_ram_tempfile():
+    with ram_tempfile(suffix='.smarts') as file:
+        file.write('C\t1\n')
+        file.seek(0)
+        assert file.read() == 'C\t1\n'
+        assert file.name.endswith('.smarts')
+        if os.access(RAM_TEMPDIR, os.W_OK):
+            assert os.path.dirname(file.name) == RAM_TEMPDIR
+    assert not os.path.exists(file.name)
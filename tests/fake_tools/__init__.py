@@ -0,0 +1,63 @@
+"""
+Fake stand-ins for the external NAOMI tools (``SMARTScompare``, ``SMARTSMoleculeMatcher``,
+``SMARTScompareViewer`` and ``mol2svg``), which emit output in the formats the app expects, so
+that the pipelines calling them can be tested and benchmarked end-to-end without the real tools.
+
+Use :func:`install_fake_tools` (or ``python -m tests.fake_tools DIRECTORY``) to write executables
+for the fake tools, and point the app config at them (the ``fake_tools`` pytest fixture does
+both). The behaviour of the fake tools is controlled by environment variables, which are
+inherited by the processes the app starts. Each setting ``X`` is read from ``FAKE_<TOOL>_X``
+(with ``<TOOL>`` being ``SMARTSCOMPARE``, ``MATCHTOOL``, ``SMARTSCOMPARE_VIEWER`` or ``MOL2SVG``),
+falling back to ``FAKE_TOOLS_X`` for all tools:
+
+* ``LATENCY``: Seconds to sleep before producing any output.
+* ``LINE_LATENCY``: Seconds to sleep before each output line, which is flushed immediately.
+* ``FAIL``: The probability (0 to 1) of failing right after starting.
+* ``FAIL_AFTER``: Fail after printing this many output lines.
+* ``EXIT_CODE``: The exit code to fail with (1 by default).
+* ``SEED``: The seed for all pseudo-random decisions (0 by default).
+* ``EDGES`` (SMARTScompare), ``MATCH_RATE`` (SMARTSMoleculeMatcher), ``SVG_BYTES``
+  (SMARTScompareViewer, mol2svg): The output volume, see the modules of the tools.
+"""
+import os
+import stat
+import sys
+from typing import Dict
+
+
+"""The fake tools, as app config key -> (executable name, module name)"""
+TOOLS = {
+    'SMARTSCOMPARE_PATH': ('SMARTScompare', 'smartscompare'),
+    'MATCHTOOL_PATH': ('SMARTSMoleculeMatcher', 'matcher'),
+    'SMARTSCOMPARE_VIEWER_PATH': ('SMARTScompareViewer', 'viewer'),
+    'MOL2SVG_PATH': ('mol2svg', 'mol2svg'),
+}
+
+_EXECUTABLE = '''#!{python}
+import sys
+sys.path.insert(0, {root!r})
+from tests.fake_tools.{module} import main
+sys.exit(main(sys.argv[1:]))
+'''
+
+
+def install_fake_tools(directory: str) -> Dict[str, str]:
+    """
+    Writes executables for all fake tools into a directory, which run with the current Python
+    interpreter.
+
+    :param directory: The directory to write the executables to. Is created if necessary.
+    :returns: A dictionary mapping the app config keys of the tool paths (e.g. MATCHTOOL_PATH) to
+        the paths of the written executables.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.makedirs(directory, exist_ok=True)
+
+    config = {}
+    for config_key, (executable_name, module) in TOOLS.items():
+        path = os.path.join(os.path.abspath(directory), executable_name)
+        with open(path, 'w') as f:
+            f.write(_EXECUTABLE.format(python=sys.executable, root=root, module=module))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        config[config_key] = path
+    return config
@@ -0,0 +1,14 @@
+"""
+Installs the fake tools into a directory, and prints the corresponding app config lines, e.g.
+for an instance ``config.py``: ``python -m tests.fake_tools DIRECTORY``.
+"""
+import sys
+
+from tests.fake_tools import install_fake_tools
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit('Usage: python -m tests.fake_tools DIRECTORY')
+    for config_key, path in install_fake_tools(sys.argv[1]).items():
+        print(f'{config_key} = {path!r}')
@@ -0,0 +1,110 @@
+"""
+Settings, latency and failure injection shared by all fake tools.
+"""
+import os
+import random
+import sys
+import time
+import zlib
+
+
+class FakeTool:
+    """
+    The environment-variable settings of one fake tool, plus helpers to emit output according to
+    them. Each setting ``X`` is read from ``FAKE_<TOOL>_X``, falling back to ``FAKE_TOOLS_X``.
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: The name of the tool in the environment variables, e.g. ``MATCHTOOL``.
+        """
+        """The name of the tool in the environment variables"""
+        self.name = name
+        """The number of output lines written so far"""
+        self.nof_lines = 0
+        """A random number generator, seeded by the SEED setting"""
+        self.rng = random.Random(self.setting('SEED', int, 0))
+
+    def setting(self, key: str, type_=str, default=None):
+        """
+        :returns: The value of the setting ``key``, converted with ``type_``, or ``default`` if
+            it is not set.
+        """
+        for variable in (f'FAKE_{self.name}_{key}', f'FAKE_TOOLS_{key}'):
+            if os.environ.get(variable, '') != '':
+                return type_(os.environ[variable])
+        return default
+
+    def start(self) -> None:
+        """
+        Sleeps for the LATENCY setting (seconds), and fails with the probability given by the
+        FAIL setting (0 to 1), before the tool produces any output.
+        """
+        time.sleep(self.setting('LATENCY', float, 0.))
+        if self.rng.random() < self.setting('FAIL', float, 0.):
+            self.fail('injected failure')
+
+    def fail(self, reason: str) -> None:
+        """Exits with the EXIT_CODE setting (1 by default), after printing ``reason`` to stderr."""
+        sys.stdout.flush()
+        print(f'fake {self.name}: {reason}', file=sys.stderr)
+        sys.exit(self.setting('EXIT_CODE', int, 1))
+
+    def emit(self, line: str) -> None:
+        """
+        Writes one line to stdout, after sleeping for the LINE_LATENCY setting (seconds). Fails
+        instead if FAIL_AFTER lines were already written.
+        """
+        if self.nof_lines == self.setting('FAIL_AFTER', int, -1):
+            self.fail(f'injected failure after {self.nof_lines} lines')
+        line_latency = self.setting('LINE_LATENCY', float, 0.)
+        if line_latency:
+            time.sleep(line_latency)
+            print(line, flush=True)
+        else:
+            print(line)
+        self.nof_lines += 1
+
+    def pair_hit(self, rate: float, *key) -> bool:
+        """
+        :returns: Whether a pair of inputs, identified by ``key``, is "hit" at the given rate.
+            Deterministic for the same key and SEED setting, regardless of the input order.
+        """
+        seed = self.setting('SEED', int, 0)
+        return zlib.crc32(':'.join(map(str, (seed, *key))).encode('utf-8')) < rate * 2**32
+
+    def svg(self, title: str) -> str:
+        """
+        :returns: A fake SVG image showing ``title``, padded with a comment to the SVG_BYTES
+            setting (bytes), if given.
+        """
+        svg = (f'<svg xmlns="http://www.w3.org/2000/svg" width="300" height="300">'
+               f'<title>{title}</title></svg>\n')
+        nof_padding_bytes = self.setting('SVG_BYTES', int, 0) - len(svg) - len('<!---->')
+        if nof_padding_bytes > 0:
+            svg = svg.replace('</svg>', f'<!--{"x" * nof_padding_bytes}--></svg>')
+        return svg
+
+
+def read_labelled_lines(filename: str):
+    """
+    Reads a .smiles or .smarts file with one ``pattern<whitespace>label`` per line, as written
+    by the app for the external tools.
+
+    :returns: A list of (pattern, label) tuples.
+    """
+    with open(filename) as f:
+        return [(parts[0], parts[1].strip() if len(parts) > 1 else '')
+                for parts in (line.split(None, 1) for line in f) if parts]
+
+
+def option(argv, flag: str, nof_values: int = 1, default=None):
+    """
+    :returns: The value (or list of ``nof_values`` values) after ``flag`` in ``argv``, or
+        ``default`` if the flag is not given.
+    """
+    if flag not in argv:
+        return default
+    index = argv.index(flag)
+    values = argv[index + 1:index + 1 + nof_values]
+    return values[0] if nof_values == 1 else values
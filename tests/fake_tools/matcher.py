@@ -0,0 +1,33 @@
+"""
+A fake ``SMARTSMoleculeMatcher``. Matches all molecules of a .smiles file against all SMARTS of a
+.smarts file, and prints the matches in the format parsed by
+:func:`smartsexplore.parsers.parse_moleculematch`.
+
+Usage: ``SMARTSMoleculeMatcher -i 2 -m SMILES_FILE -s SMARTS_FILE``
+
+By default, a SMARTS matches a molecule if the SMARTS pattern is a substring of the molecule
+pattern. Setting FAKE_MATCHTOOL_MATCH_RATE (0 to 1) matches that fraction of all pairs instead,
+pseudo-randomly but deterministically per pair. A molecule with the pattern ``FAIL`` makes the
+matcher fail.
+"""
+from tests.fake_tools._common import FakeTool, read_labelled_lines, option
+
+
+def main(argv):
+    tool = FakeTool('MATCHTOOL')
+    tool.start()
+    molecules = read_labelled_lines(option(argv, '-m'))
+    smartss = read_labelled_lines(option(argv, '-s'))
+    match_rate = tool.setting('MATCH_RATE', float)
+
+    for molecule_pattern, molecule_label in molecules:
+        if molecule_pattern == 'FAIL':
+            tool.fail(f'cannot parse molecule {molecule_label}')
+        for smarts_pattern, smarts_label in smartss:
+            if match_rate is not None:
+                matches = tool.pair_hit(match_rate, smarts_label, molecule_label)
+            else:
+                matches = smarts_pattern in molecule_pattern
+            if matches:
+                tool.emit(f'{smarts_label}\t{molecule_label}')
+    return 0
@@ -0,0 +1,29 @@
+"""
+A fake ``mol2svg``. Writes an SVG image per molecule of a .smiles file, named by the output file
+name suffixed with the zero-filled line number (e.g. ``img_01.svg``, ``img_02.svg``, ...).
+
+Usage: ``mol2svg -i SMILES_FILE -o OUTPUT_FILE [-a] [-P]``
+
+Only draws the first molecule unless ``-a`` is given. The size of the written images can be set
+with FAKE_MOL2SVG_SVG_BYTES. A molecule with the pattern ``FAIL`` makes mol2svg fail.
+"""
+import os
+
+from tests.fake_tools._common import FakeTool, read_labelled_lines, option
+
+
+def main(argv):
+    tool = FakeTool('MOL2SVG')
+    tool.start()
+    molecules = read_labelled_lines(option(argv, '-i'))
+    if '-a' not in argv:
+        molecules = molecules[:1]
+    stem, extension = os.path.splitext(option(argv, '-o'))
+    width = len(str(len(molecules)))
+
+    for line_no, (pattern, label) in enumerate(molecules, start=1):
+        if pattern == 'FAIL':
+            tool.fail(f'cannot parse molecule {label}')
+        with open(f'{stem}_{line_no:0{width}d}{extension}', 'w') as f:
+            f.write(tool.svg(pattern.replace('&', '&amp;').replace('<', '&lt;')))
+    return 0
@@ -0,0 +1,65 @@
+"""
+A fake ``SMARTScompare``. Compares all SMARTS of a .smarts file pairwise, and prints the pairs in
+the format parsed by :func:`smartsexplore.parsers.parse_smartscompare`.
+
+Usage: ``SMARTScompare SMARTS_FILE [-t THRESHOLD] [-d DELIM] [-D DELIM] [-m MODE_ID] ...``
+
+By default, a pair is printed if the pattern of the right SMARTS is a substring of the pattern of
+the left one (mode SubsetOfFirst), or if their similarity exceeds the threshold (mode
+Similarity). Setting FAKE_SMARTSCOMPARE_EDGES prints that many distinct pairs instead (as far as
+there are enough SMARTS), regardless of the patterns. Similarities are pseudo-random but
+deterministic per pair.
+"""
+import itertools
+import zlib
+
+from tests.fake_tools._common import FakeTool, read_labelled_lines, option
+
+
+MODES = {1: 'Identical', 2: 'SubsetOfFirst', 3: 'SubsetOfSecond', 4: 'Similarity'}
+
+
+def _similarities(left_label: str, right_label: str, threshold: float):
+    """:returns: A deterministic (MCS similarity, SP similarity > threshold) of a pair."""
+    key = f'{min(left_label, right_label)}:{max(left_label, right_label)}'.encode('utf-8')
+    mcssim = (zlib.crc32(key) % 1000) / 1000
+    spsim = threshold + (1 - threshold) * ((zlib.crc32(key[::-1]) % 999) + 1) / 1000
+    return round(mcssim, 3), round(spsim, 3)
+
+
+def _pairs(smartss, mode: str, threshold: float, nof_edges=None):
+    """Yields the (left index, right index) pairs to print."""
+    if nof_edges is not None:
+        pairs = itertools.combinations if mode == 'Similarity' else itertools.permutations
+        yield from itertools.islice(pairs(range(len(smartss)), 2), nof_edges)
+        return
+    for left, (left_pattern, left_label) in enumerate(smartss):
+        for right, (right_pattern, right_label) in enumerate(smartss):
+            if mode == 'Similarity':
+                if left < right and \
+                        _similarities(left_label, right_label, 0.)[1] > threshold:
+                    yield left, right
+            elif left != right and right_pattern in left_pattern:
+                yield left, right
+
+
+def main(argv):
+    tool = FakeTool('SMARTSCOMPARE')
+    tool.start()
+    smartss = read_labelled_lines(argv[0])
+    mode = MODES[int(option(argv, '-m', default='4'))]
+    threshold = float(option(argv, '-t', default='0'))
+    delimiter, inner_delimiter = option(argv, '-d', default='|'), option(argv, '-D', default='`')
+
+    tool.emit(f'SMARTScompare (fake) on {len(smartss)} SMARTS')
+    tool.emit('')
+    tool.emit(f"Comparison mode: '{mode}'")
+    for left, right in _pairs(smartss, mode, threshold, tool.setting('EDGES', int)):
+        (left_pattern, left_label), (right_pattern, right_label) = smartss[left], smartss[right]
+        mcssim, spsim = _similarities(left_label, right_label,
+                                      threshold if tool.setting('EDGES', int) else 0.)
+        flags = ',sub' if mode == 'SubsetOfFirst' else ''
+        tool.emit(f'{left_pattern}{inner_delimiter}({left_label}){delimiter}'
+                  f'({mcssim},{spsim}{flags}){inner_delimiter}'
+                  f'{right_pattern}{inner_delimiter}({right_label})')
+    return 0
@@ -0,0 +1,19 @@
+"""
+A fake ``SMARTScompareViewer``. Writes an SVG image of one SMARTS, or of a pair of SMARTS.
+
+Usage: ``SMARTScompareViewer [-p ...] [-d ...] -o OUTPUT_FILE -s PATTERN [PATTERN] [-m3]``
+
+The size of the written images can be set with FAKE_SMARTSCOMPARE_VIEWER_SVG_BYTES.
+"""
+from tests.fake_tools._common import FakeTool, option
+
+
+def main(argv):
+    tool = FakeTool('SMARTSCOMPARE_VIEWER')
+    tool.start()
+    output_filename = option(argv, '-o')
+    patterns = option(argv, '-s', nof_values=2 if '-m3' in argv else 1)
+    title = ' | '.join(patterns) if isinstance(patterns, list) else patterns
+    with open(output_filename, 'w') as f:
+        f.write(tool.svg(title.replace('&', '&amp;').replace('<', '&lt;')))
+    return 0
@@ -0,0 +1,57 @@
+import { ImageCache, MAX_BATCH_SIZE, svgDataURL } from '../../smartsexplore/frontend/images'
+
+const singleURL = (id) => `/images/${id}`;
+
+beforeEach(() => {
+    fetch.resetMocks();
+});
+
+test('ImageCache falls back to single image URLs for uncached images', () => {
+    const cache = new ImageCache(singleURL, '/images/batch');
+    expect(cache.url(3)).toEqual('/images/3');
+
+    cache.add({ '3': '<svg>3</svg>' });
+    expect(cache.url(3)).toEqual(svgDataURL('<svg>3</svg>'));
+    expect(cache.url(4)).toEqual('/images/4');
+});
+
+test('ImageCache prefetches uncached images in batches', async () => {
+    const cache = new ImageCache(singleURL, '/images/batch');
+    const ids = [...Array(MAX_BATCH_SIZE + 1).keys()];
+    fetch.mockResponse(async (request) => {
+        const requested = new URL(request.url, 'http://localhost').searchParams.get('ids');
+        const images = {};
+        requested.split(',').forEach((id) => { images[id] = `<svg>${id}</svg>`; });
+        return JSON.stringify({ images, missing: [] });
+    });
+
+    await cache.prefetch(ids);
+    expect(fetch.mock.calls.length).toEqual(2);
+    expect(cache.url(MAX_BATCH_SIZE)).toEqual(svgDataURL(`<svg>${MAX_BATCH_SIZE}</svg>`));
+
+    // cached (or requested) images are not requested again
+    await cache.prefetch([0, '1', MAX_BATCH_SIZE]);
+    expect(fetch.mock.calls.length).toEqual(2);
+});
+
+test('ImageCache requests images of failed batch requests again', async () => {
+    const cache = new ImageCache(singleURL, '/images/batch');
+    fetch.mockResponseOnce('', { status: 400 });
+    await cache.prefetch([1, 2]);
+    expect(cache.url(1)).toEqual('/images/1');
+
+    fetch.mockResponseOnce(JSON.stringify({ images: { '1': '<svg>1</svg>' }, missing: [2] }));
+    await cache.prefetch([1, 2]);
+    expect(fetch.mock.calls.length).toEqual(2);
+    expect(cache.url(1)).toEqual(svgDataURL('<svg>1</svg>'));
+    expect(cache.url(2)).toEqual('/images/2');
+});
+
+test('ImageCache caches all images of a bundle', async () => {
+    const cache = new ImageCache(singleURL);
+    fetch.mockResponseOnce(JSON.stringify({ '7': '<svg>7</svg>', '8': '<svg>8</svg>' }));
+    await cache.fetchBundle('/images/set/1');
+    expect(fetch.mock.calls[0][0]).toEqual('/images/set/1');
+    expect(cache.url(7)).toEqual(svgDataURL('<svg>7</svg>'));
+    expect(cache.url(8)).toEqual(svgDataURL('<svg>8</svg>'));
+});